@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+
+#############################################################################
+# NOTICE                                                                    #
+#                                                                           #
+# This software (or technical data) was produced for the U.S. Government    #
+# under contract, and is subject to the Rights in Data-General Clause       #
+# 52.227-14, Alt. IV (DEC 2007).                                            #
+#                                                                           #
+# Copyright 2024 The MITRE Corporation. All Rights Reserved.                #
+#############################################################################
+
+#############################################################################
+# Copyright 2024 The MITRE Corporation                                      #
+#                                                                           #
+# Licensed under the Apache License, Version 2.0 (the "License");           #
+# you may not use this file except in compliance with the License.          #
+# You may obtain a copy of the License at                                   #
+#                                                                           #
+#    http://www.apache.org/licenses/LICENSE-2.0                             #
+#                                                                           #
+# Unless required by applicable law or agreed to in writing, software       #
+# distributed under the License is distributed on an "AS IS" BASIS,         #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  #
+# See the License for the specific language governing permissions and       #
+# limitations under the License.                                            #
+#############################################################################
+
+"""
+Benchmarks build_components.py without real compilers. A synthetic tree of C++, Java, and Python
+components is generated, and shim cmake3, make, mvn, and python3.12 executables that sleep for a
+randomly drawn time and write plugin packages are put at the front of PATH. The python3.12 shim
+also creates venvs and simulates "pip wheel", "pip install", and "pip download", so packaging the
+pyproject.toml based Python components exercises the SDK venv snapshot, the reused build
+environments, and the wheel cache. Then component location, a full parallel build, a build where
+every component is up to date, packaging, and cleaning are each timed. The results are written to
+a JSON file, and can be compared to the results of a previous run with --compare.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import unittest.mock
+
+import build_components
+
+
+
+def main():
+    args = parse_args()
+    results = run_benchmarks(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print_results(results)
+    print('Results written to:', args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+
+def parse_args(arg_strings=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks build_components.py using a synthetic component tree and shim '
+                    'build tools.')
+    parser.add_argument('--cpp-components', type=int, default=8, metavar='<count>')
+    parser.add_argument('--java-components', type=int, default=8, metavar='<count>')
+    parser.add_argument('--python-components', type=int, default=8, metavar='<count>')
+    parser.add_argument('--files-per-component', type=int, default=50, metavar='<count>')
+    parser.add_argument('--file-size', type=build_components.parse_size, default='16K',
+                        metavar='<size>', help='Size of each generated source file.')
+    parser.add_argument('--package-size', type=build_components.parse_size, default='1M',
+                        metavar='<size>',
+                        help='Size of the plugin packages the shim make and mvn commands write.')
+    parser.add_argument('-p', '--parallel', type=int, default=4, metavar='<num_builds>')
+    parser.add_argument('--time-scale', type=float, default=0.01, metavar='<factor>',
+                        help='Multiplier applied to the realistic durations of the shim '
+                             'commands, e.g. 1 makes a C++ build take minutes. Defaults to 0.01.')
+    parser.add_argument('--repeat', type=int, default=3, metavar='<count>',
+                        help='Number of times each benchmark is run.')
+    parser.add_argument('--seed', type=int, default=0, metavar='<seed>')
+    parser.add_argument('--work-dir', metavar='<dir>',
+                        help='Directory for the synthetic tree and build directory. Defaults to a '
+                             'temporary directory that is deleted afterwards.')
+    parser.add_argument('-o', '--output', default='build-benchmark-results.json', metavar='<path>')
+    parser.add_argument('--compare', metavar='<previous_results>',
+                        help='JSON results from a previous run to compare against.')
+    return parser.parse_args(arg_strings)
+
+
+
+def run_benchmarks(args):
+    with contextlib.ExitStack() as stack:
+        if args.work_dir:
+            work_dir = os.path.abspath(args.work_dir)
+            os.makedirs(work_dir, exist_ok=True)
+        else:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory())
+
+        rng = random.Random(args.seed)
+        components_dir = os.path.join(work_dir, 'components')
+        component_dirs = create_component_tree(components_dir, args, rng)
+        shim_dir = create_shims(os.path.join(work_dir, 'shims'))
+        stack.enter_context(unittest.mock.patch.dict(os.environ, {
+            'PATH': shim_dir + os.pathsep + os.environ.get('PATH', ''),
+            'MPF_SDK_INSTALL_PATH': os.path.join(work_dir, 'sdk-install'),
+            'MPF_BENCHMARK_TIME_SCALE': str(args.time_scale),
+            'MPF_BENCHMARK_PACKAGE_SIZE': str(args.package_size),
+            'MPF_BENCHMARK_SEED': str(args.seed)}))
+        python_sdk_dir = os.path.join(work_dir, 'sdk-install', 'python')
+        os.makedirs(os.path.join(python_sdk_dir, 'wheelhouse'), exist_ok=True)
+        build_dir = os.path.join(work_dir, 'build')
+        # The components are found through the component search path, which is what the saved
+        # component index speeds up.
+        build_args = ['-b', build_dir, '-p', str(args.parallel), '-cp', components_dir,
+                      '-c', ':'.join(os.path.basename(d) for d in component_dirs),
+                      '--venv-snapshot-dir', os.path.join(work_dir, 'venv-snapshots')]
+        log_path = os.path.join(work_dir, 'benchmark-output.log')
+
+        timings = {name: [] for name in ('locate_cold', 'locate_warm', 'build_cold',
+                                         'build_up_to_date', 'clean')}
+        packaging = []
+        shutil.rmtree(build_dir, ignore_errors=True)
+        for _ in range(args.repeat):
+            with redirected_output(log_path):
+                cmdline_args = build_components.MpfArgumentParser.parse(build_args)
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(build_dir, build_components.ComponentIndex.FILE_NAME))
+                timings['locate_cold'].append(time_call(
+                    build_components.ComponentLocator.locate, cmdline_args))
+                timings['locate_warm'].append(time_call(
+                    build_components.ComponentLocator.locate, cmdline_args))
+                components = build_components.ComponentLocator.locate(cmdline_args)
+
+                # The SDK venv is removed so that every repetition after the first restores it
+                # from the snapshot. Like the build history, the wheel cache and the build
+                # environments are kept.
+                shutil.rmtree(os.path.join(python_sdk_dir, 'venv'), ignore_errors=True)
+                build_components.PipUtil._get_python_executable.cache_clear()
+                # Cleaning keeps the build history, so every repetition after the first orders
+                # builds by critical path using the recorded durations.
+                timings['build_cold'].append(time_call(
+                    build_components.ProjectBuilder.build_projects, [], components, cmdline_args))
+                timings['build_up_to_date'].append(time_call(
+                    build_components.ProjectBuilder.build_projects, [], components, cmdline_args))
+                packaging.append(time_packaging(
+                    [c for c in components if isinstance(c, build_components.PythonComponent)],
+                    os.path.join(work_dir, 'packaging'), cmdline_args.compression_level))
+                timings['clean'].append(time_call(
+                    build_components.clean, build_dir, components))
+
+        results = {name: summarize(samples) for name, samples in timings.items()}
+        total_bytes = packaging[0][1]
+        results['packaging'] = summarize([seconds for seconds, _ in packaging])
+        results['packaging']['bytes'] = total_bytes
+        results['packaging']['mb_per_second'] = (
+            total_bytes / 1024 ** 2 / results['packaging']['median']
+            if results['packaging']['median'] else None)
+        return {
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'host': {'python': platform.python_version(), 'platform': platform.platform(),
+                     'cpus': os.cpu_count()},
+            'parameters': {k: v for k, v in vars(args).items()
+                           if k not in ('output', 'compare', 'work_dir')},
+            'results': results
+        }
+
+
+@contextlib.contextmanager
+def redirected_output(log_path):
+    """
+    Sends the output of build_components.py, including the output of subprocesses that inherit
+    the standard output file descriptor, to log_path.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = [os.dup(1), os.dup(2)]
+    try:
+        with open(log_path, 'a') as log:
+            os.dup2(log.fileno(), 1)
+            os.dup2(log.fileno(), 2)
+            with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+                yield
+            log.flush()
+    except SystemExit as err:
+        raise SystemExit('Benchmark build failed: %s. See %s' % (err.code, log_path))
+    finally:
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+        for fd in saved_fds:
+            os.close(fd)
+
+
+def time_call(func, *args):
+    start_time = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start_time
+
+
+def time_packaging(python_components, output_dir, compression_level):
+    """ :return: Tuple containing the seconds taken and the number of bytes packaged. """
+    total_bytes = 0
+    for component in python_components:
+        for root, _, files in os.walk(component.src_dir):
+            total_bytes += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+    start_time = time.perf_counter()
+    for component in python_components:
+        build_components.Files.tar_directory(component.src_dir, output_dir, compression_level)
+    return time.perf_counter() - start_time, total_bytes
+
+
+def summarize(samples):
+    return {
+        'samples': samples,
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.mean(samples)
+    }
+
+
+
+def create_component_tree(components_dir, args, rng):
+    """ :return: The source directories of the generated components. """
+    shutil.rmtree(components_dir, ignore_errors=True)
+    component_dirs = []
+    for lang, count in (('cpp', args.cpp_components), ('java', args.java_components),
+                        ('python', args.python_components)):
+        for i in range(count):
+            component_dir = os.path.join(components_dir, lang, 'Benchmark%s%s' % (lang.title(), i))
+            create_component(component_dir, lang, args.files_per_component, args.file_size, rng)
+            component_dirs.append(component_dir)
+    return component_dirs
+
+
+def create_component(component_dir, lang, num_files, file_size, rng):
+    name = os.path.basename(component_dir)
+    # Python projects keep their descriptor in plugin-files, which is copied in to the package.
+    descriptor_dir = os.path.join(component_dir, *(
+        ('plugin-files', 'descriptor') if lang == 'python' else ('descriptor',)))
+    os.makedirs(descriptor_dir)
+    with open(os.path.join(descriptor_dir, 'descriptor.json'), 'w') as f:
+        json.dump({'componentName': name, 'sourceLanguage': lang}, f)
+
+    if lang == 'cpp':
+        write_file(os.path.join(component_dir, 'CMakeLists.txt'), 'project(%s)\n' % name)
+        source_dir, extension = os.path.join(component_dir, 'src'), '.cpp'
+    elif lang == 'java':
+        write_file(os.path.join(component_dir, 'pom.xml'),
+                   '<project><artifactId>%s</artifactId></project>\n' % name)
+        source_dir, extension = os.path.join(component_dir, 'src', 'main', 'java'), '.java'
+    else:
+        write_file(os.path.join(component_dir, 'pyproject.toml'),
+                   _PYPROJECT_TEMPLATE % (name, rng.randrange(_NUM_PYTHON_DEPENDENCIES)))
+        source_dir, extension = os.path.join(component_dir, name), '.py'
+
+    os.makedirs(source_dir)
+    for i in range(num_files):
+        # Half the files are in subdirectories so the trees have some depth.
+        file_dir = os.path.join(source_dir, 'module%s' % (i % 4)) if i % 2 else source_dir
+        os.makedirs(file_dir, exist_ok=True)
+        write_file(os.path.join(file_dir, 'source%s%s' % (i, extension)),
+                   generate_source_text(file_size, rng))
+
+
+# The Python components share a small set of dependencies, so most of them are found in the
+# wheel cache.
+_NUM_PYTHON_DEPENDENCIES = 3
+
+_PYPROJECT_TEMPLATE = '''[build-system]
+requires = ["setuptools", "wheel"]
+build-backend = "setuptools.build_meta"
+
+[project]
+name = "%s"
+version = "0.0.0"
+dependencies = ["benchmark_dependency_%s"]
+'''
+
+
+_WORDS = ('int', 'return', 'if', 'else', 'for', 'while', 'value', 'result', 'detection', 'frame',
+          'track', 'confidence', 'property', 'config', 'model', 'image', 'video', '=', '+', '(',
+          ')', '{', '}', ';', '0', '1', 'nullptr', 'self', 'std::vector', 'String')
+
+def generate_source_text(size, rng):
+    """ Generates text that compresses about as well as source code does. """
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(_WORDS) if rng.random() < 0.8 else '%x' % rng.getrandbits(32)
+        words.append(word)
+        length += len(word) + 1
+        if len(words) % 12 == 0:
+            words.append('\n')
+    return ' '.join(words)[:size]
+
+
+def write_file(path, contents):
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+
+def create_shims(shim_dir):
+    """ :return: shim_dir, which contains the shim executables. """
+    os.makedirs(shim_dir, exist_ok=True)
+    for name in ('cmake3', 'make', 'mvn', 'python3.12'):
+        path = os.path.join(shim_dir, name)
+        write_file(path, '#!%s\n%s' % (sys.executable, _SHIM_SOURCE))
+        os.chmod(path, 0o755)
+    return shim_dir
+
+
+# Each shim sleeps for a duration drawn from a log-normal distribution, which is how build times
+# are typically distributed: most builds take about the median time, and a few take much longer.
+# The draw is seeded by the command and the working directory or project, so each project takes
+# the same time on every run. The medians are in seconds, before MPF_BENCHMARK_TIME_SCALE is
+# applied.
+_SHIM_SOURCE = r'''
+import glob
+import hashlib
+import os
+import random
+import re
+import shutil
+import sys
+import tarfile
+import time
+import zipfile
+
+# (median seconds, sigma)
+TIMINGS = {
+    'cmake3 configure': (20, 0.4),
+    'cmake3 build': (240, 0.8),
+    'make': (240, 0.8),
+    'mvn': (90, 0.5),
+    'python3.12 -m venv': (4, 0.3),
+    'pip install': (8, 0.5),
+    'pip wheel': (10, 0.5),
+    'pip download': (3, 0.5),
+}
+
+# Options that take a value, for the pip subcommands the shim supports.
+PIP_VALUE_OPTIONS = ('-w', '--wheel-dir', '-f', '--find-links', '-d', '--dest')
+
+
+def main():
+    tool = os.path.basename(sys.argv[0])
+    args = sys.argv[1:]
+    if '--version' in args:
+        print('%s version 0.0.0 (benchmark shim)' % tool)
+        return
+    if tool == 'cmake3' and '--build' in args:
+        sleep('cmake3 build')
+        write_package(read_cmake_home_directory())
+    elif tool == 'cmake3':
+        sleep('cmake3 configure')
+        configure(args)
+    elif tool == 'make':
+        sleep('make')
+        write_package(read_cmake_home_directory())
+    elif tool == 'mvn':
+        sleep('mvn')
+        if 'package' in args or 'install' in args:
+            write_package(os.getcwd(), os.path.join(os.getcwd(), 'target'))
+    elif tool == 'python3.12' and args[:2] == ['-m', 'venv']:
+        create_venv(args[2])
+    elif tool == 'python3.12' and args[:2] == ['-m', 'pip'] and len(args) > 2:
+        run_pip(args[2], args[3:])
+    elif tool == 'python3.12' and args[:1] == ['-c']:
+        # Only used to check that a venv works, by printing sys.prefix.
+        print(get_prefix())
+    else:
+        sys.exit('The benchmark %s shim does not support: %s' % (tool, ' '.join(args)))
+
+
+def sleep(timing_name, key=None):
+    median, sigma = TIMINGS[timing_name]
+    seed = '%s %s %s' % (os.getenv('MPF_BENCHMARK_SEED'), timing_name, key or os.getcwd())
+    rng = random.Random(hashlib.sha256(seed.encode()).digest())
+    duration = rng.lognormvariate(0, sigma) * median
+    time.sleep(duration * float(os.getenv('MPF_BENCHMARK_TIME_SCALE', '0.01')))
+
+
+def create_venv(venv_dir):
+    sleep('python3.12 -m venv', os.path.basename(venv_dir))
+    bin_dir = os.path.join(venv_dir, 'bin')
+    os.makedirs(bin_dir)
+    with open(os.path.join(venv_dir, 'pyvenv.cfg'), 'w') as f:
+        f.write('home = %s\nversion = 3.12.0\n' % os.path.dirname(os.path.abspath(sys.argv[0])))
+    shutil.copy2(sys.argv[0], os.path.join(bin_dir, 'python3.12'))
+    for name in ('python', 'python3'):
+        os.symlink('python3.12', os.path.join(bin_dir, name))
+
+
+def get_prefix():
+    venv_dir = os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0])))
+    if os.path.exists(os.path.join(venv_dir, 'pyvenv.cfg')):
+        return venv_dir
+    return sys.prefix
+
+
+def run_pip(command, args):
+    options = {}
+    requirements = []
+    arg_iter = iter(args)
+    for arg in arg_iter:
+        if arg in PIP_VALUE_OPTIONS:
+            options.setdefault(arg.lstrip('-')[0], []).append(next(arg_iter))
+        elif not arg.startswith('-'):
+            requirements.append(arg)
+
+    if command == 'install':
+        sleep('pip install', ' '.join(requirements))
+        print('Successfully installed', ' '.join(requirements))
+        return
+    if command not in ('wheel', 'download'):
+        sys.exit('The benchmark pip shim does not support: pip %s' % command)
+
+    wheel_dir = (options.get('w') or options.get('d') or ['.'])[0]
+    os.makedirs(wheel_dir, exist_ok=True)
+    dependencies = []
+    for requirement in requirements:
+        if requirement.endswith('.whl'):
+            shutil.copy(requirement, wheel_dir)
+            dependencies.extend(read_wheel_dependencies(requirement))
+        elif os.path.isdir(requirement):
+            sleep('pip wheel', requirement)
+            name, project_dependencies = read_pyproject(requirement)
+            write_wheel(wheel_dir, name, project_dependencies)
+            dependencies.extend(project_dependencies)
+        else:
+            dependencies.append(requirement)
+    if '--no-deps' in args:
+        return
+    for dependency in dependencies:
+        found = [w for links_dir in options.get('f', ())
+                 for w in glob.glob(os.path.join(links_dir, dependency + '-*.whl'))]
+        if found:
+            print('Processing', found[0])
+            shutil.copy(found[0], wheel_dir)
+        else:
+            print('Collecting', dependency)
+            sleep('pip download', dependency)
+            write_wheel(wheel_dir, dependency, [])
+
+
+def read_pyproject(src_dir):
+    with open(os.path.join(src_dir, 'pyproject.toml')) as f:
+        pyproject = f.read()
+    name = re.search(r'^name = "(.*)"$', pyproject, re.M).group(1)
+    dependencies = re.search(r'^dependencies = \[(.*)\]$', pyproject, re.M)
+    return name, re.findall(r'"([^"]+)"', dependencies.group(1)) if dependencies else []
+
+
+def write_wheel(wheel_dir, name, dependencies):
+    dist_info = '%s-0.0.0.dist-info' % name
+    metadata = 'Metadata-Version: 2.1\nName: %s\nVersion: 0.0.0\n' % name
+    metadata += ''.join('Requires-Dist: %s\n' % d for d in dependencies)
+    wheel_path = os.path.join(wheel_dir, '%s-0.0.0-py3-none-any.whl' % name)
+    with zipfile.ZipFile(wheel_path, 'w') as wheel:
+        wheel.writestr(os.path.join(name, 'payload.bin'),
+                       os.urandom(int(os.getenv('MPF_BENCHMARK_PACKAGE_SIZE', '1048576'))))
+        wheel.writestr(os.path.join(dist_info, 'METADATA'), metadata)
+
+
+def read_wheel_dependencies(wheel_path):
+    with zipfile.ZipFile(wheel_path) as wheel:
+        metadata_name = next(n for n in wheel.namelist() if n.endswith('.dist-info/METADATA'))
+        metadata = wheel.read(metadata_name).decode()
+    return re.findall(r'^Requires-Dist: (.*)$', metadata, re.M)
+
+
+def configure(args):
+    generator = args[args.index('-G') + 1]
+    src_dir = args[-1]
+    cache_lines = ['CMAKE_GENERATOR:INTERNAL=' + generator,
+                   'CMAKE_HOME_DIRECTORY:INTERNAL=' + src_dir]
+    cache_lines.extend(a[2:] for a in args if a.startswith('-D'))
+    with open('CMakeCache.txt', 'w') as f:
+        f.write('\n'.join(cache_lines) + '\n')
+    os.makedirs('CMakeFiles', exist_ok=True)
+    with open(os.path.join('CMakeFiles', 'Makefile.cmake'), 'w') as f:
+        f.write('set(CMAKE_MAKEFILE_DEPENDS\n  "%s/CMakeLists.txt"\n)\n' % src_dir)
+    generator_file = 'build.ninja' if generator == 'Ninja' else 'Makefile'
+    with open(generator_file, 'w') as f:
+        f.write('# Generated by the benchmark cmake3 shim.\n')
+    open(os.path.join('CMakeFiles', 'cmake.check_cache'), 'w').close()
+
+
+def read_cmake_home_directory():
+    with open('CMakeCache.txt') as f:
+        return re.search(r'^CMAKE_HOME_DIRECTORY:INTERNAL=(.*)$', f.read(), re.M).group(1)
+
+
+def write_package(src_dir, output_dir='.'):
+    name = os.path.basename(src_dir.rstrip('/'))
+    package_dir = os.path.join(output_dir, 'plugin-packages')
+    os.makedirs(package_dir, exist_ok=True)
+    payload_path = os.path.join(package_dir, name + '.bin')
+    with open(payload_path, 'wb') as f:
+        f.write(os.urandom(int(os.getenv('MPF_BENCHMARK_PACKAGE_SIZE', '1048576'))))
+    with tarfile.open(os.path.join(package_dir, name + '.tar.gz'), 'w:gz',
+                      compresslevel=1) as tar:
+        tar.add(payload_path, arcname=os.path.join(name, 'plugin-files', name + '.bin'))
+    os.remove(payload_path)
+
+
+main()
+'''
+
+
+
+def print_results(results):
+    print('%-20s %10s %10s %10s' % ('Benchmark', 'min (s)', 'median (s)', 'mean (s)'))
+    for name, result in results['results'].items():
+        print('%-20s %10.3f %10.3f %10.3f' % (name, result['min'], result['median'],
+                                              result['mean']))
+    mb_per_second = results['results']['packaging']['mb_per_second']
+    if mb_per_second:
+        print('Packaging throughput: %.1f MB/s' % mb_per_second)
+
+
+def print_comparison(previous_results, results):
+    if previous_results['parameters'] != results['parameters']:
+        print('Warning: The previous results were produced with different parameters.')
+    print('%-20s %15s %15s %10s' % ('Benchmark', 'previous (s)', 'current (s)', 'change'))
+    for name, result in results['results'].items():
+        previous = previous_results['results'].get(name)
+        if not previous:
+            continue
+        change = ('%+9.1f%%' % (100 * (result['median'] / previous['median'] - 1))
+                  if previous['median'] else '         -')
+        print('%-20s %15.3f %15.3f %s' % (name, previous['median'], result['median'], change))
+
+
+
+if __name__ == '__main__':
+    main()
@@ -28,29 +28,66 @@
 
 import abc
 import argparse
+import collections
+import concurrent.futures
 import contextlib
+import ctypes
+import ctypes.util
+import errno
+import fcntl
 import functools
 import glob
+import hashlib
+import heapq
+import hmac
+import http.server
+import io
 import json
 import multiprocessing
+import multiprocessing.connection
 import multiprocessing.pool
 import os
 import pathlib
+import queue
+import re
+import resource
+import select
 import shutil
+import signal
+import struct
 import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree
+import zipfile
+import zlib
+
+try:
+    import tomllib  # Added in Python 3.11
+except ImportError:
+    tomllib = None
 
 
 def main():
+    if sys.argv[1:2] == ['worker']:
+        BuildWorker.main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['cache-server']:
+        RemoteCacheServer.main(sys.argv[2:])
+        return
     cmdline_args = MpfArgumentParser.parse()
     print_argument_warnings(cmdline_args)
     sdks = get_sdks(cmdline_args)
     components = ComponentLocator.locate(cmdline_args)
 
     if cmdline_args.clean or cmdline_args.clean_only:
-        clean(cmdline_args.build_dir, sdks + components)
+        clean(cmdline_args.build_dir, sdks + components, cmdline_args.native_clean)
 
     if not cmdline_args.clean_only:
         ProjectBuilder.build_projects(sdks, components, cmdline_args)
@@ -70,12 +107,29 @@ def print_argument_warnings(cmdline_args):
     if cmdline_args.mpf_package_json and cmdline_args.components:
         print_warning('Both a JSON package file and a component list was specified. Only components from the JSON'
                       ' package file will be built.')
-    if not cmdline_args.mpf_package_json and not cmdline_args.components:
+    if not cmdline_args.mpf_package_json and not cmdline_args.components \
+            and not cmdline_args.discover_components:
         print_warning('No components specified.')
+    if cmdline_args.admission_control and cmdline_args.workers:
+        print_warning('--admission-control does not know which builds will run on --workers, so '
+                      'it assumes every build uses local memory.')
+    if cmdline_args.jobserver and cmdline_args.jobs != 1:
+        print_warning('Both --jobserver and -j were specified. -j will be ignored, and the number '
+                      'of jobs will only be limited by --jobserver.')
+
 
 
+def clean(base_build_dir, projects, native_clean=False):
+    start_time = time.monotonic()
+    BuildManifest.delete(base_build_dir)
+    PackageStore(base_build_dir).delete()
+
+    if not native_clean:
+        bytes_freed = FastClean.delete(FastClean.get_output_paths(base_build_dir, projects))
+        print('Clean freed %s in %.1f seconds.' % (format_size(bytes_freed),
+                                                   time.monotonic() - start_time))
+        return
 
-def clean(base_build_dir, projects):
     for base_package in Files.list_component_packages(base_build_dir):
         print('Deleting', base_package)
         os.remove(base_package)
@@ -85,6 +139,87 @@ def clean(base_build_dir, projects):
 
     for project in projects:
         MavenUtil.clean(project.src_dir)
+    print('Clean took %.1f seconds.' % (time.monotonic() - start_time))
+
+
+
+class FastClean(object):
+    """
+    Cleans by deleting build outputs directly, instead of running "make clean" and "mvn clean",
+    which each start a subprocess, and in Maven's case a JVM, just to delete files. Directories
+    are deleted by a thread pool, one task per directory entry, so that large trees like the C++
+    SDK's build directory are deleted in parallel.
+    """
+
+    @staticmethod
+    def get_output_paths(base_build_dir, projects):
+        """
+        :return: The CMake build directories, the Maven target directories, and the plugin
+            packages in the build directory.
+        """
+        output_paths = Files.list_component_packages(base_build_dir)
+        output_paths.extend(d for d in Files.dir_children(base_build_dir)
+                            if Files.path_exists(d, 'CMakeCache.txt'))
+        for project in projects:
+            if MavenUtil.is_project(project.src_dir):
+                output_paths.extend(FastClean._find_maven_target_dirs(project.src_dir))
+        return output_paths
+
+
+    @staticmethod
+    def _find_maven_target_dirs(src_dir):
+        target_dirs = []
+        with os.scandir(src_dir) as entries:
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False) or entry.name.startswith('.'):
+                    continue
+                if entry.name == 'target':
+                    target_dirs.append(entry.path)
+                elif Files.path_exists(entry.path, 'pom.xml'):
+                    target_dirs.extend(FastClean._find_maven_target_dirs(entry.path))
+        return target_dirs
+
+
+    @staticmethod
+    def delete(paths):
+        """
+        :return: The number of bytes freed.
+        """
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            futures = []
+            dirs = []
+            for path in paths:
+                print('Deleting', path)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    dirs.append(path)
+                    with os.scandir(path) as entries:
+                        futures.extend(executor.submit(FastClean._delete_entry, e.path)
+                                       for e in entries)
+                else:
+                    futures.append(executor.submit(FastClean._delete_entry, path))
+            bytes_freed = sum(f.result() for f in futures)
+        for directory in dirs:
+            os.rmdir(directory)
+        return bytes_freed
+
+
+    @staticmethod
+    def _delete_entry(path):
+        """ Deletes path, measuring the size of each file as it is deleted. """
+        if not os.path.isdir(path) or os.path.islink(path):
+            size = os.lstat(path).st_size
+            os.remove(path)
+            return size
+        size = 0
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    size += FastClean._delete_entry(entry.path)
+                else:
+                    size += entry.stat(follow_symlinks=False).st_size
+                    os.remove(entry.path)
+        os.rmdir(path)
+        return size
 
 
 def print_warning(msg):
@@ -150,6 +285,12 @@ class MpfArgumentParser(argparse.ArgumentParser):
                  'or a path relative to a path provided in the component search paths.',
             metavar='<components>')
 
+        self.add_argument(
+            '--discover-components',
+            action='store_true',
+            help='Build every component found in the component search paths, instead of the '
+                 'components listed with -c or -json.')
+
         self.add_argument(
             '-json', '--mpf-package-json',
             type=none_when_falsy(argparse.FileType()),
@@ -167,6 +308,19 @@ class MpfArgumentParser(argparse.ArgumentParser):
             help='Cleans without building anything'
         )
 
+        self.add_argument(
+            '--native-clean',
+            action='store_true',
+            help='Clean by running "make clean" in each C++ build directory and "mvn clean" in '
+                 'each Java project. By default, --clean and --clean-only delete the CMake build '
+                 'directories, Maven target directories, and plugin packages directly.')
+
+        self.add_argument(
+            '--force-rebuild',
+            action='store_true',
+            help='Builds every component even when the build manifest indicates that the '
+                 'component\'s sources, SDK, and toolchain have not changed since the last build.')
+
 
         parallel_arg_def = self.add_argument(
             '-p', '--parallel',
@@ -188,9 +342,214 @@ class MpfArgumentParser(argparse.ArgumentParser):
             const=float('inf'),
             type=int,
             help='Specifies the number of "make" jobs for C++ builds. '
-                 'The given value is forwarded to all calls to "make".',
+                 'The given value is forwarded to all calls to "make". Ignored when --jobserver '
+                 'is provided.',
             metavar='<num_make_jobs>')
 
+        self.add_argument(
+            '--ninja',
+            action='store_true',
+            help='Use the Ninja generator for C++ builds instead of Unix Makefiles. '
+                 'The -j and --jobserver options also limit the number of Ninja jobs.')
+
+        self.add_argument(
+            '--ccache',
+            nargs='?',
+            const=CompilerCache.DEFAULT_CACHE_DIR,
+            help='Use ccache as the compiler launcher for the C++ SDK and C++ components. '
+                 'If <cache_dir> is not specified, %s is used.' % CompilerCache.DEFAULT_CACHE_DIR,
+            metavar='<cache_dir>')
+
+        self.add_argument(
+            '--ccache-max-size',
+            default='10G',
+            help='Maximum size of the ccache cache directory, e.g. 500M or 20G. When the cache is '
+                 'full, the least recently used entries are evicted. Defaults to 10G.',
+            metavar='<size>')
+
+        self.add_argument(
+            '--maven-reactor',
+            action='store_true',
+            help='Build all of the Java components in a single Maven reactor, instead of running '
+                 'a separate "mvn package" for each component. The -j option, or --jobserver, '
+                 'sets the number of Maven threads.')
+
+        self.add_argument(
+            '--isolated-maven-repo',
+            nargs='?',
+            const=IsolatedMavenRepo.DEFAULT_WARMED_REPO_DIR,
+            help='Give each Java build its own local Maven repository and run Maven offline. '
+                 'Dependencies and plugins are resolved once in to the shared, warmed repository '
+                 'at <warmed_repo_dir>, which the builds only read from. If <warmed_repo_dir> is '
+                 'not provided, %s is used. Requires Maven 3.9 or later.'
+                 % IsolatedMavenRepo.DEFAULT_WARMED_REPO_DIR,
+            metavar='<warmed_repo_dir>')
+
+        self.add_argument(
+            '--stream-output',
+            action='store_true',
+            help='When building more than one project in parallel, print the output of each '
+                 'build to the console. By default, the output of each project is written to '
+                 'its own log file in <build_dir>/logs, and a progress display is shown instead.')
+
+        failure_mode_group = self.add_mutually_exclusive_group()
+        failure_mode_group.add_argument(
+            '--fail-fast',
+            action='store_const',
+            dest='failure_mode',
+            const='fail-fast',
+            help='When a project fails to build, kill the builds that are running and do not '
+                 'start any more builds. This is the default when -p is 1.')
+
+        failure_mode_group.add_argument(
+            '--keep-going',
+            action='store_const',
+            dest='failure_mode',
+            const='keep-going',
+            help='When a project fails to build, keep building every project that does not '
+                 'depend on the failed project. This is the default when -p is greater than 1.')
+
+        self.add_argument(
+            '--admission-control',
+            action='store_true',
+            help='Only start a build when the host has enough available memory for the peak '
+                 'memory use recorded for the project on earlier runs, in addition to what the '
+                 'running builds are expected to use, and the load average is below --max-load.')
+
+        self.add_argument(
+            '--memory-reserve',
+            type=parse_size,
+            default='1G',
+            help='Amount of memory --admission-control keeps available for the rest of the '
+                 'system. Defaults to 1G.',
+            metavar='<size>')
+
+        self.add_argument(
+            '--max-load',
+            type=float,
+            help='Load average at which --admission-control stops starting builds. Defaults to '
+                 'the number of CPUs.',
+            metavar='<load>')
+
+        self.add_argument(
+            '--build-memory-limit',
+            type=parse_size,
+            help='Limit the memory each build may use. By default, the address space of each '
+                 'process is limited with RLIMIT_AS. When --build-cgroup is provided, the '
+                 'processes of each build are placed in a cgroup that limits their total memory.',
+            metavar='<size>')
+
+        self.add_argument(
+            '--build-cgroup',
+            help='cgroup v2 directory, delegated to the current user, in which a child cgroup is '
+                 'created for each build. e.g. the cgroup of a '
+                 '"systemd-run --user --scope -p Delegate=yes" scope.',
+            metavar='<cgroup_dir>')
+
+        self.add_argument(
+            '--watch',
+            action='store_true',
+            help='After building, keep watching the source directories of the SDKs and components '
+                 'for changes. When files change, the changed projects and the projects that '
+                 'depend on them are rebuilt. Press Ctrl-C to stop.')
+
+        self.add_argument(
+            '--remote-cache',
+            help='URL of an HTTP artifact cache, e.g. one started with '
+                 '"build_components.py cache-server". Before a component is built, its packages '
+                 'are downloaded from the cache when the cache has an entry for the component\'s '
+                 'fingerprint. After a component is built, its packages are uploaded.',
+            metavar='<url>')
+
+        self.add_argument(
+            '--remote-cache-read-only',
+            action='store_true',
+            help='Download packages from --remote-cache, but do not upload them.')
+
+        self.add_argument(
+            '--workers',
+            type=none_when_falsy(lambda s: [WorkerProtocol.parse_address(a) for a in s.split(',')]),
+            help='Comma separated list of <host>:<port> addresses of build workers started with '
+                 '"build_components.py worker". Components are built on the least loaded worker, '
+                 'and their packages are copied back to this host. SDKs are still built locally, '
+                 'so each worker must already have the SDKs installed. The %s environment '
+                 'variable must be set to the same secret on this host and the workers.'
+                 % WorkerProtocol.AUTHKEY_ENV_VAR,
+            metavar='<workers>')
+
+        self.add_argument(
+            '--send-sources',
+            action='store_true',
+            help='Send a snapshot of each component\'s source code to the build worker. By '
+                 'default, workers build from the same path, e.g. on a shared file system.')
+
+        self.add_argument(
+            '--jobserver',
+            nargs='?',
+            const=multiprocessing.cpu_count(),
+            type=int,
+            help='Creates a single pool of job slots that is shared by every build. Each "make", '
+                 '"mvn", and "pip" process started by this script takes a slot from the pool, and '
+                 'parallel "make" processes draw their additional jobs from the same pool, so the '
+                 'total number of jobs stays within <num_jobs> regardless of -p. '
+                 'When provided, -j is ignored for "make", Ninja, and the Maven reactor. '
+                 'If no number is specified, the number of CPUs is used.',
+            metavar='<num_jobs>')
+
+        self.add_argument(
+            '--wheel-cache-max-size',
+            type=parse_size,
+            default='5G',
+            help='Maximum size of the persistent cache of dependency wheels downloaded or built '
+                 'while packaging Python components. The cache is stored in '
+                 '$MPF_SDK_INSTALL_PATH/python/wheel-cache and shared by all build directories. '
+                 'When the cache is full, the least recently used wheels are evicted. Use 0 to '
+                 'disable the cache. Defaults to 5G.',
+            metavar='<size>')
+
+        self.add_argument(
+            '--isolated-python-builds',
+            action='store_true',
+            help='Let pip create a new isolated build environment each time a Python component is '
+                 'packaged. By default, the build backend is installed once, in an environment '
+                 'in $MPF_SDK_INSTALL_PATH/python/build-envs for each distinct set of '
+                 '[build-system] requires, and reused with "pip wheel --no-build-isolation".')
+
+        self.add_argument(
+            '--venv-snapshot-dir',
+            type=none_when_falsy(),
+            default=VenvSnapshot.DEFAULT_SNAPSHOT_DIR,
+            help='When the Python SDK venv needs to be created, restore it from a snapshot in '
+                 'this directory, or save a snapshot after creating it. Snapshots are keyed by '
+                 'the python3.12 interpreter. Defaults to %s. Pass an empty string to disable '
+                 'snapshots.' % VenvSnapshot.DEFAULT_SNAPSHOT_DIR,
+            metavar='<snapshot_dir>')
+
+        self.add_argument(
+            '--compression-level',
+            type=int,
+            choices=range(0, 10),
+            default=9,
+            help='The gzip compression level used when this script creates plugin packages. '
+                 'Defaults to 9.',
+            metavar='<level>')
+
+        self.add_argument(
+            '--fast-packaging',
+            action='store_const',
+            dest='compression_level',
+            const=1,
+            help='Use the fastest gzip compression level when creating plugin packages. '
+                 'Intended for development builds.')
+
+        self.add_argument(
+            '--trace',
+            help='Writes a timeline of every build phase (cmake configure, make, mvn, venv '
+                 'creation, pip, tar/gzip, and copying packages) to <trace_file>. '
+                 'The file uses the Chrome trace event format, so it can be opened with '
+                 'chrome://tracing or https://ui.perfetto.dev.',
+            metavar='<trace_file>')
+
         # Add as separate argument to prevent parsing second letter as a number.
         self.add_argument(
             '-jp', '-pj',
@@ -206,13 +565,18 @@ class MpfArgumentParser(argparse.ArgumentParser):
     def parse_args(self, arg_strings=sys.argv[1:], namespace=None):
         arg_strings = MpfArgumentParser._expand_path_tilde(arg_strings)
         args = super(MpfArgumentParser, self).parse_args(arg_strings, namespace)
+        if args.ccache and not shutil.which('ccache'):
+            self.error('--ccache was provided, but ccache is not installed.')
+        if args.workers and not os.getenv(WorkerProtocol.AUTHKEY_ENV_VAR):
+            self.error('--workers was provided, but the %s environment variable is not set.'
+                       % WorkerProtocol.AUTHKEY_ENV_VAR)
         if args.cpp_sdk_src or args.java_sdk_src or args.python_sdk_src or args.components or args.mpf_package_json \
-                or args.clean or args.clean_only:
+                or args.discover_components or args.clean or args.clean_only:
             return args
         else:
             self.error(
                 'One of the following options must be provided: '
-                '-csdk, -jsdk, -psdk, -c, -json, '
+                '-csdk, -jsdk, -psdk, -c, -json, --discover-components, '
                 '--clean, --clean-only, or --help')
 
 
@@ -238,6 +602,23 @@ class MpfArgumentParser(argparse.ArgumentParser):
             return []
 
 
+def parse_size(size_str):
+    """ Converts a size like 500M or 20G to a number of bytes. """
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([KMGT]?)B?', size_str.strip().upper())
+    if not match:
+        raise argparse.ArgumentTypeError('"%s" is not a valid size, e.g. 500M or 20G.' % size_str)
+    multiplier = 1024 ** ' KMGT'.index(match.group(2) or ' ')
+    return int(float(match.group(1)) * multiplier)
+
+
+def format_size(num_bytes):
+    for unit in ('bytes', 'KiB', 'MiB', 'GiB'):
+        if num_bytes < 1024 or unit == 'GiB':
+            break
+        num_bytes /= 1024
+    return ('%d %s' if unit == 'bytes' else '%.1f %s') % (num_bytes, unit)
+
+
 def none_when_falsy(func=lambda x: x):
     def apply_func(arg):
         return func(arg) if arg else None
@@ -264,17 +645,28 @@ class ComponentLocator(object):
 
     def __init__(self, cmdline_args):
         self._cmdline_args = cmdline_args
-        if cmdline_args.mpf_package_json:
+        if cmdline_args.discover_components or (cmdline_args.components
+                                                and not cmdline_args.mpf_package_json):
+            self._component_search_paths \
+                = self._get_search_paths(cmdline_args.component_search_path)
+        else:
+            self._component_search_paths = ()
+        # The index is only saved when it can speed up searching the component search paths in
+        # later runs, so that runs that do not search, like --clean-only runs, do not create the
+        # build directory.
+        self._index = ComponentIndex(
+            cmdline_args.build_dir
+            if self._component_search_paths and not cmdline_args.clean_only else None)
+
+        if cmdline_args.discover_components:
+            self._components = self._discover_components()
+        elif cmdline_args.mpf_package_json:
             self._components \
                 = ComponentLocator._get_components_listed_in_json(cmdline_args.mpf_package_json)
-            self._component_search_paths = ()
         elif cmdline_args.components:
             self._components = ComponentLocator._split_path_list(cmdline_args.components)
-            self._component_search_paths \
-                = self._get_search_paths(cmdline_args.component_search_path)
         else:
             self._components = ()
-            self._component_search_paths = ()
 
 
     @staticmethod
@@ -290,6 +682,13 @@ class ComponentLocator(object):
 
 
     def locate_components(self):
+        try:
+            return self._locate_components()
+        finally:
+            self._index.save()
+
+
+    def _locate_components(self):
         located_components = []
         missing_components = []
         for component_path in self._components:
@@ -320,15 +719,42 @@ class ComponentLocator(object):
 
 
     def _check_search_paths(self, component_path):
-        component = MpfComponent.create(component_path, self._cmdline_args)
+        component = self._create_component(component_path)
         if component:
             return component
         for search_path in self._component_search_paths:
             full_component_path = os.path.join(search_path, component_path)
-            component = MpfComponent.create(full_component_path, self._cmdline_args)
+            component = self._create_component(full_component_path)
             if component:
                 return component
 
+    def _create_component(self, src_dir):
+        component_type = self._index.get_component_type(src_dir)
+        return component_type(src_dir, self._cmdline_args) if component_type else None
+
+
+    def _discover_components(self):
+        """
+        :return: The names of the component directories that are direct children of the
+            component search paths, or of a language directory in a component search path.
+            Language directories are skipped because they are projects that build all of the
+            components they contain, and those components are discovered individually.
+        """
+        component_names = []
+        for search_path in self._component_search_paths:
+            for name in self._index.list_dirs(search_path):
+                if (name.startswith('.') or name in ComponentLocator.LANG_DIRS
+                        or name in component_names):
+                    continue
+                child_path = os.path.join(search_path, name)
+                if self._index.get_component_type(child_path) or any(
+                        self._index.get_component_type(os.path.join(child_path, lang_dir))
+                        for lang_dir in ComponentLocator.LANG_DIRS):
+                    component_names.append(name)
+        if not component_names:
+            sys.exit('Error: No components were found in the component search paths.')
+        return component_names
+
     def _check_lang_dirs(self, component_path):
         """
         If the top level directory of a component repo is given as a component,
@@ -392,161 +818,3141 @@ class ComponentLocator(object):
 
 
 
+class ComponentIndex(object):
+    """
+    Answers the questions ComponentLocator asks about candidate component directories using one
+    os.scandir call per directory, rather than several os.path.exists calls per candidate,
+    which is slow when the search paths are on a network file system. Directory listings and
+    the languages read from descriptor.json files are saved in the build directory. A saved
+    listing is reused when the directory's modification time has not changed, which is the case
+    unless an entry was added, removed, or renamed.
+    """
+    FILE_NAME = 'component-index.json'
+
+    def __init__(self, base_build_dir):
+        """
+        :param base_build_dir: The directory the index is saved in, or None when the index should
+            only be kept in memory.
+        """
+        self._path = base_build_dir and os.path.join(base_build_dir, ComponentIndex.FILE_NAME)
+        saved_index = Files.load_json(self._path, {}) if self._path else {}
+        self._saved_listings = saved_index.get('listings', {})
+        self._saved_descriptors = saved_index.get('descriptors', {})
+        self._listings = {}
+        self._descriptors = {}
+
+
+    def get_component_type(self, src_dir):
+        """
+        :return: The MpfComponent subclass for the project in src_dir, or None when src_dir does
+            not contain a component. Uses the same rules as MpfComponent.create.
+        """
+        entries = self._get_entries(src_dir)
+        if entries is None:
+            return None
+        if 'CMakeLists.txt' in entries and '.mpfdockeronly' not in entries:
+            return CppComponent
+        if 'pom.xml' in entries:
+            return JavaComponent
+        if 'pyproject.toml' in entries or 'setup.py' in entries:
+            return PythonComponent
+        if entries.get('descriptor') and self._get_descriptor_lang(src_dir) == 'python':
+            return PythonComponent
+        return None
+
+
+    def list_dirs(self, dir_path):
+        entries = self._get_entries(dir_path) or {}
+        return sorted(name for name, is_dir in entries.items() if is_dir)
+
+
+    def _get_entries(self, dir_path):
+        """
+        :return: Mapping from the name of each entry in dir_path to whether it is a directory,
+            or None when dir_path is not a directory.
+        """
+        key = os.path.abspath(dir_path)
+        if key in self._listings:
+            return self._listings[key]
+
+        parent, name = os.path.split(key)
+        parent_entries = self._listings.get(parent)
+        if parent_entries is not None and not parent_entries.get(name):
+            # The parent was already listed, so no system calls are needed.
+            entries = None
+        else:
+            entries = self._load_entries(key)
+        self._listings[key] = entries
+        return entries
+
+
+    def _load_entries(self, dir_path):
+        try:
+            mtime_ns = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            return None
+        saved_listing = self._saved_listings.get(dir_path)
+        if saved_listing and saved_listing['mtime_ns'] == mtime_ns:
+            return saved_listing['entries']
+        try:
+            with os.scandir(dir_path) as dir_entries:
+                entries = {e.name: e.is_dir() for e in dir_entries}
+        except OSError:
+            return None
+        self._saved_listings[dir_path] = {'mtime_ns': mtime_ns, 'entries': entries}
+        return entries
+
+
+    def _get_descriptor_lang(self, src_dir):
+        descriptor_path = os.path.join(os.path.abspath(src_dir), 'descriptor', 'descriptor.json')
+        if descriptor_path in self._descriptors:
+            return self._descriptors[descriptor_path]
+        try:
+            stat = os.stat(descriptor_path)
+        except OSError:
+            lang = None
+        else:
+            saved = self._saved_descriptors.get(descriptor_path)
+            if saved and saved['stat'] == [stat.st_mtime_ns, stat.st_size]:
+                lang = saved['lang']
+            else:
+                descriptor_json = Files.load_json(descriptor_path, {})
+                lang = str(descriptor_json.get('sourceLanguage', '')).lower()
+                self._saved_descriptors[descriptor_path] = {
+                    'stat': [stat.st_mtime_ns, stat.st_size], 'lang': lang}
+        self._descriptors[descriptor_path] = lang
+        return lang
+
+
+    def save(self):
+        if not self._path:
+            return
+        Files.write_json(self._path, {'listings': self._saved_listings,
+                                      'descriptors': self._saved_descriptors})
+
+
+
 class ProjectBuilder(object):
-    def __init__(self, pool_size):
+    """
+    Schedules projects based on the SDK they depend on. A component is started as soon as the SDK
+    for its language has been built, so, for example, Python and Java components do not wait on
+    the C++ SDK. When more projects are ready than there are build slots, the projects with the
+    longest critical path, based on the durations recorded in the build history, are started first.
+    """
+    def __init__(self, pool_size, build_manifest, build_history, base_log_dir=None,
+                 failure_mode=None, remote_cache=None):
+        """
+        :param base_log_dir: When provided, the output of each project's build is written to a
+            log file in this directory, and a progress display is shown instead.
+        :param failure_mode: Either 'fail-fast', to cancel the other builds when a project fails,
+            or 'keep-going', to build every project that does not depend on a failed project.
+            Defaults to 'keep-going' for parallel builds and 'fail-fast' for sequential builds.
+        """
+        if failure_mode is None:
+            failure_mode = 'keep-going' if pool_size > 1 else 'fail-fast'
+        self._fail_fast = failure_mode == 'fail-fast'
+        self._remote_cache = remote_cache
+        self._pool_size = pool_size
+        self._build_manifest = build_manifest
+        self._build_history = build_history
+        self._base_log_dir = base_log_dir
         if pool_size > 1:
             self._pool = multiprocessing.pool.ThreadPool(processes=pool_size)
         else:
             self._pool = None
 
     def build(self, projects):
+        dependencies = ProjectBuilder.get_dependencies(projects)
+        durations = {p: self._build_history.get_estimated_duration(p) for p in projects}
+        priorities = ProjectBuilder.get_critical_path_lengths(projects, dependencies, durations)
+        predicted_makespan = self.predict_makespan(projects, dependencies, durations, priorities)
+        command_line_order_makespan = self.predict_makespan(projects, dependencies, durations)
+
+        start_time = time.monotonic()
         if self._pool:
-            self._build_parallel(projects)
+            progress = ProgressDisplay(self, projects, dependencies, durations, priorities)
+            with progress.showing():
+                self._build_parallel(projects, dependencies, priorities, progress)
         else:
-            ProjectBuilder._build_sequential(projects)
+            self._build_sequential(projects, dependencies, priorities)
+        print('Build took %.0f seconds. Predicted time was %.0f seconds when ordering builds by '
+              'critical path and %.0f seconds when using command line order.'
+              % (time.monotonic() - start_time, predicted_makespan, command_line_order_makespan))
 
 
-    def _build_parallel(self, projects):
-        build_results = []
+    def watch(self, projects, base_build_dir, on_build_finished):
+        """
+        Builds the projects, then waits for changes to their source files and rebuilds the
+        changed projects and the projects that depend on them, until interrupted.
+        :param on_build_finished: Called after each build, including failed builds.
+        """
+        dependencies = ProjectBuilder.get_dependencies(projects)
+        watched_dirs = {}
         for project in projects:
-            async_result = self._pool.apply_async(project.build)
-            build_results.append((project, async_result))
+            for src_dir in SourceWatcher.get_src_dirs(project):
+                watched_dirs.setdefault(src_dir, []).append(project)
+
+        with SourceWatcher.create(watched_dirs, [base_build_dir]) as watcher:
+            projects_to_build = projects
+            while True:
+                try:
+                    self.build(projects_to_build)
+                except SystemExit as err:
+                    # Build failures are reported, but the projects are still watched.
+                    print(err.code, file=sys.stderr)
+                finally:
+                    on_build_finished()
+                print('Watching %s source directories for changes. Press Ctrl-C to stop.'
+                      % len(watched_dirs))
+                try:
+                    changed_dirs = watcher.wait_for_changes()
+                except KeyboardInterrupt:
+                    print('Stopped watching.')
+                    return
+                changed_projects = {p for d in changed_dirs for p in watched_dirs[d]}
+                projects_to_build = ProjectBuilder.get_affected_projects(
+                    projects, dependencies, changed_projects)
+                print('Changes detected in:', ', '.join(sorted(changed_dirs)))
+
 
-        for p, r in build_results:
-            r.wait()
-        ProjectBuilder._report_build_errors(build_results)
+    @staticmethod
+    def get_affected_projects(projects, dependencies, changed_projects):
+        """
+        :return: The changed projects and every project that directly or indirectly depends on
+            one of them, in the same order as projects.
+        """
+        affected = set(changed_projects)
+        added = True
+        while added:
+            added = False
+            for project in projects:
+                if project not in affected and any(d in affected for d in dependencies[project]):
+                    affected.add(project)
+                    added = True
+        return [p for p in projects if p in affected]
 
 
     @staticmethod
-    def _build_sequential(projects):
-        for project in projects:
-            try:
-                project.build()
-            except Exception as err:
-                sys.exit('An error occurred while trying to build %s: %s.' % (project.src_dir, err))
+    def get_dependencies(projects):
+        """
+        :return: Mapping from each project to the list of projects that must be built before it.
+        """
+        return {project: [p for p in projects if project.depends_on(p)] for project in projects}
 
 
     @staticmethod
-    def _report_build_errors(build_results):
-        error_msgs = []
-        for project, result in build_results:
+    def get_critical_path_lengths(projects, dependencies, durations):
+        """
+        :return: Mapping from each project to the duration of the longest chain of builds that
+            starts with the project.
+        """
+        dependents = {p: [] for p in projects}
+        for project in projects:
+            for dependency in dependencies[project]:
+                dependents[dependency].append(project)
+
+        lengths = {}
+        def get_length(project):
+            if project not in lengths:
+                lengths[project] = durations[project] + max(
+                    (get_length(d) for d in dependents[project]), default=0)
+            return lengths[project]
+
+        for project in projects:
+            get_length(project)
+        return lengths
+
+
+    def predict_makespan(self, projects, dependencies, durations, priorities=None):
+        """ Simulates a build where each project takes exactly its estimated duration. """
+        scheduler = DependencyScheduler(projects, dependencies, priorities)
+        running = []
+        current_time = 0
+        # "-p 0" builds sequentially, like "-p 1".
+        pool_size = max(1, self._pool_size)
+        while scheduler.has_ready() or running:
+            while scheduler.has_ready() and len(running) < pool_size:
+                project = scheduler.pop_ready()
+                heapq.heappush(running, (current_time + durations[project], id(project), project))
+            current_time, _, project = heapq.heappop(running)
+            scheduler.mark_succeeded(project)
+        return current_time
+
+
+    def _build_parallel(self, projects, dependencies, priorities, progress):
+        scheduler = DependencyScheduler(projects, dependencies, priorities)
+        finished_builds = queue.Queue()
+        running_projects = set()
+        results = BuildResults(projects)
+        if self._base_log_dir:
+            print('Writing the output of each build to:', self._base_log_dir)
+
+        def start_build(project):
+            running_projects.add(project)
+            progress.on_started(project)
+            self._pool.apply_async(
+                self._build_project, (project,),
+                callback=lambda _: finished_builds.put((project, None)),
+                error_callback=lambda err: finished_builds.put((project, err)))
+
+        last_delay_msg = None
+        while (scheduler.has_ready() and not results.is_cancelled()) or running_projects:
+            delay_reason = None
+            while (scheduler.has_ready() and not results.is_cancelled()
+                   and len(running_projects) < self._pool_size):
+                delay_reason = ResourceMonitor.get_start_delay_reason(
+                    scheduler.peek_ready(), running_projects)
+                if delay_reason:
+                    delay_msg = 'Waiting to start %s because %s.' % (
+                        scheduler.peek_ready().src_dir, delay_reason)
+                    if delay_msg != last_delay_msg:
+                        print(delay_msg)
+                        last_delay_msg = delay_msg
+                    break
+                start_build(scheduler.pop_ready())
+
+            try:
+                # When a start was delayed, check the host again after a while, even if no
+                # build finishes.
+                project, err = finished_builds.get(
+                    timeout=ResourceMonitor.SAMPLE_INTERVAL if delay_reason else None)
+            except queue.Empty:
+                continue
+            running_projects.discard(project)
+            if err is None:
+                scheduler.mark_succeeded(project)
+                results.mark_succeeded(project)
+                progress.on_finished(project, succeeded=True)
+            elif results.is_cancelled():
+                results.mark_cancelled(project)
+                progress.on_finished(project, succeeded=False)
+            else:
+                self._print_log_tail(project)
+                skipped_projects = scheduler.mark_failed(project)
+                results.mark_failed(project, err, skipped_projects)
+                progress.on_finished(project, succeeded=False, skipped=skipped_projects)
+                if self._fail_fast:
+                    print('Cancelling the remaining builds because %s failed to build.'
+                          % project.src_dir)
+                    results.cancel()
+                    SubprocessUtil.cancel_all()
+            progress.print_status()
+
+        results.print_table()
+        results.exit_if_any_failed()
+
+
+    def _build_sequential(self, projects, dependencies, priorities):
+        scheduler = DependencyScheduler(projects, dependencies, priorities)
+        results = BuildResults(projects)
+        while scheduler.has_ready():
+            project = scheduler.pop_ready()
             try:
-                result.get()
+                self._build_project(project)
             except Exception as err:
-                error_msgs.append(
-                    'An error occurred while trying to build %s: %s.' % (project.src_dir, err))
-        if error_msgs:
-            sys.exit('\n'.join(error_msgs))
+                results.mark_failed(project, err, scheduler.mark_failed(project))
+                if self._fail_fast:
+                    results.cancel()
+                    break
+            else:
+                scheduler.mark_succeeded(project)
+                results.mark_succeeded(project)
+
+        if len(projects) > 1:
+            results.print_table()
+        results.exit_if_any_failed()
+
+
+    def _print_log_tail(self, project):
+        if not self._base_log_dir:
+            return
+        log_path = ProjectLog.get_path(self._base_log_dir, project)
+        print('%s failed to build. The end of %s is:' % (project.src_dir, log_path))
+        print(ProjectLog.read_tail(log_path), end='')
+
+
+    def _build_project(self, project):
+        if self._base_log_dir:
+            log_capture = ProjectLog.capturing(ProjectLog.get_path(self._base_log_dir, project))
+        else:
+            log_capture = contextlib.nullcontext()
+        with log_capture, BuildTrace.project_span(project), ResourceMonitor.tracking(project):
+            return self._build_project_with_cache(project)
+
+
+    def _build_project_with_cache(self, project):
+        if isinstance(project, MavenReactorBuild):
+            self._build_reactor_with_cache(project)
+            return
+        if not BuildManifest.is_cacheable(project):
+            self._build_and_time_project(project)
+            return
+
+        with BuildTrace.span('fingerprint'):
+            fingerprint = self._build_manifest.get_fingerprint(project)
+        if self._build_manifest.is_up_to_date(project, fingerprint):
+            print('Build cache hit, skipping:', project.src_dir)
+            return
+        packages = RemoteCache.fetch(self._remote_cache, project, fingerprint)
+        if packages is not None:
+            self._build_manifest.record(project, fingerprint, packages)
+            return
+        print('Build cache miss, building:', project.src_dir)
+        try:
+            packages = self._build_and_time_project(project)
+        except Exception:
+            self._build_manifest.remove(project)
+            raise
+        self._build_manifest.record(project, fingerprint, packages)
+        RemoteCache.store(self._remote_cache, project, fingerprint, packages)
+
+
+    def _build_reactor_with_cache(self, reactor):
+        stale_components = []
+        fingerprints = {}
+        for component in reactor.components:
+            with BuildTrace.span('fingerprint', project=component.src_dir):
+                fingerprints[component] = self._build_manifest.get_fingerprint(component)
+            if self._build_manifest.is_up_to_date(component, fingerprints[component]):
+                print('Build cache hit, skipping:', component.src_dir)
+                continue
+            packages = RemoteCache.fetch(self._remote_cache, component, fingerprints[component])
+            if packages is not None:
+                self._build_manifest.record(component, fingerprints[component], packages)
+                continue
+            print('Build cache miss, building:', component.src_dir)
+            stale_components.append(component)
+
+        if not stale_components:
+            return
+        start_time = time.monotonic()
+        try:
+            published_packages = reactor.build_components(stale_components)
+        except ReactorBuildError as e:
+            # Components that built successfully are still recorded so they are not rebuilt.
+            self._record_reactor_results(e.published_packages, fingerprints)
+            for component in e.failed_components:
+                self._build_manifest.remove(component)
+            raise
+        except Exception:
+            for component in stale_components:
+                self._build_manifest.remove(component)
+            raise
+        self._build_history.record_duration(reactor, time.monotonic() - start_time)
+        self._record_reactor_results(published_packages, fingerprints)
+
+
+    def _record_reactor_results(self, published_packages, fingerprints):
+        for component, packages in published_packages.items():
+            self._build_manifest.record(component, fingerprints[component], packages)
+            RemoteCache.store(self._remote_cache, component, fingerprints[component], packages)
+
+
+    def _build_and_time_project(self, project):
+        start_time = time.monotonic()
+        result = project.build()
+        self._build_history.record_duration(project, time.monotonic() - start_time)
+        return result
 
 
     @staticmethod
     def build_projects(sdks, components, cmdline_args):
         if not sdks and not components:
             return
-        max_possible_simultaneous_builds = max(len(sdks), len(components))
-        pool_size = min(max_possible_simultaneous_builds, cmdline_args.parallel)
-        builder = ProjectBuilder(pool_size)
-        builder.build(sdks)
+        java_components = [c for c in components if isinstance(c, JavaComponent)]
+        if cmdline_args.maven_reactor and len(java_components) > 1:
+            components = [c for c in components if not isinstance(c, JavaComponent)]
+            components.append(MavenReactorBuild(java_components, cmdline_args))
+        worker_pool = WorkerPool.connect(cmdline_args)
+        # Each remote build also occupies a local thread while it waits for the result.
+        max_pool_size = cmdline_args.parallel + (worker_pool.total_capacity if worker_pool else 0)
+        pool_size = min(len(sdks) + len(components), max_pool_size)
+        build_manifest = BuildManifest(cmdline_args.build_dir, cmdline_args.force_rebuild)
+        build_history = BuildHistory(cmdline_args.build_dir)
+        if pool_size > 1 and not cmdline_args.stream_output:
+            base_log_dir = os.path.join(cmdline_args.build_dir, ProjectLog.DIR_NAME)
+        else:
+            base_log_dir = None
+        builder = ProjectBuilder(pool_size, build_manifest, build_history, base_log_dir,
+                                 cmdline_args.failure_mode, RemoteCache.from_args(cmdline_args))
         if components:
             plugin_output_dir = get_plugin_output_dir(cmdline_args)
             Files.make_dir(plugin_output_dir)
-            builder.build(components)
+
+        def save_build_state():
+            SubprocessUtil.reset()
+            build_manifest.save()
+            build_history.save()
+            PackageStore(cmdline_args.build_dir).prune()
+
+        try:
+            with BuildTrace.recording(cmdline_args.trace), \
+                    JobServer.running(cmdline_args.jobserver), \
+                    VenvSnapshot.enabled(cmdline_args.venv_snapshot_dir), \
+                    WorkerPool.running(worker_pool), \
+                    ResourceMonitor.running(ResourceMonitor.from_args(cmdline_args, build_history)):
+                if cmdline_args.watch:
+                    builder.watch(sdks + components, cmdline_args.build_dir, save_build_state)
+                else:
+                    builder.build(sdks + components)
+        except KeyboardInterrupt:
+            # Build commands run in their own process groups, so they do not receive the SIGINT.
+            SubprocessUtil.cancel_all()
+            raise
+        finally:
+            save_build_state()
+            build_manifest.print_summary()
+            CmakeUtil.print_timing_summary()
+            CompilerCache.print_stats_summary()
+            PipUtil.print_stats_summary()
+        if components:
             print('Component packages written to:', plugin_output_dir)
 
 
 
-class CmakeUtil(object):
-    @staticmethod
-    def is_project(src_dir):
-        return Files.path_exists(src_dir, 'CMakeLists.txt') and not(Files.path_exists(src_dir, '.mpfdockeronly'))
+class BuildResults(object):
+    """ Records whether each project succeeded, failed, or was skipped, and prints a summary. """
+    def __init__(self, projects):
+        self._projects = projects
+        self._results = {}
+        self._error_msgs = []
+        self._cancelled = False
+
+    def mark_succeeded(self, project):
+        self._results[project] = ('succeeded', '')
+
+    def mark_failed(self, project, err, skipped_projects):
+        self._results[project] = ('failed', str(err))
+        self._error_msgs.append(
+            'An error occurred while trying to build %s: %s.' % (project.src_dir, err))
+        for skipped in skipped_projects:
+            self._results[skipped] = ('skipped', '%s failed' % Files.get_leaf(project.src_dir))
+            self._error_msgs.append('Did not build %s because %s failed to build.'
+                                    % (skipped.src_dir, project.src_dir))
+
+    def mark_cancelled(self, project):
+        self._results[project] = ('cancelled', 'killed by --fail-fast')
+
+    def cancel(self):
+        self._cancelled = True
+
+    def is_cancelled(self):
+        return self._cancelled
+
+
+    def print_table(self):
+        rows = []
+        for project in self._projects:
+            default_result = ('cancelled', 'not started') if self._cancelled else ('', '')
+            result, detail = self._results.get(project, default_result)
+            rows.append((project.src_dir, result, detail))
+        name_width = max(len(r[0]) for r in rows)
+        result_width = max(len(r[1]) for r in rows)
+        print('Build results:')
+        for name, result, detail in rows:
+            first_detail_line = detail.splitlines()[0] if detail else ''
+            print(('    %s  %s  %s' % (name.ljust(name_width), result.ljust(result_width),
+                                      first_detail_line)).rstrip())
+        counts = collections.Counter(r[1] for r in rows)
+        print('    %d succeeded, %d failed, %d skipped, %d cancelled.' % (
+            counts['succeeded'], counts['failed'], counts['skipped'], counts['cancelled']))
+
+
+    def exit_if_any_failed(self):
+        if self._error_msgs:
+            sys.exit('\n'.join(self._error_msgs))
+
+
+
+class DependencyScheduler(object):
+    """
+    Tracks which projects are ready to be built. Ready projects are handed out in descending order
+    of priority. Projects with the same priority are handed out in the order they were originally
+    provided.
+    """
+    def __init__(self, projects, dependencies, priorities=None):
+        self._remaining_dependencies = {p: set(dependencies[p]) for p in projects}
+        self._dependents = {p: [] for p in projects}
+        for project in projects:
+            for dependency in dependencies[project]:
+                self._dependents[dependency].append(project)
+        order = {p: i for i, p in enumerate(projects)}
+        priorities = priorities or {}
+        self._sort_key = lambda p: (-priorities.get(p, 0), order[p])
+        self._ready = [p for p in projects if not self._remaining_dependencies[p]]
+        self._ready.sort(key=self._sort_key)
+
+    def has_ready(self):
+        return bool(self._ready)
+
+    def peek_ready(self):
+        return self._ready[0]
+
+    def pop_ready(self):
+        return self._ready.pop(0)
+
+    def mark_succeeded(self, project):
+        for dependent in self._dependents[project]:
+            remaining = self._remaining_dependencies[dependent]
+            remaining.discard(project)
+            if not remaining:
+                self._ready.append(dependent)
+        self._ready.sort(key=self._sort_key)
+
+    def mark_failed(self, project):
+        """
+        :return: The projects that will not be built because they transitively depend on project.
+        """
+        skipped = []
+        to_visit = list(self._dependents[project])
+        while to_visit:
+            dependent = to_visit.pop(0)
+            if dependent in skipped:
+                continue
+            skipped.append(dependent)
+            to_visit.extend(self._dependents[dependent])
+        return skipped
+
 
-    @staticmethod
-    def build(build_dir, src_dir, num_jobs):
-        Files.make_dir(build_dir)
-        subprocess.check_call(('cmake3', '-DCMAKE_RULE_MESSAGES=OFF', src_dir), cwd=build_dir)
-        if num_jobs == 1:
-            subprocess.check_call(('make', 'install'), cwd=build_dir)
-        elif num_jobs == float('inf'):
-            subprocess.check_call(('make', 'install', '--jobs'), cwd=build_dir)
-        else:
-            subprocess.check_call(('make', 'install', '--jobs', str(num_jobs)), cwd=build_dir)
+
+class SourceWatcher(abc.ABC):
+    """
+    Reports which source directories had files created, modified, moved, or deleted. Directories
+    that Fingerprint ignores, e.g. build output directories, are not watched. Uses inotify when
+    it is available, and otherwise periodically compares file sizes and modification times.
+    """
+    DEBOUNCE_SECONDS = 0.5
+
+    def __init__(self, src_dirs, ignored_dirs):
+        # Mapping from absolute path to the path as passed in.
+        self._src_dirs = {os.path.abspath(d): d for d in src_dirs}
+        self._ignored_dirs = {os.path.abspath(d) for d in ignored_dirs}
 
     @staticmethod
-    def clean(build_dir):
-        if Files.path_exists(build_dir, 'makefile') or Files.path_exists(build_dir, 'Makefile'):
-            print('Cleaning', build_dir)
-            subprocess.check_call(('make', 'clean'), cwd=build_dir)
-            for package in Files.list_component_packages(build_dir):
-                print('Deleting', package)
-                os.remove(package)
+    def create(src_dirs, ignored_dirs=()):
+        try:
+            return InotifyWatcher(src_dirs, ignored_dirs)
+        except OSError as err:
+            print_warning('Unable to use inotify to watch for changes, so source directories will '
+                          'be polled instead: %s' % err)
+            return PollingWatcher(src_dirs, ignored_dirs)
 
     @staticmethod
-    def generate_build_path(base_build_dir, src_dir):
-        path_no_leading_slash = src_dir[1:]
-        build_dir_name = path_no_leading_slash.replace('/', '-') + '-build'
-        return os.path.join(base_build_dir, build_dir_name)
+    def get_src_dirs(project):
+        if isinstance(project, MavenReactorBuild):
+            return [c.src_dir for c in project.components]
+        return [project.src_dir]
 
+    def __enter__(self):
+        return self
 
+    def __exit__(self, *args):
+        self.close()
 
-class MavenUtil(object):
-    @staticmethod
-    def is_project(src_dir):
-        return Files.path_exists(src_dir, 'pom.xml')
+    def close(self):
+        pass
 
-    _SKIP_INTEGRATION_TESTS_ARGS = ('-Dit.test=none', '-DfailIfNoTests=false', '-DskipITs')
 
-    @staticmethod
-    def _run_maven_phase(phase, src_dir):
-        subprocess.check_call(('mvn', phase) + MavenUtil._SKIP_INTEGRATION_TESTS_ARGS, cwd=src_dir)
+    def wait_for_changes(self):
+        """
+        Blocks until a file changes, and then until DEBOUNCE_SECONDS pass without any further
+        changes, so that a burst of changes, like saving several files or switching branches,
+        only results in one build.
+        :return: The set of source directories, as passed to the constructor, that changed.
+        """
+        changed_dirs = self._wait_for_events(None)
+        while True:
+            more_changed_dirs = self._wait_for_events(SourceWatcher.DEBOUNCE_SECONDS)
+            if not more_changed_dirs:
+                return changed_dirs
+            changed_dirs |= more_changed_dirs
 
-    @staticmethod
-    def package(src_dir):
-        MavenUtil._run_maven_phase('package', src_dir)
 
-    @staticmethod
-    def install(src_dir):
-        MavenUtil._run_maven_phase('install', src_dir)
+    @abc.abstractmethod
+    def _wait_for_events(self, timeout):
+        """
+        :param timeout: Maximum number of seconds to wait, or None to wait until a change occurs.
+        :return: The set of source directories that changed, which is empty when the timeout
+            expired.
+        """
+        raise NotImplementedError()
 
-    @staticmethod
-    def clean(src_dir):
-        if MavenUtil.is_project(src_dir):
-            print('Cleaning ', src_dir)
-            subprocess.check_call(('mvn', 'clean'), cwd=src_dir)
 
+    def _get_src_dirs_containing(self, path):
+        return {original for d, original in self._src_dirs.items()
+                if path == d or path.startswith(d + os.sep)}
 
 
-class PipUtil(object):
+    def _walk_dirs(self, top_dir):
+        for root, dirs, files in os.walk(top_dir):
+            dirs[:] = [d for d in dirs if not self._is_ignored(root, d)]
+            yield root, files
 
-    @classmethod
-    def run_pip(cls, *args: str):
-        subprocess.run((cls._get_python_executable(), '-m', 'pip', *args), check=True)
 
-    @classmethod
-    @functools.lru_cache(maxsize=1)
-    def _get_python_executable(cls) -> str:
-        venv_root = pathlib.Path(cls._get_sdk_install_root()) / 'venv'
-        executable_path = venv_root / 'bin/python3.12'
-        if not executable_path.is_file():
-            if venv_root.exists():
-                raise Exception(
-                    f'Expected "{venv_root}" to either not exist or be a Python 3.12 virtualenv.')
-            print('Creating venv at:', venv_root)
-            subprocess.run(
-                    ('python3.12', '-m', 'venv', str(venv_root), '--upgrade-deps'), check=True)
-        return str(executable_path)
+    def _is_ignored(self, parent_dir, dir_name):
+        return (Fingerprint.is_ignored_source_dir(dir_name)
+                or os.path.join(parent_dir, dir_name) in self._ignored_dirs)
 
 
-    @staticmethod
-    def is_project(src_dir):
-        return (Files.path_exists(src_dir, 'pyproject.toml')
-                or Files.path_exists(src_dir, 'setup.py'))
 
-    @staticmethod
-    def is_component(src_dir):
-        return PipUtil.is_project(src_dir) or PipUtil._descriptor_lang_matches(src_dir)
+class InotifyWatcher(SourceWatcher):
+    _IN_MODIFY = 0x2
+    _IN_MOVED_FROM = 0x40
+    _IN_MOVED_TO = 0x80
+    _IN_CREATE = 0x100
+    _IN_DELETE = 0x200
+    _IN_Q_OVERFLOW = 0x4000
+    _IN_IGNORED = 0x8000
+    _IN_ISDIR = 0x40000000
+    _WATCH_MASK = _IN_MODIFY | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+    _EVENT_HEADER = struct.Struct('iIII')
 
-    @staticmethod
-    def _descriptor_lang_matches(src_dir):
+    def __init__(self, src_dirs, ignored_dirs):
+        super(InotifyWatcher, self).__init__(src_dirs, ignored_dirs)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError('The C library does not support inotify.')
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error_code = ctypes.get_errno()
+            raise OSError(error_code, os.strerror(error_code))
+        self._watched_paths = {}
+        try:
+            for src_dir in self._src_dirs:
+                self._add_watches(src_dir)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+    def _add_watches(self, top_dir):
+        for dir_path, _ in self._walk_dirs(top_dir):
+            watch_descriptor = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(dir_path), InotifyWatcher._WATCH_MASK)
+            if watch_descriptor < 0:
+                error_code = ctypes.get_errno()
+                if error_code == errno.ENOENT:
+                    # The directory was deleted while it was being walked.
+                    continue
+                raise OSError(error_code, '%s: %s' % (os.strerror(error_code), dir_path))
+            self._watched_paths[watch_descriptor] = dir_path
+
+
+    def _wait_for_events(self, timeout):
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed_dirs = set()
+        data = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            watch_descriptor, mask, _, name_length = InotifyWatcher._EVENT_HEADER.unpack_from(
+                data, offset)
+            offset += InotifyWatcher._EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b'\0'))
+            offset += name_length
+            if mask & InotifyWatcher._IN_Q_OVERFLOW:
+                # Events were dropped, so assume everything changed.
+                changed_dirs.update(self._src_dirs.values())
+                continue
+            if mask & InotifyWatcher._IN_IGNORED:
+                self._watched_paths.pop(watch_descriptor, None)
+                continue
+            parent_dir = self._watched_paths.get(watch_descriptor)
+            if parent_dir is None:
+                continue
+            if mask & InotifyWatcher._IN_ISDIR:
+                if self._is_ignored(parent_dir, name):
+                    continue
+                if mask & (InotifyWatcher._IN_CREATE | InotifyWatcher._IN_MOVED_TO):
+                    self._add_watches(os.path.join(parent_dir, name))
+            changed_dirs.update(self._get_src_dirs_containing(os.path.join(parent_dir, name)))
+        return changed_dirs
+
+
+
+class PollingWatcher(SourceWatcher):
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, src_dirs, ignored_dirs):
+        super(PollingWatcher, self).__init__(src_dirs, ignored_dirs)
+        self._file_stats = self._get_file_stats()
+
+
+    def _get_file_stats(self):
+        file_stats = {}
+        for src_dir in self._src_dirs:
+            for root, files in self._walk_dirs(src_dir):
+                for file_name in files:
+                    path = os.path.join(root, file_name)
+                    with contextlib.suppress(OSError):
+                        stat = os.stat(path)
+                        file_stats[path] = (stat.st_size, stat.st_mtime_ns)
+        return file_stats
+
+
+    def _wait_for_events(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = PollingWatcher.POLL_INTERVAL
+            if deadline is not None:
+                delay = max(0, min(delay, deadline - time.monotonic()))
+            time.sleep(delay)
+            file_stats = self._get_file_stats()
+            changed_paths = {p for p in file_stats.keys() | self._file_stats.keys()
+                             if file_stats.get(p) != self._file_stats.get(p)}
+            self._file_stats = file_stats
+            if changed_paths or (deadline is not None and time.monotonic() >= deadline):
+                return {d for p in changed_paths for d in self._get_src_dirs_containing(p)}
+
+
+
+class RemoteCache(object):
+    """
+    Client for an HTTP artifact cache. Each entry is an uncompressed tar containing a
+    component's plugin packages, stored at <url>/<key>. The key only depends on the contents of
+    the component's source files and the component's portable build inputs, so it is the same on
+    every host that builds the same source against the same SDK and toolchain. Errors talking to
+    the cache are reported as warnings, so an unavailable cache never fails a build.
+    """
+    TIMEOUT = 30
+
+    def __init__(self, url, read_only):
+        self._url = url.rstrip('/')
+        self._read_only = read_only
+
+    @staticmethod
+    def from_args(cmdline_args):
+        if cmdline_args.remote_cache:
+            return RemoteCache(cmdline_args.remote_cache, cmdline_args.remote_cache_read_only)
+        return None
+
+
+    @staticmethod
+    def get_key(component, fingerprint):
+        # The package names and paths in the package depend on the directory name and type.
+        return Fingerprint.hash_json([fingerprint['source_digest'],
+                                      component.get_portable_build_inputs(),
+                                      type(component).__name__,
+                                      Files.get_leaf(component.src_dir)])
+
+
+    @staticmethod
+    def fetch(remote_cache, component, fingerprint):
+        """
+        :return: The published packages, or None when there is no remote cache entry.
+        """
+        if remote_cache is None:
+            return None
+        url = '%s/%s' % (remote_cache._url, RemoteCache.get_key(component, fingerprint))
+        with BuildTrace.span('remote cache fetch'), component.create_staging_dir() as staging_dir:
+            try:
+                with urllib.request.urlopen(url, timeout=RemoteCache.TIMEOUT) as response, \
+                        tarfile.open(fileobj=response, mode='r|') as tar:
+                    packages = RemoteCache._extract_packages(tar, staging_dir)
+            except urllib.error.HTTPError as err:
+                if err.code != 404:
+                    print_warning('Unable to download %s from the remote cache: %s' % (url, err))
+                return None
+            except (OSError, tarfile.TarError) as err:
+                print_warning('Unable to download %s from the remote cache: %s' % (url, err))
+                return None
+            print('Remote cache hit, downloaded:', component.src_dir)
+            return component.publish_packages(packages, staging_dir)
+
+
+    @staticmethod
+    def _extract_packages(tar, staging_dir):
+        packages = []
+        for member in tar:
+            if not member.isfile() or os.path.basename(member.name) != member.name:
+                raise tarfile.TarError('Unexpected entry in remote cache archive: ' + member.name)
+            package_path = os.path.join(staging_dir, member.name)
+            with open(package_path, 'wb') as f:
+                shutil.copyfileobj(tar.extractfile(member), f)
+            packages.append(package_path)
+        return packages
+
+
+    @staticmethod
+    def store(remote_cache, component, fingerprint, packages):
+        if remote_cache is None or remote_cache._read_only:
+            return
+        url = '%s/%s' % (remote_cache._url, RemoteCache.get_key(component, fingerprint))
+        # The archive is written to a file, rather than memory, because packages may be
+        # several gigabytes. urllib sends file objects in blocks.
+        with tempfile.TemporaryFile() as archive:
+            with tarfile.open(fileobj=archive, mode='w') as tar:
+                for package in packages:
+                    tar.add(package, arcname=os.path.basename(package), filter=normalize_tar_info)
+            archive_size = archive.tell()
+            archive.seek(0)
+            headers = {'Content-Type': 'application/x-tar', 'Content-Length': str(archive_size)}
+            upload_token = os.getenv(RemoteCacheServer.UPLOAD_TOKEN_ENV_VAR)
+            if upload_token:
+                headers['Authorization'] = 'Bearer ' + upload_token
+            request = urllib.request.Request(url, data=archive, method='PUT', headers=headers)
+            try:
+                with BuildTrace.span('remote cache upload'), \
+                        urllib.request.urlopen(request, timeout=RemoteCache.TIMEOUT):
+                    pass
+            except OSError as err:
+                print_warning('Unable to upload %s to the remote cache: %s' % (url, err))
+
+
+
+class RemoteCacheServer(http.server.ThreadingHTTPServer):
+    """
+    Minimal artifact cache server for RemoteCache, started with
+    "build_components.py cache-server". Entries are files in cache_dir. When the total size of
+    the entries exceeds max_size, the least recently used entries are deleted. An entry's
+    modification time records when it was last used, so the order survives restarts.
+
+    Anyone who can upload entries can replace the packages that builds publish. The server only
+    listens on the loopback interface by default, and when upload_token is provided, uploads
+    must include it as a bearer token. Downloads are not authenticated.
+    """
+    UPLOAD_TOKEN_ENV_VAR = 'MPF_REMOTE_CACHE_TOKEN'
+    _KEY_REGEX = re.compile(r'/([0-9a-f]{64})')
+
+    def __init__(self, address, cache_dir, max_size, upload_token=None):
+        super(RemoteCacheServer, self).__init__(address, _RemoteCacheRequestHandler)
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self._upload_token = upload_token
+        self._lock = threading.Lock()
+        self._entry_sizes = collections.OrderedDict()
+        Files.make_dir(self.cache_dir)
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if RemoteCacheServer._KEY_REGEX.fullmatch('/' + name):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime_ns, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._entry_sizes[name] = size
+
+    @staticmethod
+    def main(arg_strings):
+        parser = argparse.ArgumentParser(
+            prog='build_components.py cache-server',
+            description='Serves the artifact cache used by "build_components.py --remote-cache".')
+        parser.add_argument(
+            '--listen', type=WorkerProtocol.parse_address, default=('127.0.0.1', 8470),
+            help='Address to listen on. Defaults to 127.0.0.1:8470. When other hosts can connect, '
+                 'set the %s environment variable on the server and on every build host, so '
+                 'that only builds can upload entries.' % RemoteCacheServer.UPLOAD_TOKEN_ENV_VAR,
+            metavar='<host>:<port>')
+        parser.add_argument(
+            '--max-size', type=parse_size, default='20G',
+            help='Maximum total size of the cache entries. Defaults to 20G.', metavar='<size>')
+        parser.add_argument(
+            '--cache-dir', default='mpf-remote-cache',
+            help='Directory where cache entries are stored.', metavar='<cache_dir>')
+        args = parser.parse_args(arg_strings)
+        upload_token = os.getenv(RemoteCacheServer.UPLOAD_TOKEN_ENV_VAR)
+        if not upload_token and args.listen[0] not in ('127.0.0.1', 'localhost', '::1'):
+            print_warning('%s is not set, so any host that can connect to %s can replace cache '
+                          'entries.' % (RemoteCacheServer.UPLOAD_TOKEN_ENV_VAR, args.listen[0]))
+        server = RemoteCacheServer(args.listen, args.cache_dir, args.max_size, upload_token)
+        print('Remote cache listening on %s:%s, storing up to %s in %s.' % (
+            server.server_address[:2] + (format_size(args.max_size), server.cache_dir)))
+        server.serve_forever()
+
+
+    def get_key(self, url_path):
+        match = RemoteCacheServer._KEY_REGEX.fullmatch(url_path)
+        return match.group(1) if match else None
+
+
+    def is_upload_authorized(self, authorization_header):
+        if not self._upload_token:
+            return True
+        expected = 'Bearer ' + self._upload_token
+        return hmac.compare_digest(expected.encode(), (authorization_header or '').encode())
+
+
+    def open_entry(self, key):
+        """ :return: The open entry file and its size, or None if there is no entry for key. """
+        with self._lock:
+            if key not in self._entry_sizes:
+                return None
+            path = os.path.join(self.cache_dir, key)
+            entry_file = open(path, 'rb')
+            self._entry_sizes.move_to_end(key)
+            os.utime(path)
+            return entry_file, self._entry_sizes[key]
+
+
+    def store_entry(self, key, input_stream, size):
+        """ :return: False if the entry is larger than the whole cache. """
+        if size > self.max_size:
+            return False
+        path = os.path.join(self.cache_dir, key)
+        temp_path = '%s.%s.tmp' % (path, threading.get_ident())
+        try:
+            with open(temp_path, 'wb') as f:
+                remaining = size
+                while remaining > 0:
+                    chunk = input_stream.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        raise EOFError('The request body ended before Content-Length bytes.')
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            with self._lock:
+                os.replace(temp_path, path)
+                self._entry_sizes[key] = size
+                self._entry_sizes.move_to_end(key)
+                self._evict()
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return True
+
+
+    def _evict(self):
+        total_size = sum(self._entry_sizes.values())
+        while total_size > self.max_size:
+            key, size = self._entry_sizes.popitem(last=False)
+            os.remove(os.path.join(self.cache_dir, key))
+            total_size -= size
+
+
+
+class _RemoteCacheRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        key = self.server.get_key(self.path)
+        entry = key and self.server.open_entry(key)
+        if not entry:
+            self._send_empty_response(404)
+            return
+        entry_file, size = entry
+        with entry_file:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-tar')
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            shutil.copyfileobj(entry_file, self.wfile)
+
+    def do_PUT(self):
+        if not self.server.is_upload_authorized(self.headers['Authorization']):
+            self.close_connection = True
+            self._send_empty_response(401)
+            return
+        key = self.server.get_key(self.path)
+        if not key:
+            self._send_empty_response(404)
+            return
+        try:
+            size = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self._send_empty_response(411)
+            return
+        if self.server.store_entry(key, self.rfile, size):
+            self._send_empty_response(201)
+        else:
+            self.close_connection = True
+            self._send_empty_response(413)
+
+    def _send_empty_response(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+
+class WorkerProtocol(object):
+    """
+    Messages between the coordinator and build workers are JSON objects sent with
+    multiprocessing.connection, which also authenticates both ends using a shared secret.
+    Package and source archive contents follow their messages as a series of byte strings of at
+    most CHUNK_SIZE bytes, ending with an empty byte string, so files of any size can be sent
+    without reading them in to memory.
+    """
+    AUTHKEY_ENV_VAR = 'MPF_BUILD_WORKER_AUTHKEY'
+    DEFAULT_PORT = 7465
+    CHUNK_SIZE = 1024 * 1024
+
+    @staticmethod
+    def get_authkey():
+        authkey = os.getenv(WorkerProtocol.AUTHKEY_ENV_VAR)
+        if not authkey:
+            raise Exception('The %s environment variable must be set.'
+                            % WorkerProtocol.AUTHKEY_ENV_VAR)
+        return authkey.encode()
+
+    @staticmethod
+    def parse_address(address_str):
+        host, _, port = address_str.strip().rpartition(':')
+        if not host:
+            return address_str.strip(), WorkerProtocol.DEFAULT_PORT
+        return host, int(port)
+
+    @staticmethod
+    def send(conn, message):
+        conn.send_bytes(json.dumps(message).encode())
+
+    @staticmethod
+    def receive(conn):
+        return json.loads(conn.recv_bytes().decode())
+
+    @staticmethod
+    def send_file(conn, path):
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(WorkerProtocol.CHUNK_SIZE)
+                conn.send_bytes(chunk)
+                if not chunk:
+                    return
+
+    @staticmethod
+    def receive_file(conn, path):
+        with open(path, 'wb') as f:
+            while True:
+                chunk = conn.recv_bytes()
+                if not chunk:
+                    return
+                f.write(chunk)
+
+    @staticmethod
+    def create_source_archive(src_dir, archive_path):
+        """ Writes the gzipped tar of src_dir, without hidden and build output directories. """
+        def exclude_build_output(tar_info):
+            dir_names = tar_info.name.split('/')[1:]
+            if any(Fingerprint.is_ignored_source_dir(d) for d in dir_names[:-1]) or (
+                    tar_info.isdir() and dir_names and
+                    Fingerprint.is_ignored_source_dir(dir_names[-1])):
+                return None
+            return tar_info
+
+        with tarfile.open(archive_path, mode='w:gz', compresslevel=1) as tar:
+            tar.add(src_dir, arcname='src', filter=exclude_build_output)
+
+
+
+class WorkerDiedError(Exception):
+    pass
+
+
+
+class WorkerPool(object):
+    """
+    Coordinator side of distributed builds. Component builds are sent to the worker with the
+    lowest fraction of its capacity in use. While a worker builds, it sends a heartbeat every
+    BuildWorker.HEARTBEAT_INTERVAL seconds. If a worker disconnects, or sends nothing for
+    HEARTBEAT_TIMEOUT seconds, it is considered dead and the build is requeued on another worker.
+    """
+    HEARTBEAT_TIMEOUT = 30
+    _current = None
+
+    def __init__(self, addresses, cmdline_args):
+        self._authkey = WorkerProtocol.get_authkey()
+        self._send_sources = cmdline_args.send_sources
+        self._args = {}
+        for name, value in vars(cmdline_args).items():
+            with contextlib.suppress(TypeError):
+                json.dumps(value)
+                self._args[name] = value
+        self._condition = threading.Condition()
+        self._workers = []
+        for address in addresses:
+            try:
+                with multiprocessing.connection.Client(address, authkey=self._authkey) as conn:
+                    WorkerProtocol.send(conn, {'type': 'hello'})
+                    capacity = WorkerProtocol.receive(conn)['capacity']
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as err:
+                print_warning('Unable to connect to build worker %s:%s: %s' % (address + (err,)))
+                continue
+            print('Connected to build worker %s:%s with capacity %d.' % (address + (capacity,)))
+            self._workers.append({'address': address, 'capacity': capacity, 'in_flight': 0,
+                                  'alive': True})
+        if not self._workers:
+            raise Exception('Unable to connect to any of the build workers.')
+        self.total_capacity = sum(w['capacity'] for w in self._workers)
+
+    @staticmethod
+    def connect(cmdline_args):
+        if cmdline_args.workers:
+            return WorkerPool(cmdline_args.workers, cmdline_args)
+        return None
+
+    @staticmethod
+    @contextlib.contextmanager
+    def running(worker_pool):
+        WorkerPool._current = worker_pool
+        try:
+            yield worker_pool
+        finally:
+            WorkerPool._current = None
+
+    @staticmethod
+    def is_running():
+        return WorkerPool._current is not None
+
+
+    @staticmethod
+    def build_remotely(component, staging_dir):
+        """
+        :return: Paths to the packages the worker built, copied in to staging_dir.
+        """
+        pool = WorkerPool._current
+        with Files.create_temp_dir() as temp_dir:
+            source_archive = None
+            if pool._send_sources:
+                source_archive = os.path.join(temp_dir, 'sources.tar.gz')
+                WorkerProtocol.create_source_archive(component.src_dir, source_archive)
+            while True:
+                worker = pool._acquire_worker()
+                try:
+                    with BuildTrace.span('remote build', worker='%s:%s' % worker['address']):
+                        return pool._build_on_worker(worker, component, staging_dir,
+                                                     source_archive)
+                except WorkerDiedError as err:
+                    print_warning('Build worker %s:%s died while building %s: %s. Requeueing the '
+                                  'build.' % (worker['address'] + (component.src_dir, err)))
+                    pool._mark_dead(worker)
+                finally:
+                    pool._release_worker(worker)
+
+
+    def _acquire_worker(self):
+        with self._condition:
+            while True:
+                alive = [w for w in self._workers if w['alive']]
+                if not alive:
+                    raise Exception('All of the build workers have died.')
+                available = [w for w in alive if w['in_flight'] < w['capacity']]
+                if available:
+                    worker = min(available, key=lambda w: w['in_flight'] / w['capacity'])
+                    worker['in_flight'] += 1
+                    return worker
+                self._condition.wait()
+
+    def _release_worker(self, worker):
+        with self._condition:
+            worker['in_flight'] -= 1
+            self._condition.notify_all()
+
+    def _mark_dead(self, worker):
+        with self._condition:
+            worker['alive'] = False
+            self._condition.notify_all()
+
+
+    def _build_on_worker(self, worker, component, staging_dir, source_archive):
+        request = {'type': 'build', 'component_type': type(component).__name__,
+                   'src_dir': component.src_dir, 'args': self._args,
+                   'has_sources': source_archive is not None}
+        try:
+            with multiprocessing.connection.Client(worker['address'],
+                                                   authkey=self._authkey) as conn:
+                WorkerProtocol.send(conn, request)
+                if source_archive is not None:
+                    WorkerProtocol.send_file(conn, source_archive)
+                response = WorkerPool._receive_result(conn)
+                if response['type'] == 'error':
+                    # The worker is still working, so the build is not requeued. The same error
+                    # would most likely occur on every worker.
+                    raise Exception('Failed to build on worker %s:%s: %s\n%s' % (
+                        worker['address'] + (response['message'], response['log_tail'])))
+                packages = []
+                for package_name in response['packages']:
+                    package_path = os.path.join(staging_dir, os.path.basename(package_name))
+                    WorkerProtocol.receive_file(conn, package_path)
+                    packages.append(package_path)
+                return packages
+        except (OSError, EOFError, multiprocessing.AuthenticationError) as err:
+            raise WorkerDiedError(str(err) or type(err).__name__)
+
+
+    @staticmethod
+    def _receive_result(conn):
+        while True:
+            if not conn.poll(WorkerPool.HEARTBEAT_TIMEOUT):
+                raise WorkerDiedError('No heartbeat for %s seconds' % WorkerPool.HEARTBEAT_TIMEOUT)
+            message = WorkerProtocol.receive(conn)
+            if message['type'] != 'heartbeat':
+                return message
+
+
+
+class BuildWorker(object):
+    """
+    Worker side of distributed builds, started with "build_components.py worker". Each
+    connection carries one request. At most "capacity" components are built at once.
+    """
+    HEARTBEAT_INTERVAL = 5
+
+    def __init__(self, address, capacity, base_build_dir):
+        self._listener = multiprocessing.connection.Listener(
+            address, authkey=WorkerProtocol.get_authkey())
+        self.address = self._listener.address
+        self._capacity = capacity
+        self._build_slots = threading.BoundedSemaphore(capacity)
+        self._base_build_dir = os.path.abspath(base_build_dir)
+        self._closed = False
+
+    @staticmethod
+    def main(arg_strings):
+        parser = argparse.ArgumentParser(
+            prog='build_components.py worker',
+            description='Builds components sent by "build_components.py --workers".')
+        parser.add_argument(
+            '--listen', type=WorkerProtocol.parse_address,
+            default=('0.0.0.0', WorkerProtocol.DEFAULT_PORT),
+            help='Address to listen on. Defaults to 0.0.0.0:%s.' % WorkerProtocol.DEFAULT_PORT,
+            metavar='<host>:<port>')
+        parser.add_argument(
+            '--capacity', type=int, default=multiprocessing.cpu_count(),
+            help='Maximum number of components to build at once. Defaults to the number of CPUs.',
+            metavar='<num_builds>')
+        parser.add_argument(
+            '-b', '--build-dir', default='mpf-build-worker',
+            help='Path to the directory where builds will occur.',
+            metavar='<build_dir>')
+        args = parser.parse_args(arg_strings)
+        if not os.getenv(WorkerProtocol.AUTHKEY_ENV_VAR):
+            parser.error('The %s environment variable must be set.'
+                         % WorkerProtocol.AUTHKEY_ENV_VAR)
+        worker = BuildWorker(args.listen, args.capacity, args.build_dir)
+        print('Build worker listening on %s:%s with capacity %d.'
+              % (worker.address + (args.capacity,)))
+        worker.serve_forever()
+
+
+    def serve_forever(self):
+        while not self._closed:
+            try:
+                conn = self._listener.accept()
+            except multiprocessing.AuthenticationError as err:
+                print_warning('Rejected a connection: %s' % err)
+                continue
+            except OSError:
+                if self._closed:
+                    return
+                raise
+            threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+    def close(self):
+        self._closed = True
+        self._listener.close()
+
+
+    def _handle_connection(self, conn):
+        with conn:
+            try:
+                request = WorkerProtocol.receive(conn)
+                if request['type'] == 'hello':
+                    WorkerProtocol.send(conn, {'type': 'hello', 'capacity': self._capacity})
+                elif request['type'] == 'build':
+                    self._handle_build(conn, request)
+            except (OSError, EOFError):
+                pass  # The coordinator disconnected. It will requeue the build if needed.
+            except Exception as err:
+                # e.g. an unknown component type or an invalid source archive. The coordinator
+                # fails the build rather than treating this worker as dead.
+                print('Failed to handle request:', err)
+                with contextlib.suppress(OSError):
+                    WorkerProtocol.send(conn, {'type': 'error', 'message': str(err),
+                                               'log_tail': traceback.format_exc()})
+
+
+    def _handle_build(self, conn, request):
+        with Files.create_temp_dir() as temp_dir:
+            source_archive = None
+            if request['has_sources']:
+                source_archive = os.path.join(temp_dir, 'sources.tar.gz')
+                WorkerProtocol.receive_file(conn, source_archive)
+            self._handle_build_with_sources(conn, request, source_archive)
+
+
+    def _handle_build_with_sources(self, conn, request, source_archive):
+        send_lock = threading.Lock()
+        stop_heartbeats = threading.Event()
+
+        def send_heartbeats():
+            while not stop_heartbeats.wait(BuildWorker.HEARTBEAT_INTERVAL):
+                with send_lock, contextlib.suppress(OSError):
+                    WorkerProtocol.send(conn, {'type': 'heartbeat'})
+
+        heartbeat_thread = threading.Thread(target=send_heartbeats, daemon=True)
+        heartbeat_thread.start()
+        try:
+            with self._build_slots:
+                self._build(conn, request, source_archive, send_lock)
+        finally:
+            stop_heartbeats.set()
+            heartbeat_thread.join()
+
+
+    def _build(self, conn, request, source_archive, send_lock):
+        cmdline_args = argparse.Namespace(**request['args'])
+        cmdline_args.build_dir = self._base_build_dir
+        src_dir = request['src_dir']
+        if source_archive is not None:
+            src_dir = self._extract_sources(src_dir, source_archive)
+        component_types = {t.__name__: t for t in (CppComponent, JavaComponent, PythonComponent)}
+        component = component_types[request['component_type']](src_dir, cmdline_args)
+        log_path = ProjectLog.get_path(
+            os.path.join(self._base_build_dir, ProjectLog.DIR_NAME), component)
+        print('Building', request['src_dir'])
+        with PackageStore(self._base_build_dir).create_staging_dir() as staging_dir:
+            try:
+                with ProjectLog.capturing(log_path):
+                    packages = component.build_package(staging_dir)
+            except Exception as err:
+                print('Failed to build', request['src_dir'])
+                with send_lock:
+                    WorkerProtocol.send(conn, {'type': 'error', 'message': str(err),
+                                               'log_tail': ProjectLog.read_tail(log_path)})
+                return
+            with send_lock:
+                WorkerProtocol.send(conn, {'type': 'result',
+                                           'packages': [os.path.basename(p) for p in packages]})
+                for package in packages:
+                    WorkerProtocol.send_file(conn, package)
+        print('Finished building', request['src_dir'])
+
+
+    def _extract_sources(self, original_src_dir, source_archive):
+        """
+        Sources are extracted to the same directory each time a component is built, so that
+        build directories derived from the source path, like C++ build directories, are reused.
+        """
+        src_dir = os.path.join(self._base_build_dir, 'worker-sources',
+                               original_src_dir.strip('/').replace('/', '-'),
+                               Files.get_leaf(original_src_dir))
+        if os.path.exists(src_dir):
+            shutil.rmtree(src_dir)
+        Files.make_dir(os.path.dirname(src_dir))
+        with tarfile.open(source_archive) as tar:
+            members = []
+            for member in tar.getmembers():
+                if member.name != 'src' and not member.name.startswith('src/'):
+                    raise Exception('Unexpected path in source archive: ' + member.name)
+                member.name = os.path.join(Files.get_leaf(original_src_dir), member.name[4:])
+                members.append(member)
+            extract_kwargs = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+            tar.extractall(os.path.dirname(src_dir), members, **extract_kwargs)
+        return src_dir
+
+
+
+class BuildHistory(object):
+    """
+    Records how long each project took to build and how much memory it used, so that later runs
+    can estimate how long each build will take and how much memory it will need.
+    """
+    FILE_NAME = 'build-history.json'
+
+    def __init__(self, base_build_dir):
+        self._path = os.path.join(base_build_dir, BuildHistory.FILE_NAME)
+        self._lock = threading.Lock()
+        self._entries = Files.load_json(self._path, {})
+
+    def get_estimated_duration(self, project):
+        with self._lock:
+            duration = self._entries.get(project.src_dir, {}).get('duration')
+        return project.default_build_duration if duration is None else duration
+
+    def record_duration(self, project, duration):
+        with self._lock:
+            self._entries.setdefault(project.src_dir, {})['duration'] = duration
+
+    def get_estimated_peak_memory(self, project):
+        with self._lock:
+            peak_memory = self._entries.get(project.src_dir, {}).get('peak_memory')
+        return project.default_peak_memory if peak_memory is None else peak_memory
+
+    def record_peak_memory(self, project, peak_memory):
+        with self._lock:
+            self._entries.setdefault(project.src_dir, {})['peak_memory'] = peak_memory
+
+    def save(self):
+        with self._lock:
+            Files.write_json(self._path, self._entries)
+
+
+
+class BuildManifest(object):
+    """
+    Persists a fingerprint of everything that goes in to building each component, so that
+    components whose sources, SDK, toolchain, and arguments have not changed since their last
+    successful build, and whose plugin packages are still present, can be skipped.
+    """
+    FILE_NAME = 'build-manifest.json'
+
+    def __init__(self, base_build_dir, force_rebuild=False):
+        self._path = os.path.join(base_build_dir, BuildManifest.FILE_NAME)
+        self._force_rebuild = force_rebuild
+        self._lock = threading.Lock()
+        self._entries = Files.load_json(self._path, {})
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def delete(base_build_dir):
+        path = os.path.join(base_build_dir, BuildManifest.FILE_NAME)
+        if os.path.exists(path):
+            print('Deleting', path)
+            os.remove(path)
+
+    @staticmethod
+    def is_cacheable(project):
+        return isinstance(project, MpfComponent)
+
+
+    def get_fingerprint(self, project):
+        with self._lock:
+            previous_file_hashes = self._entries.get(project.src_dir, {}).get('file_hashes', {})
+        source_digest, file_hashes = Fingerprint.hash_source_tree(
+            project.src_dir, previous_file_hashes)
+        inputs_digest = Fingerprint.hash_json(project.get_build_inputs())
+        return {
+            'digest': Fingerprint.hash_json((source_digest, inputs_digest)),
+            'source_digest': source_digest,
+            'file_hashes': file_hashes
+        }
+
+
+    def is_up_to_date(self, project, fingerprint):
+        with self._lock:
+            entry = self._entries.get(project.src_dir)
+            is_hit = (not self._force_rebuild
+                      and entry is not None
+                      and entry['digest'] == fingerprint['digest']
+                      and BuildManifest._packages_unchanged(entry['packages']))
+            if is_hit:
+                self._hits += 1
+                # Pick up any refreshed file stats even though the contents are the same.
+                entry['file_hashes'] = fingerprint['file_hashes']
+            else:
+                self._misses += 1
+            return is_hit
+
+
+    @staticmethod
+    def _packages_unchanged(recorded_packages):
+        for path, (size, mtime_ns) in recorded_packages.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                return False
+        return True
+
+
+    def record(self, project, fingerprint, packages):
+        recorded_packages = {}
+        for package in packages:
+            stat = os.stat(package)
+            recorded_packages[os.path.abspath(package)] = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            self._entries[project.src_dir] = {
+                'digest': fingerprint['digest'],
+                'file_hashes': fingerprint['file_hashes'],
+                'packages': recorded_packages
+            }
+
+    def remove(self, project):
+        with self._lock:
+            self._entries.pop(project.src_dir, None)
+
+
+    def save(self):
+        with self._lock:
+            Files.write_json(self._path, self._entries)
+
+    def print_summary(self):
+        if self._hits or self._misses:
+            print('Build cache: %s hit(s), %s miss(es).' % (self._hits, self._misses))
+
+
+
+class Fingerprint(object):
+    _IGNORED_SOURCE_DIRS = ('target', 'build', '__pycache__')
+
+    @staticmethod
+    def hash_source_tree(src_dir, previous_file_hashes):
+        """
+        Hashes the contents of every file under src_dir, skipping hidden directories and
+        directories that contain build output.
+        :param previous_file_hashes: Mapping from relative path to (size, mtime_ns, digest)
+            recorded on a previous run. Files whose size and modification time have not changed
+            are not re-read.
+        :return: Tuple containing the digest of the whole tree and the updated mapping.
+        """
+        file_hashes = {}
+        for root, dirs, files in os.walk(src_dir):
+            dirs[:] = [d for d in dirs if not Fingerprint.is_ignored_source_dir(d)]
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                rel_path = os.path.relpath(path, src_dir)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # Broken symlink
+                previous = previous_file_hashes.get(rel_path)
+                if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns:
+                    digest = previous[2]
+                else:
+                    digest = Fingerprint.hash_file(path)
+                file_hashes[rel_path] = (stat.st_size, stat.st_mtime_ns, digest)
+
+        tree_digest = Fingerprint.hash_json(
+            sorted((rel_path, digest) for rel_path, (_, _, digest) in file_hashes.items()))
+        return tree_digest, file_hashes
+
+    @staticmethod
+    def is_ignored_source_dir(dir_name):
+        return (dir_name.startswith('.')
+                or dir_name.endswith('.egg-info')
+                or dir_name in Fingerprint._IGNORED_SOURCE_DIRS)
+
+
+    @staticmethod
+    def hash_file(path):
+        file_hash = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+
+    @staticmethod
+    def hash_tree_stats(path, excluded_dirs=()):
+        """
+        Cheaply fingerprints an installed tree, like an SDK install directory, using the size and
+        modification time of each file rather than its contents.
+        """
+        entries = []
+        for root, dirs, files in os.walk(path):
+            if root == path:
+                dirs[:] = [d for d in dirs if d not in excluded_dirs]
+            for file_name in files:
+                file_path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                entries.append((os.path.relpath(file_path, path), stat.st_size, stat.st_mtime_ns))
+        return Fingerprint.hash_json(sorted(entries))
+
+
+    _content_digests_lock = threading.Lock()
+    _content_digests = {}
+
+    @staticmethod
+    def hash_tree_contents(path, excluded_dirs=(), excluded_files=(), zip_suffixes=(),
+                           excluded_zip_entries=()):
+        """
+        Fingerprints an installed tree using only relative paths and file contents, so identical
+        trees have the same digest on every host, regardless of where they are installed and when
+        they were written. The digest is recomputed only when hash_tree_stats changes.
+        :param excluded_files: Names of files that are skipped, e.g. files with local timestamps.
+        :param zip_suffixes: Files whose names end with one of the suffixes, like jars and wheels,
+            are hashed with hash_zip_entries, because the archives contain build timestamps.
+        :param excluded_zip_entries: Passed to hash_zip_entries.
+        """
+        cache_key = (path, excluded_dirs, excluded_files, zip_suffixes, excluded_zip_entries,
+                     Fingerprint.hash_tree_stats(path, excluded_dirs))
+        with Fingerprint._content_digests_lock:
+            digest = Fingerprint._content_digests.get(cache_key)
+        if digest is not None:
+            return digest
+        entries = []
+        for root, dirs, files in os.walk(path):
+            if root == path:
+                dirs[:] = [d for d in dirs if d not in excluded_dirs]
+            for file_name in files:
+                if file_name in excluded_files:
+                    continue
+                file_path = os.path.join(root, file_name)
+                rel_path = os.path.relpath(file_path, path)
+                try:
+                    if zip_suffixes and file_name.endswith(zip_suffixes):
+                        file_digest = Fingerprint.hash_zip_entries(file_path,
+                                                                   excluded_zip_entries)
+                    else:
+                        file_digest = Fingerprint.hash_file(file_path)
+                except OSError:
+                    continue
+                entries.append((rel_path, file_digest))
+        digest = Fingerprint.hash_json(sorted(entries))
+        with Fingerprint._content_digests_lock:
+            Fingerprint._content_digests[cache_key] = digest
+        return digest
+
+
+    @staticmethod
+    def hash_zip_entries(path, excluded_entries=()):
+        """
+        Fingerprints a zip archive using the name and CRC-32 of each entry, which, unlike the
+        archive's bytes, do not change when the same files are archived again later.
+        :param excluded_entries: Base names of entries that are skipped, e.g. files that record
+            when or where the archive was built.
+        """
+        try:
+            with zipfile.ZipFile(path) as archive:
+                entries = sorted((info.filename, info.CRC) for info in archive.infolist()
+                                 if os.path.basename(info.filename) not in excluded_entries)
+        except zipfile.BadZipFile:
+            return Fingerprint.hash_file(path)
+        return Fingerprint.hash_json(entries)
+
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get_tool_version(*command):
+        try:
+            proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                  universal_newlines=True)
+            return proc.stdout.strip()
+        except OSError:
+            return 'not found'
+
+
+    @staticmethod
+    def hash_json(obj):
+        return hashlib.sha256(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+
+
+
+class BuildTrace(object):
+    """
+    Records a span for each phase of each build and writes them out in the Chrome trace event
+    format. Each build slot (thread) is shown as a separate row.
+    """
+    _current = None
+
+    def __init__(self):
+        self._start_time = time.monotonic()
+        self._lock = threading.Lock()
+        self._events = []
+        self._slot_ids = {}
+        self._thread_local = threading.local()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def recording(trace_file):
+        if not trace_file:
+            yield None
+            return
+        trace = BuildTrace()
+        BuildTrace._current = trace
+        try:
+            yield trace
+        finally:
+            BuildTrace._current = None
+            trace._write(trace_file)
+            print('Build trace written to:', trace_file)
+
+
+    @staticmethod
+    @contextlib.contextmanager
+    def project_span(project):
+        trace = BuildTrace._current
+        if trace is None:
+            yield
+            return
+        trace._thread_local.project = project.src_dir
+        try:
+            with BuildTrace.span(Files.get_leaf(project.src_dir), category='project'):
+                yield
+        finally:
+            trace._thread_local.project = None
+
+
+    @staticmethod
+    @contextlib.contextmanager
+    def span(name, category='phase', **args):
+        trace = BuildTrace._current
+        if trace is None:
+            yield
+            return
+        project = getattr(trace._thread_local, 'project', None)
+        if project:
+            args['project'] = project
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            trace._add_event(name, category, start_time, time.monotonic(), args)
+
+
+    def _add_event(self, name, category, start_time, end_time, args):
+        with self._lock:
+            slot_id = self._slot_ids.setdefault(threading.get_ident(), len(self._slot_ids))
+            self._events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': (start_time - self._start_time) * 1e6,
+                'dur': (end_time - start_time) * 1e6,
+                'pid': os.getpid(),
+                'tid': slot_id,
+                'args': args
+            })
+
+
+    def _write(self, trace_file):
+        with self._lock:
+            thread_name_events = [
+                {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': slot_id,
+                 'args': {'name': 'build slot %s' % slot_id}}
+                for slot_id in self._slot_ids.values()]
+            Files.write_json(trace_file, {
+                'traceEvents': thread_name_events + self._events,
+                'displayTimeUnit': 'ms'
+            })
+
+
+
+class JobServer(object):
+    """
+    GNU make compatible jobserver. The jobserver is a pipe that initially contains one byte
+    (token) per job slot. Every process started through SubprocessUtil holds a token while it
+    runs, and "make" processes read additional tokens from the pipe for each extra parallel job,
+    so the total number of jobs across all simultaneous builds never exceeds the number of slots.
+    """
+    _current = None
+
+    def __init__(self, num_jobs):
+        self.num_jobs = num_jobs
+        self._read_fd, self._write_fd = os.pipe()
+        os.write(self._write_fd, b'+' * num_jobs)
+        # Opening the pipe through /proc creates a separate open file description, so it can be
+        # made non-blocking without affecting the make processes that share _read_fd.
+        self._non_blocking_read_fd = os.open('/proc/self/fd/%s' % self._read_fd,
+                                             os.O_RDONLY | os.O_NONBLOCK)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def running(num_jobs):
+        if not num_jobs:
+            yield None
+            return
+        job_server = JobServer(num_jobs)
+        JobServer._current = job_server
+        try:
+            yield job_server
+        finally:
+            JobServer._current = None
+            os.close(job_server._read_fd)
+            os.close(job_server._write_fd)
+            os.close(job_server._non_blocking_read_fd)
+
+    @staticmethod
+    def is_running():
+        return JobServer._current is not None
+
+
+    @staticmethod
+    @contextlib.contextmanager
+    def job_slot(max_slots=1):
+        """
+        Blocks until a token is available and holds it for the duration of the "with" block.
+        :param max_slots: After the first token is acquired, up to max_slots - 1 additional tokens
+            are taken if they are immediately available. This is used for tools, like Ninja, that
+            can not read tokens from the jobserver themselves.
+        :return: The number of tokens held, or max_slots when no jobserver is running.
+        """
+        job_server = JobServer._current
+        if job_server is None:
+            yield max_slots
+            return
+        with BuildTrace.span('wait for job slot'):
+            tokens = os.read(job_server._read_fd, 1)
+        try:
+            if max_slots > 1:
+                with contextlib.suppress(BlockingIOError):
+                    tokens += os.read(job_server._non_blocking_read_fd,
+                                      min(max_slots, job_server.num_jobs) - 1)
+            yield len(tokens)
+        finally:
+            os.write(job_server._write_fd, tokens)
+
+
+    @staticmethod
+    def get_make_env():
+        job_server = JobServer._current
+        fds = '%s,%s' % (job_server._read_fd, job_server._write_fd)
+        if JobServer._make_supports_jobserver_auth():
+            make_flags = ' -j --jobserver-auth=' + fds
+        else:
+            make_flags = ' -j --jobserver-fds=' + fds
+        return {'MAKEFLAGS': make_flags}
+
+    @staticmethod
+    def get_fds():
+        job_server = JobServer._current
+        return job_server._read_fd, job_server._write_fd
+
+    @staticmethod
+    def _make_supports_jobserver_auth():
+        # --jobserver-auth replaced --jobserver-fds in GNU make 4.2.
+        version_output = Fingerprint.get_tool_version('make', '--version')
+        try:
+            version = tuple(int(v) for v in version_output.split()[2].split('.')[:2])
+        except (IndexError, ValueError):
+            return True
+        return version >= (4, 2)
+
+
+
+class ResourceMonitor(object):
+    """
+    Samples the memory used by the processes of each running build, records each project's peak
+    memory use in the build history, and decides whether the host has enough memory and CPU to
+    start another build. Every process started through SubprocessUtil is the leader of a new
+    session, so a build's memory use is the total resident set size of the processes in the
+    sessions the build started, or the memory use of the build's cgroup when --build-cgroup is
+    used.
+    """
+    _current = None
+    SAMPLE_INTERVAL = 1.0
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+    def __init__(self, build_history, admission_control=False, memory_reserve=0, max_load=None,
+                 memory_limit=None, cgroup_dir=None):
+        self._build_history = build_history
+        self._admission_control = admission_control
+        self._memory_reserve = memory_reserve
+        self._max_load = max_load or os.cpu_count()
+        self._memory_limit = memory_limit
+        self._cgroup_dir = cgroup_dir
+        self._lock = threading.Lock()
+        self._thread_local = threading.local()
+        # Mapping from each running project to a dict with its sampled memory use.
+        self._running = {}
+        # Mapping from session id to the project that started the session.
+        self._sessions = {}
+        self._num_cgroups = 0
+        self._stop_sampling = threading.Event()
+        if cgroup_dir:
+            ResourceMonitor._prepare_cgroup(cgroup_dir)
+
+    @staticmethod
+    def from_args(cmdline_args, build_history):
+        if not (cmdline_args.admission_control or cmdline_args.build_memory_limit
+                or cmdline_args.build_cgroup):
+            return None
+        return ResourceMonitor(build_history, cmdline_args.admission_control,
+                               cmdline_args.memory_reserve, cmdline_args.max_load,
+                               cmdline_args.build_memory_limit, cmdline_args.build_cgroup)
+
+
+    @staticmethod
+    @contextlib.contextmanager
+    def running(monitor):
+        if monitor is None:
+            yield None
+            return
+        ResourceMonitor._current = monitor
+        sampler = threading.Thread(target=monitor._sample_until_stopped, daemon=True)
+        sampler.start()
+        try:
+            yield monitor
+        finally:
+            ResourceMonitor._current = None
+            monitor._stop_sampling.set()
+            sampler.join()
+
+
+    @staticmethod
+    @contextlib.contextmanager
+    def tracking(project):
+        """ Attributes the processes started by the current thread to project. """
+        monitor = ResourceMonitor._current
+        if monitor is None:
+            yield
+            return
+        cgroup = monitor._create_cgroup(project)
+        with monitor._lock:
+            monitor._running[project] = {'current': 0, 'peak': 0, 'started_processes': False,
+                                         'cgroup': cgroup}
+        monitor._thread_local.project = project
+        try:
+            yield
+        finally:
+            monitor._thread_local.project = None
+            with monitor._lock:
+                usage = monitor._running.pop(project)
+                monitor._sessions = {s: p for s, p in monitor._sessions.items() if p is not project}
+            if cgroup:
+                usage['peak'] = max(usage['peak'],
+                                    ResourceMonitor._read_cgroup_int(cgroup, 'memory.peak') or 0)
+                with contextlib.suppress(OSError):
+                    os.rmdir(cgroup)
+            if usage['peak'] or not usage['started_processes']:
+                # When no processes were started, the build only used memory in this process.
+                monitor._build_history.record_peak_memory(project, usage['peak'])
+
+
+    @staticmethod
+    def get_preexec_fn():
+        """
+        :return: None, or a function to run in the child process before the command is executed,
+            that moves the child in to the current project's cgroup, or limits its address space
+            when no cgroup is used. Applying the limit before exec means that none of the
+            command's memory escapes it. The function only makes system calls, because the child
+            of a multi-threaded process must not take locks that other threads may have held
+            when it was forked.
+        """
+        monitor = ResourceMonitor._current
+        project = monitor and getattr(monitor._thread_local, 'project', None)
+        if project is None:
+            return None
+        with monitor._lock:
+            cgroup = monitor._running[project]['cgroup']
+        if cgroup:
+            procs_path = os.path.join(cgroup, 'cgroup.procs')
+
+            def join_cgroup():
+                # Writing 0 moves the writing process.
+                fd = os.open(procs_path, os.O_WRONLY)
+                try:
+                    os.write(fd, b'0')
+                finally:
+                    os.close(fd)
+            return join_cgroup
+        if monitor._memory_limit:
+            limit = (monitor._memory_limit, monitor._memory_limit)
+            return lambda: resource.setrlimit(resource.RLIMIT_AS, limit)
+        return None
+
+
+    @staticmethod
+    def on_process_started(pid):
+        monitor = ResourceMonitor._current
+        project = monitor and getattr(monitor._thread_local, 'project', None)
+        if project is None:
+            return
+        with monitor._lock:
+            monitor._sessions[pid] = project
+            monitor._running[project]['started_processes'] = True
+
+
+    @staticmethod
+    def get_start_delay_reason(project, running_projects):
+        """
+        :return: None when project can be started now, or a description of why it should wait.
+            A project is always started when no other projects are running.
+        """
+        monitor = ResourceMonitor._current
+        if monitor is None or not monitor._admission_control or not running_projects:
+            return None
+        load = os.getloadavg()[0]
+        if load >= monitor._max_load:
+            return 'the load average is %.1f' % load
+        available_memory = ResourceMonitor.get_available_memory()
+        if available_memory is None:
+            return None
+        history = monitor._build_history
+        with monitor._lock:
+            # Memory that the running builds are expected to use, but have not used yet.
+            pending_memory = sum(
+                max(0, history.get_estimated_peak_memory(p)
+                    - monitor._running.get(p, {}).get('current', 0))
+                for p in running_projects)
+        needed_memory = history.get_estimated_peak_memory(project)
+        if needed_memory + pending_memory + monitor._memory_reserve > available_memory:
+            return 'it may use %s of memory and the running builds may use %s more, but only %s ' \
+                   'is available' % (format_size(needed_memory), format_size(pending_memory),
+                                     format_size(available_memory))
+        return None
+
+
+    @staticmethod
+    def get_available_memory():
+        """ :return: MemAvailable from /proc/meminfo in bytes, or None if it is not available. """
+        try:
+            with open('/proc/meminfo') as f:
+                for line in f:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) * 1024
+        except (IOError, ValueError, IndexError):
+            pass
+        return None
+
+
+    def _sample_until_stopped(self):
+        while not self._stop_sampling.wait(ResourceMonitor.SAMPLE_INTERVAL):
+            self._sample()
+
+
+    def _sample(self):
+        with self._lock:
+            sessions = dict(self._sessions)
+            cgroups = {p: u['cgroup'] for p, u in self._running.items() if u['cgroup']}
+        memory_use = collections.Counter()
+        if len(cgroups) < len(set(sessions.values())):
+            for session, rss in ResourceMonitor._get_session_memory_use(sessions):
+                memory_use[sessions[session]] += rss
+        for project, cgroup in cgroups.items():
+            memory_use[project] = ResourceMonitor._read_cgroup_int(cgroup, 'memory.current') or 0
+        with self._lock:
+            for project, usage in self._running.items():
+                usage['current'] = memory_use[project]
+                usage['peak'] = max(usage['peak'], usage['current'])
+
+
+    @staticmethod
+    def _get_session_memory_use(sessions):
+        """ :return: Pairs of session id and resident set size, for each process in sessions. """
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open('/proc/%s/stat' % pid, 'rb') as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            # The process name may contain spaces, so split the fields after it. See proc(5).
+            fields = stat[stat.rindex(b')') + 2:].split()
+            session, rss_pages = int(fields[3]), int(fields[21])
+            if session in sessions:
+                yield session, rss_pages * ResourceMonitor._PAGE_SIZE
+
+
+    @staticmethod
+    def _prepare_cgroup(cgroup_dir):
+        """
+        Enables the memory controller for the children of cgroup_dir. cgroup v2 does not allow
+        processes in a cgroup whose children have controllers enabled, so processes in
+        cgroup_dir, i.e. this process, are first moved to a child cgroup.
+        """
+        try:
+            with open(os.path.join(cgroup_dir, 'cgroup.procs')) as f:
+                pids = f.read().split()
+            if pids:
+                leaf_dir = os.path.join(cgroup_dir, 'build-components')
+                Files.make_dir(leaf_dir)
+                for pid in pids:
+                    with contextlib.suppress(ProcessLookupError), \
+                            open(os.path.join(leaf_dir, 'cgroup.procs'), 'w') as f:
+                        f.write(pid)
+            with open(os.path.join(cgroup_dir, 'cgroup.subtree_control'), 'w') as f:
+                f.write('+memory')
+        except OSError as err:
+            sys.exit('Error: Unable to enable the memory controller in %s: %s' % (cgroup_dir, err))
+
+
+    def _create_cgroup(self, project):
+        if not self._cgroup_dir:
+            return None
+        with self._lock:
+            self._num_cgroups += 1
+            cgroup = os.path.join(self._cgroup_dir, 'build-%s-%s' % (
+                Files.get_leaf(project.src_dir), self._num_cgroups))
+        os.mkdir(cgroup)
+        if self._memory_limit:
+            with open(os.path.join(cgroup, 'memory.max'), 'w') as f:
+                f.write(str(self._memory_limit))
+        return cgroup
+
+
+    @staticmethod
+    def _read_cgroup_int(cgroup, file_name):
+        try:
+            with open(os.path.join(cgroup, file_name)) as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            return None
+
+
+
+class BuildCancelledError(Exception):
+    pass
+
+
+
+class SubprocessUtil(object):
+    _running_lock = threading.Lock()
+    _running_processes = set()
+    _cancelled = False
+    _KILL_TIMEOUT = 5
+
+    @staticmethod
+    def check_call(command, cwd=None, env=None, share_jobserver=False, hold_job_slot=True):
+        """
+        Runs command while holding a job slot, when a jobserver is running.
+        :param env: Environment variables to set in addition to the ones in os.environ.
+        :param share_jobserver: When true, the command is a "make" process that should draw its
+            parallel jobs from the jobserver.
+        :param hold_job_slot: When false, the caller has already acquired the job slots for the
+            command.
+        """
+        full_env = dict(os.environ, **(env or {}))
+        output_args = ProjectLog.get_subprocess_output_args(command)
+        job_slot = JobServer.job_slot() if hold_job_slot else contextlib.nullcontext()
+        with job_slot:
+            if share_jobserver and JobServer.is_running():
+                full_env.update(JobServer.get_make_env())
+                output_args['pass_fds'] = JobServer.get_fds()
+            with SubprocessUtil._running(command, cwd=cwd, env=full_env, **output_args) as proc:
+                return_code = proc.wait()
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, command)
+
+
+    @staticmethod
+    def call_and_capture(command, cwd=None, env=None, hold_job_slot=True):
+        """
+        Runs command like check_call, but does not raise an exception when the command fails.
+        The command's output is printed, or written to the project's log, as it is produced and
+        also returned.
+        :return: Tuple containing the exit code and the combined stdout and stderr.
+        """
+        full_env = dict(os.environ, **(env or {}))
+        output_stream = ProjectLog.get_subprocess_output_args(command).get('stdout', sys.stdout)
+        job_slot = JobServer.job_slot() if hold_job_slot else contextlib.nullcontext()
+        output_lines = []
+        with job_slot, SubprocessUtil._running(
+                command, cwd=cwd, env=full_env, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT, universal_newlines=True) as proc:
+            for line in proc.stdout:
+                output_stream.write(line)
+                output_lines.append(line)
+        return proc.returncode, ''.join(output_lines)
+
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _running(command, **popen_args):
+        """
+        Starts command in its own process group, so that cancel_all can kill the command along
+        with every process it started.
+        """
+        with SubprocessUtil._running_lock:
+            if SubprocessUtil._cancelled:
+                raise BuildCancelledError(
+                    'Did not run "%s" because the build was cancelled.' % ' '.join(command))
+            proc = subprocess.Popen(command, start_new_session=True,
+                                    preexec_fn=ResourceMonitor.get_preexec_fn(), **popen_args)
+            SubprocessUtil._running_processes.add(proc)
+        ResourceMonitor.on_process_started(proc.pid)
+        try:
+            with proc:
+                yield proc
+        finally:
+            with SubprocessUtil._running_lock:
+                SubprocessUtil._running_processes.discard(proc)
+
+
+    @staticmethod
+    def cancel_all():
+        """
+        Sends SIGTERM to the process group of every running command, and SIGKILL to the ones
+        that are still running after _KILL_TIMEOUT seconds. Commands started later fail
+        immediately.
+        """
+        with SubprocessUtil._running_lock:
+            SubprocessUtil._cancelled = True
+            processes = list(SubprocessUtil._running_processes)
+        SubprocessUtil._signal_process_groups(processes, signal.SIGTERM)
+        kill_timer = threading.Timer(SubprocessUtil._KILL_TIMEOUT,
+                                     SubprocessUtil._signal_process_groups,
+                                     (processes, signal.SIGKILL))
+        kill_timer.daemon = True
+        kill_timer.start()
+
+
+    @staticmethod
+    def _signal_process_groups(processes, signal_number):
+        for proc in processes:
+            if proc.poll() is None:
+                with contextlib.suppress(ProcessLookupError):
+                    os.killpg(proc.pid, signal_number)
+
+
+    @staticmethod
+    def reset():
+        with SubprocessUtil._running_lock:
+            SubprocessUtil._cancelled = False
+
+
+
+class ProjectLog(object):
+    """
+    While a project is built with ProjectLog.capturing, the output of the commands it runs
+    through SubprocessUtil is written to a log file for the project, instead of the console.
+    """
+    DIR_NAME = 'logs'
+    _thread_local = threading.local()
+
+    @staticmethod
+    def get_path(log_dir, project):
+        name = project.src_dir.strip('/').replace('/', '-')
+        return os.path.join(log_dir, name + '.log')
+
+    @staticmethod
+    @contextlib.contextmanager
+    def capturing(log_path):
+        Files.make_dir(os.path.dirname(log_path))
+        with open(log_path, 'w') as log_file:
+            ProjectLog._thread_local.log_file = log_file
+            try:
+                yield
+            finally:
+                ProjectLog._thread_local.log_file = None
+
+
+    @staticmethod
+    def get_subprocess_output_args(command):
+        """
+        :return: Keyword arguments for subprocess that send the command's output to the current
+            thread's project log, or an empty dict when the current thread's output is not
+            being captured.
+        """
+        log_file = getattr(ProjectLog._thread_local, 'log_file', None)
+        if log_file is None:
+            return {}
+        log_file.write('+ %s\n' % ' '.join(str(c) for c in command))
+        log_file.flush()
+        return {'stdout': log_file, 'stderr': subprocess.STDOUT}
+
+
+    @staticmethod
+    def read_tail(log_path, num_lines=40):
+        try:
+            with open(log_path, errors='replace') as f:
+                return ''.join(collections.deque(f, maxlen=num_lines))
+        except IOError:
+            return ''
+
+
+
+class ProgressDisplay(object):
+    """
+    Shows which projects are running, how many are queued and finished, the elapsed time, and
+    the estimated time remaining, based on the durations in the build history. On a terminal,
+    the status is kept on the last line and refreshed every second. Otherwise, it is printed
+    each time a project finishes.
+    """
+    def __init__(self, builder, projects, dependencies, durations, priorities):
+        self._builder = builder
+        self._dependencies = dependencies
+        self._durations = durations
+        self._priorities = priorities
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+        self._queued = list(projects)
+        self._running = {}
+        self._num_finished = 0
+        self._num_failed = 0
+        self._num_total = len(projects)
+        self._status_stream = None
+
+    @contextlib.contextmanager
+    def showing(self):
+        if not sys.stdout.isatty():
+            yield self
+            return
+        stop_refreshing = threading.Event()
+        self._status_stream = _StatusLineStream(sys.stdout, self.get_status)
+        refresh_thread = threading.Thread(
+            target=self._refresh, args=(stop_refreshing,), daemon=True)
+        with contextlib.redirect_stdout(self._status_stream):
+            refresh_thread.start()
+            try:
+                yield self
+            finally:
+                stop_refreshing.set()
+                refresh_thread.join()
+                self._status_stream.clear()
+
+
+    def _refresh(self, stop_refreshing):
+        while not stop_refreshing.wait(1):
+            self._status_stream.redraw()
+
+
+    def on_started(self, project):
+        with self._lock:
+            self._queued.remove(project)
+            self._running[project] = time.monotonic()
+        self._on_changed()
+
+    def on_finished(self, project, succeeded, skipped=()):
+        with self._lock:
+            del self._running[project]
+            self._num_finished += 1
+            if not succeeded:
+                self._num_failed += 1
+            for skipped_project in skipped:
+                if skipped_project in self._queued:
+                    self._queued.remove(skipped_project)
+                    self._num_total -= 1
+        self._on_changed()
+
+
+    def _on_changed(self):
+        if self._status_stream:
+            self._status_stream.redraw()
+
+
+    def print_status(self):
+        """ Prints the status on its own line, when it is not already shown on the terminal. """
+        if not self._status_stream:
+            print('[%s]' % self.get_status())
+
+
+    def get_status(self):
+        with self._lock:
+            now = time.monotonic()
+            running = dict(self._running)
+            queued = list(self._queued)
+            status = '%s elapsed, %d/%d finished' % (
+                ProgressDisplay._format_duration(now - self._start_time), self._num_finished,
+                self._num_total)
+            if self._num_failed:
+                status += ' (%d failed)' % self._num_failed
+        if running:
+            status += ', running: ' + ', '.join(Files.get_leaf(p.src_dir) for p in running)
+        if queued:
+            status += ', %d queued' % len(queued)
+        if running or queued:
+            status += ', ETA ' + ProgressDisplay._format_duration(
+                self._estimate_remaining_time(running, queued, now))
+        return status
+
+
+    def _estimate_remaining_time(self, running, queued, now):
+        remaining = list(running) + queued
+        remaining_set = set(remaining)
+        dependencies = {p: [d for d in self._dependencies[p] if d in remaining_set]
+                        for p in remaining}
+        durations = dict(self._durations)
+        priorities = dict(self._priorities)
+        for project, start_time in running.items():
+            durations[project] = max(durations[project] - (now - start_time), 0)
+            # Running projects are already started, so the simulation must start them first.
+            priorities[project] = float('inf')
+        return self._builder.predict_makespan(remaining, dependencies, durations, priorities)
+
+
+    @staticmethod
+    def _format_duration(seconds):
+        minutes, seconds = divmod(int(seconds), 60)
+        return '%d:%02d' % (minutes, seconds)
+
+
+
+class _StatusLineStream(object):
+    """
+    Wraps stdout so that the status line stays below everything else that is printed. The status
+    line is erased before other text is written, and redrawn once that text ends with a newline.
+    """
+    def __init__(self, stream, get_status):
+        self._stream = stream
+        self._get_status = get_status
+        self._lock = threading.RLock()
+        self._status_shown = False
+        self._at_line_start = True
+
+    def write(self, text):
+        with self._lock:
+            self._erase_status()
+            self._stream.write(text)
+            if text:
+                self._at_line_start = text.endswith('\n')
+            if self._at_line_start:
+                self.redraw()
+        return len(text)
+
+    def redraw(self):
+        with self._lock:
+            if not self._at_line_start:
+                return
+            self._erase_status()
+            status = self._get_status()
+            width = shutil.get_terminal_size().columns - 1
+            self._stream.write(status[:width])
+            self._stream.flush()
+            self._status_shown = True
+
+    def clear(self):
+        with self._lock:
+            self._erase_status()
+            self._stream.flush()
+
+    def _erase_status(self):
+        if self._status_shown:
+            self._stream.write('\r\033[K')
+            self._status_shown = False
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+
+class CmakeUtil(object):
+    @staticmethod
+    def is_project(src_dir):
+        return Files.path_exists(src_dir, 'CMakeLists.txt') and not(Files.path_exists(src_dir, '.mpfdockeronly'))
+
+    _GENERATOR_FILES = {'Unix Makefiles': 'Makefile', 'Ninja': 'build.ninja'}
+
+    _timings_lock = threading.Lock()
+    _timings = []
+
+    @staticmethod
+    def build(build_dir, src_dir, num_jobs, use_ninja=False, compiler_cache=None):
+        generator = 'Ninja' if use_ninja else 'Unix Makefiles'
+        cache_variables = CompilerCache.get_cmake_variables(compiler_cache)
+        Files.make_dir(build_dir)
+        configure_start_time = time.monotonic()
+        if CmakeUtil._needs_configure(build_dir, src_dir, generator, cache_variables):
+            define_args = ['-D%s=%s' % item for item in sorted(cache_variables.items())]
+            with BuildTrace.span('cmake configure'):
+                SubprocessUtil.check_call(
+                    ('cmake3', '-G', generator, '-DCMAKE_RULE_MESSAGES=OFF', *define_args, src_dir),
+                    cwd=build_dir)
+            configure_duration = time.monotonic() - configure_start_time
+        else:
+            print('Skipping CMake configure step because %s is up to date.' % build_dir)
+            configure_duration = None
+
+        build_start_time = time.monotonic()
+        with CompilerCache.recording_stats(compiler_cache, src_dir, build_dir) as env:
+            if use_ninja:
+                with BuildTrace.span('ninja install'):
+                    CmakeUtil._run_ninja_install(build_dir, num_jobs, env)
+            else:
+                with BuildTrace.span('make install'):
+                    CmakeUtil._run_make_install(build_dir, num_jobs, env)
+        with CmakeUtil._timings_lock:
+            CmakeUtil._timings.append(
+                (Files.get_leaf(src_dir), configure_duration, time.monotonic() - build_start_time))
+
+
+    @staticmethod
+    def _run_make_install(build_dir, num_jobs, env):
+        if JobServer.is_running():
+            SubprocessUtil.check_call(('make', 'install'), cwd=build_dir, env=env,
+                                      share_jobserver=True)
+        elif num_jobs == 1:
+            SubprocessUtil.check_call(('make', 'install'), cwd=build_dir, env=env)
+        elif num_jobs == float('inf'):
+            SubprocessUtil.check_call(('make', 'install', '--jobs'), cwd=build_dir, env=env)
+        else:
+            SubprocessUtil.check_call(('make', 'install', '--jobs', str(num_jobs)), cwd=build_dir,
+                                      env=env)
+
+
+    @staticmethod
+    def _run_ninja_install(build_dir, num_jobs, env):
+        if JobServer.is_running():
+            # Ninja can not read tokens from the pipe based jobserver, so take as many tokens
+            # as are available and tell Ninja how many jobs it may use.
+            with JobServer.job_slot(max_slots=float('inf')) as num_slots:
+                SubprocessUtil.check_call(
+                    ('cmake3', '--build', '.', '--target', 'install', '--', '-j', str(num_slots)),
+                    cwd=build_dir, env=env, hold_job_slot=False)
+        else:
+            # Ninja treats "-j 0" as unlimited.
+            ninja_jobs = 0 if num_jobs == float('inf') else num_jobs
+            SubprocessUtil.check_call(
+                ('cmake3', '--build', '.', '--target', 'install', '--', '-j', str(ninja_jobs)),
+                cwd=build_dir, env=env)
+
+
+    @staticmethod
+    def _needs_configure(build_dir, src_dir, generator, cache_variables):
+        cache_path = os.path.join(build_dir, 'CMakeCache.txt')
+        cache_entries = CmakeUtil._read_cache(cache_path)
+        if cache_entries is None:
+            return True
+        if cache_entries.get('CMAKE_GENERATOR') != generator:
+            # CMake refuses to switch generators in an existing build directory.
+            print_warning('Removing CMake cache from %s because it was created with the "%s" '
+                          'generator.' % (build_dir, cache_entries.get('CMAKE_GENERATOR')))
+            os.remove(cache_path)
+            shutil.rmtree(os.path.join(build_dir, 'CMakeFiles'), ignore_errors=True)
+            return True
+        if cache_entries.get('CMAKE_HOME_DIRECTORY') != src_dir:
+            return True
+        if any(cache_entries.get(k, '') != v for k, v in cache_variables.items()):
+            return True
+
+        generator_file = os.path.join(build_dir, CmakeUtil._GENERATOR_FILES[generator])
+        if generator == 'Ninja':
+            inputs = CmakeUtil._get_ninja_generator_inputs(generator_file)
+        else:
+            inputs = CmakeUtil._get_makefile_generator_inputs(
+                os.path.join(build_dir, 'CMakeFiles', 'Makefile.cmake'))
+        if not inputs:
+            return True
+        try:
+            # CMake only rewrites generated files whose contents changed, but it always writes
+            # cmake.check_cache.
+            generated_time = max(
+                os.stat(generator_file).st_mtime_ns,
+                os.stat(os.path.join(build_dir, 'CMakeFiles', 'cmake.check_cache')).st_mtime_ns)
+            return any(os.stat(os.path.join(build_dir, i)).st_mtime_ns > generated_time
+                       for i in inputs)
+        except OSError:
+            return True
+
+
+    @staticmethod
+    def _read_cache(cache_path):
+        try:
+            with open(cache_path) as f:
+                entries = {}
+                for line in f:
+                    if line.startswith(('#', '//')) or '=' not in line:
+                        continue
+                    key_and_type, value = line.rstrip('\n').split('=', 1)
+                    entries[key_and_type.split(':', 1)[0]] = value
+                return entries
+        except IOError:
+            return None
+
+
+    @staticmethod
+    def _get_makefile_generator_inputs(makefile_cmake_path):
+        """ Reads the files that CMake lists as the inputs of the generated Makefiles. """
+        try:
+            with open(makefile_cmake_path) as f:
+                contents = f.read()
+        except IOError:
+            return None
+        match = re.search(r'set\(CMAKE_MAKEFILE_DEPENDS(.*?)\)', contents, re.DOTALL)
+        if not match:
+            return None
+        return re.findall(r'"([^"]+)"', match.group(1))
+
+
+    @staticmethod
+    def _get_ninja_generator_inputs(build_ninja_path):
+        """ Reads the implicit inputs of the rule that re-runs CMake when build.ninja is out of date. """
+        try:
+            with open(build_ninja_path) as f:
+                contents = f.read().replace('$\n', ' ')
+        except IOError:
+            return None
+        for line in contents.splitlines():
+            if line.startswith('build ') and ': RERUN_CMAKE' in line and ' | ' in line:
+                escaped_inputs = line.split(' | ', 1)[1]
+                escaped_inputs = escaped_inputs.replace('$$', '\0').replace('$:', ':')
+                return [i.replace('\1', ' ').replace('\0', '$')
+                        for i in escaped_inputs.replace('$ ', '\1').split()]
+        return None
+
+
+    @staticmethod
+    def print_timing_summary():
+        with CmakeUtil._timings_lock:
+            timings = sorted(CmakeUtil._timings)
+        if not timings:
+            return
+        name_width = max(len(name) for name, _, _ in timings)
+        print('CMake configure and build times:')
+        for name, configure_duration, build_duration in timings:
+            configure_text = ('%7.1fs' % configure_duration if configure_duration is not None
+                              else 'skipped ')
+            print('    %s  configure: %s  build: %7.1fs' % (
+                name.ljust(name_width), configure_text, build_duration))
+
+
+    @staticmethod
+    def clean(build_dir):
+        if Files.path_exists(build_dir, 'makefile') or Files.path_exists(build_dir, 'Makefile'):
+            print('Cleaning', build_dir)
+            SubprocessUtil.check_call(('make', 'clean'), cwd=build_dir)
+            CmakeUtil._delete_build_dir_packages(build_dir)
+        elif Files.path_exists(build_dir, 'build.ninja'):
+            print('Cleaning', build_dir)
+            SubprocessUtil.check_call(('cmake3', '--build', '.', '--target', 'clean'), cwd=build_dir)
+            CmakeUtil._delete_build_dir_packages(build_dir)
+
+    @staticmethod
+    def _delete_build_dir_packages(build_dir):
+        for package in Files.list_component_packages(build_dir):
+            print('Deleting', package)
+            os.remove(package)
+
+    @staticmethod
+    def generate_build_path(base_build_dir, src_dir):
+        path_no_leading_slash = src_dir[1:]
+        build_dir_name = path_no_leading_slash.replace('/', '-') + '-build'
+        return os.path.join(base_build_dir, build_dir_name)
+
+
+
+class CompilerCache(object):
+    """
+    Configures CMake to launch the C and C++ compilers through ccache, and collects per-project
+    hit and miss counts from ccache's statistics log.
+    """
+    DEFAULT_CACHE_DIR = '~/.cache/mpf-build-ccache'
+    _LAUNCHER_VARIABLES = ('CMAKE_C_COMPILER_LAUNCHER', 'CMAKE_CXX_COMPILER_LAUNCHER')
+
+    _stats_lock = threading.Lock()
+    _stats = []
+
+    def __init__(self, cache_dir, max_size):
+        self._cache_dir = Files.expand_path(cache_dir)
+        self._max_size = max_size
+
+    @staticmethod
+    def from_args(cmdline_args):
+        if cmdline_args.ccache:
+            return CompilerCache(cmdline_args.ccache, cmdline_args.ccache_max_size)
+        return None
+
+
+    @staticmethod
+    def get_cmake_variables(compiler_cache):
+        """
+        When compiler_cache is None, the launcher variables are set to empty strings, so that a
+        build directory previously configured with ccache stops using it.
+        """
+        launcher = 'ccache' if compiler_cache else ''
+        return {v: launcher for v in CompilerCache._LAUNCHER_VARIABLES}
+
+
+    @staticmethod
+    @contextlib.contextmanager
+    def recording_stats(compiler_cache, src_dir, build_dir):
+        """
+        :return: Environment variables that must be set when running the build.
+        """
+        if compiler_cache is None:
+            yield {}
+            return
+        stats_log = os.path.join(build_dir, 'ccache-stats.log')
+        if os.path.exists(stats_log):
+            os.remove(stats_log)
+        try:
+            yield {
+                'CCACHE_DIR': compiler_cache._cache_dir,
+                'CCACHE_MAXSIZE': compiler_cache._max_size,
+                'CCACHE_STATSLOG': stats_log
+            }
+        finally:
+            hits, misses = CompilerCache._read_stats_log(stats_log)
+            with CompilerCache._stats_lock:
+                CompilerCache._stats.append((Files.get_leaf(src_dir), hits, misses))
+
+
+    @staticmethod
+    def _read_stats_log(stats_log):
+        """ The stats log contains a "# <source file>" line followed by one line per counter. """
+        hits = misses = 0
+        try:
+            with open(stats_log) as f:
+                for line in f:
+                    counter = line.strip()
+                    if counter in ('direct_cache_hit', 'preprocessed_cache_hit'):
+                        hits += 1
+                    elif counter == 'cache_miss':
+                        misses += 1
+        except IOError:
+            pass
+        return hits, misses
+
+
+    @staticmethod
+    def print_stats_summary():
+        with CompilerCache._stats_lock:
+            stats = sorted(CompilerCache._stats)
+        if not stats:
+            return
+        name_width = max(len(name) for name, _, _ in stats)
+        print('ccache statistics:')
+        for name, hits, misses in stats:
+            total = hits + misses
+            hit_rate = '%5.1f%%' % (100 * hits / total) if total else '    -'
+            print('    %s  hits: %6d  misses: %6d  hit rate: %s' % (
+                name.ljust(name_width), hits, misses, hit_rate))
+
+
+
+class IsolatedMavenRepo(object):
+    """
+    Gives each Maven build its own local repository, layered over a shared repository that is
+    warmed once by resolving each project's dependencies and plugins. Builds run offline and only
+    read from the shared repository, so parallel builds do not write to the same repository.
+    Artifacts installed by "mvn install", i.e. the Java SDK, go in to a repository in the build
+    directory that is layered under every build. Layering uses Maven's maven.repo.local.tail
+    property, which requires Maven 3.9 or later.
+    """
+    DEFAULT_WARMED_REPO_DIR = '~/.cache/mpf-build-m2'
+
+    def __init__(self, warmed_repo_dir, base_build_dir):
+        self._warmed_repo_dir = Files.expand_path(warmed_repo_dir)
+        self._overlays_dir = os.path.join(base_build_dir, 'maven-repos')
+        self._installed_repo_dir = os.path.join(self._overlays_dir, 'installed')
+        self._warmed_record_path = os.path.join(self._warmed_repo_dir, '.mpf-warmed-poms.json')
+
+    @staticmethod
+    def from_args(cmdline_args):
+        if cmdline_args.isolated_maven_repo:
+            return IsolatedMavenRepo(cmdline_args.isolated_maven_repo, cmdline_args.build_dir)
+        return None
+
+
+    @staticmethod
+    def get_installed_sdk_path(maven_repo):
+        if maven_repo is None:
+            repo_dir = os.path.expanduser(os.path.join('~', '.m2', 'repository'))
+        else:
+            repo_dir = maven_repo._installed_repo_dir
+        return os.path.join(repo_dir, 'org', 'mitre', 'mpf')
+
+
+    @staticmethod
+    def prepare(maven_repo, src_dir, project_dirs, installs=False):
+        """
+        Makes sure the shared repository contains everything needed to build project_dirs.
+        :param installs: Whether the build will run "mvn install".
+        :return: Arguments that make Maven use the overlay repository for src_dir and run offline.
+        """
+        if maven_repo is None:
+            return ()
+        for project_dir in project_dirs:
+            maven_repo._warm(project_dir)
+        if installs:
+            overlay_dir = maven_repo._installed_repo_dir
+            tail = maven_repo._get_tail()[1:]
+        else:
+            overlay_dir = maven_repo._get_project_overlay_dir(src_dir)
+            tail = maven_repo._get_tail()
+        return ('--offline', '-Dmaven.repo.local=' + overlay_dir,
+                '-Dmaven.repo.local.tail=' + ','.join(tail))
+
+
+    def _get_project_overlay_dir(self, src_dir):
+        # Components in different directories may have the same leaf directory name.
+        path_key = Fingerprint.hash_json(os.path.abspath(src_dir))[:16]
+        return os.path.join(self._overlays_dir, 'projects',
+                            '%s-%s' % (Files.get_leaf(src_dir), path_key))
+
+
+    def _get_tail(self):
+        # ~/.m2/repository is last so that an SDK installed by a build that did not use an
+        # isolated repository can still be found.
+        return [self._installed_repo_dir, self._warmed_repo_dir,
+                os.path.expanduser(os.path.join('~', '.m2', 'repository'))]
+
+
+    def _warm(self, src_dir):
+        """
+        Resolves src_dir's dependencies and plugins in to the shared repository, unless it was
+        already done for the current version of src_dir's POM files. The shared repository is
+        locked while it is being written to, so concurrent builds warm it one at a time.
+        """
+        pom_digest = IsolatedMavenRepo._hash_poms(src_dir)
+        Files.make_dir(self._warmed_repo_dir)
+        with open(os.path.join(self._warmed_repo_dir, '.mpf-warm.lock'), 'w') as lock_file:
+            with BuildTrace.span('wait for Maven repo lock'):
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            warmed_poms = Files.load_json(self._warmed_record_path, {})
+            if pom_digest in warmed_poms:
+                return
+            print('Resolving Maven dependencies for', src_dir, 'in to', self._warmed_repo_dir)
+            # OpenMPF artifacts are excluded because they are built locally rather than downloaded.
+            with BuildTrace.span('mvn dependency:go-offline'):
+                SubprocessUtil.check_call(
+                    ('mvn', '--batch-mode', '--quiet', 'dependency:go-offline',
+                     '-DexcludeGroupIds=org.mitre.mpf',
+                     '-Dmaven.repo.local=' + self._warmed_repo_dir,
+                     '-Dmaven.repo.local.tail=' + ','.join(
+                         r for r in self._get_tail() if r != self._warmed_repo_dir)),
+                    cwd=src_dir)
+            warmed_poms[pom_digest] = src_dir
+            Files.write_json(self._warmed_record_path, warmed_poms)
+
+
+    @staticmethod
+    def _hash_poms(src_dir):
+        pom_hashes = {}
+        for dir_path, dir_names, file_names in os.walk(src_dir):
+            dir_names[:] = sorted(d for d in dir_names
+                                  if d not in ('target', 'build') and not d.startswith('.'))
+            if 'pom.xml' in file_names:
+                pom_path = os.path.join(dir_path, 'pom.xml')
+                pom_hashes[os.path.relpath(pom_path, src_dir)] = Fingerprint.hash_file(pom_path)
+        return Fingerprint.hash_json(pom_hashes)
+
+
+
+class MavenUtil(object):
+    @staticmethod
+    def is_project(src_dir):
+        return Files.path_exists(src_dir, 'pom.xml')
+
+    _SKIP_INTEGRATION_TESTS_ARGS = ('-Dit.test=none', '-DfailIfNoTests=false', '-DskipITs')
+
+    @staticmethod
+    def _run_maven_phase(phase, src_dir, maven_repo):
+        repo_args = IsolatedMavenRepo.prepare(maven_repo, src_dir, (src_dir,),
+                                              installs=phase == 'install')
+        with BuildTrace.span('mvn ' + phase):
+            SubprocessUtil.check_call(
+                ('mvn', phase) + repo_args + MavenUtil._SKIP_INTEGRATION_TESTS_ARGS, cwd=src_dir)
+
+    @staticmethod
+    def package(src_dir, maven_repo=None):
+        MavenUtil._run_maven_phase('package', src_dir, maven_repo)
+
+    @staticmethod
+    def install(src_dir, maven_repo=None):
+        MavenUtil._run_maven_phase('install', src_dir, maven_repo)
+
+    @staticmethod
+    def build_reactor(aggregator_dir, module_dirs, num_threads, repo_args=()):
+        """
+        Builds all of the module_dirs in a single Maven invocation using a generated aggregator
+        POM, so that JVM startup and plugin and dependency resolution happen once. The caller
+        must already hold the job slots for the reactor.
+        :param num_threads: Value for Maven's -T option.
+        :param repo_args: Arguments from IsolatedMavenRepo.prepare.
+        :return: Tuple containing the exit code and the Maven output.
+        """
+        Files.make_dir(aggregator_dir)
+        pom_path = os.path.join(aggregator_dir, 'pom.xml')
+        modules = ''.join('        <module>%s</module>\n' % os.path.relpath(d, aggregator_dir)
+                          for d in module_dirs)
+        with open(pom_path, 'w') as f:
+            f.write(MavenUtil._AGGREGATOR_POM_TEMPLATE % modules)
+        # --fail-at-end builds every module that does not depend on a failed module.
+        command = ('mvn', '--batch-mode', '--fail-at-end', '-T', str(num_threads), '-f', pom_path,
+                   'package') + repo_args + MavenUtil._SKIP_INTEGRATION_TESTS_ARGS
+        with BuildTrace.span('mvn reactor package'):
+            return SubprocessUtil.call_and_capture(command, cwd=aggregator_dir,
+                                                   hold_job_slot=False)
+
+    _AGGREGATOR_POM_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0"
+         xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+         xsi:schemaLocation="http://maven.apache.org/POM/4.0.0 http://maven.apache.org/xsd/maven-4.0.0.xsd">
+    <!-- Generated by build_components.py -->
+    <modelVersion>4.0.0</modelVersion>
+    <groupId>org.mitre.mpf</groupId>
+    <artifactId>mpf-build-components-reactor</artifactId>
+    <version>1.0</version>
+    <packaging>pom</packaging>
+    <modules>
+%s    </modules>
+</project>
+"""
+
+
+    @staticmethod
+    def get_module_names(src_dir):
+        """
+        :return: The names Maven uses for the project in src_dir and all of its modules in the
+            Reactor Summary. A project's name is its <name>, or its <artifactId> when it does not
+            have a name.
+        """
+        try:
+            root = xml.etree.ElementTree.parse(os.path.join(src_dir, 'pom.xml')).getroot()
+        except (IOError, xml.etree.ElementTree.ParseError):
+            return []
+        namespace = {'pom': root.tag[1:root.tag.index('}')]} if root.tag.startswith('{') else {}
+        prefix = 'pom:' if namespace else ''
+        name = root.findtext(prefix + 'name', namespaces=namespace) \
+            or root.findtext(prefix + 'artifactId', namespaces=namespace)
+        names = [name.strip()] if name else []
+        for module in root.iterfind('%smodules/%smodule' % (prefix, prefix), namespaces=namespace):
+            names.extend(MavenUtil.get_module_names(os.path.join(src_dir, module.text.strip())))
+        return names
+
+
+    @staticmethod
+    def parse_reactor_summary(maven_output):
+        """
+        :return: Mapping from project name to its status in the Reactor Summary, e.g. SUCCESS,
+            FAILURE, or SKIPPED.
+        """
+        statuses = {}
+        in_summary = False
+        for line in maven_output.splitlines():
+            line = re.sub(r'^\[\w+\]\s?', '', line)
+            if line.startswith('Reactor Summary'):
+                in_summary = True
+                continue
+            if in_summary:
+                match = re.match(r'(.+?) \.* ?(SUCCESS|FAILURE|SKIPPED)\b', line)
+                if match:
+                    statuses[match.group(1).strip()] = match.group(2)
+                elif line.startswith('-----'):
+                    break
+        return statuses
+
+
+    @staticmethod
+    def clean(src_dir):
+        if MavenUtil.is_project(src_dir):
+            print('Cleaning ', src_dir)
+            SubprocessUtil.check_call(('mvn', 'clean'), cwd=src_dir)
+
+
+
+class PipUtil(object):
+
+    _stats_lock = threading.Lock()
+    _durations = []
+    _invocations_avoided = 0
+    # Parallel builds of Python components must not create the SDK venv at the same time.
+    _venv_lock = threading.Lock()
+
+    @classmethod
+    def run_pip(cls, *args: str, num_batched: int = 1):
+        """
+        :param num_batched: Number of separate pip invocations this invocation replaces.
+        """
+        python_executable = cls._get_python_executable()
+        start_time = time.monotonic()
+        with BuildTrace.span('pip ' + args[0]):
+            SubprocessUtil.check_call((python_executable, '-m', 'pip', *args))
+        with cls._stats_lock:
+            cls._durations.append(time.monotonic() - start_time)
+            cls._invocations_avoided += num_batched - 1
+
+
+    @classmethod
+    def print_stats_summary(cls):
+        with cls._stats_lock:
+            durations = list(cls._durations)
+            invocations_avoided = cls._invocations_avoided
+        if not durations:
+            return
+        print('pip: %d invocation(s) took %.1f seconds.' % (len(durations), sum(durations)))
+        if invocations_avoided:
+            # Each avoided invocation would have cost at least as much interpreter startup and
+            # dependency resolution as the fastest invocation that did run.
+            print('    Batching avoided %d invocation(s), saving an estimated %.1f seconds.'
+                  % (invocations_avoided, invocations_avoided * min(durations)))
+
+
+    # The build requirements PEP 518 specifies for projects without a [build-system] table.
+    _DEFAULT_BUILD_REQUIRES = ('setuptools>=40.8.0', 'wheel')
+
+    @staticmethod
+    def get_build_requires(src_dir):
+        """
+        :return: The sorted [build-system] requires from src_dir's pyproject.toml, or None when
+            they can not be determined.
+        """
+        pyproject_path = os.path.join(src_dir, 'pyproject.toml')
+        if not os.path.exists(pyproject_path):
+            return sorted(PipUtil._DEFAULT_BUILD_REQUIRES)
+        if tomllib is None:
+            return None
+        try:
+            with open(pyproject_path, 'rb') as f:
+                build_system = tomllib.load(f).get('build-system', {})
+        except tomllib.TOMLDecodeError:
+            return None
+        return sorted(build_system.get('requires', PipUtil._DEFAULT_BUILD_REQUIRES))
+
+
+    @classmethod
+    def get_build_env(cls, build_requires):
+        """
+        Gets a virtualenv with build_requires installed, that is used in place of the isolated
+        build environment pip would otherwise create for every build. The environment is created
+        the first time it is needed and reused until build_requires changes.
+        :return: Path to the environment's Python executable.
+        """
+        env_key = Fingerprint.hash_json(
+            [Fingerprint.get_tool_version('python3.12', '--version'), build_requires])
+        env_dir = os.path.join(cls.get_sdk_install_root(), 'build-envs', env_key[:16])
+        python_executable = os.path.join(env_dir, 'bin', 'python3.12')
+        ready_marker = os.path.join(env_dir, '.mpf-build-env-ready')
+        Files.make_dir(os.path.dirname(env_dir))
+        with open(env_dir + '.lock', 'a') as lock_file:
+            with BuildTrace.span('wait for build env lock'):
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if not os.path.exists(ready_marker):
+                print('Creating Python build environment with', ' '.join(build_requires),
+                      'at:', env_dir)
+                if os.path.exists(env_dir):
+                    shutil.rmtree(env_dir)
+                with BuildTrace.span('create build env'):
+                    SubprocessUtil.check_call(
+                        ('python3.12', '-m', 'venv', env_dir, '--upgrade-deps'))
+                    SubprocessUtil.check_call(
+                        (python_executable, '-m', 'pip', 'install', *build_requires))
+                Files.write_json(ready_marker, build_requires)
+        return python_executable
+
+
+    @staticmethod
+    def build_wheel_without_isolation(build_env_python, src_dir, wheel_dir):
+        """
+        Builds only src_dir's own wheel using the build backend installed in build_env_python's
+        environment. Its dependencies are left for a normal "pip wheel", so that dependencies
+        built from source still get isolated build environments with their own requirements.
+        :return: Path to the wheel.
+        """
+        with BuildTrace.span('pip wheel --no-build-isolation'):
+            SubprocessUtil.check_call(
+                (build_env_python, '-m', 'pip', 'wheel', '--no-deps', '--no-build-isolation',
+                 '--wheel-dir', wheel_dir, src_dir))
+        wheels = glob.glob(os.path.join(wheel_dir, '*.whl'))
+        if len(wheels) != 1:
+            raise Exception('Expected building %s to produce one wheel, but found: %s'
+                            % (src_dir, wheels))
+        return wheels[0]
+
+
+    @staticmethod
+    @contextlib.contextmanager
+    def locked_sdk_wheelhouse(exclusive=False):
+        """
+        The SDK wheelhouse is locked exclusively while the Python SDK writes to it, so that
+        component builds in other runs of this script never read a partially written wheel.
+        """
+        lock_path = os.path.join(PipUtil.get_sdk_install_root(), '.wheelhouse.lock')
+        Files.make_dir(os.path.dirname(lock_path))
+        with open(lock_path, 'a') as lock_file:
+            with BuildTrace.span('wait for SDK wheelhouse lock'):
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    @classmethod
+    @functools.lru_cache(maxsize=1)
+    def _get_python_executable(cls) -> str:
+        venv_root = pathlib.Path(cls.get_sdk_install_root()) / 'venv'
+        executable_path = venv_root / 'bin/python3.12'
+        with cls._venv_lock:
+            if not executable_path.is_file():
+                if venv_root.exists():
+                    raise Exception(f'Expected "{venv_root}" to either not exist or be a Python '
+                                    '3.12 virtualenv.')
+                if not VenvSnapshot.restore(str(venv_root)):
+                    print('Creating venv at:', venv_root)
+                    with BuildTrace.span('create venv'):
+                        SubprocessUtil.check_call(
+                            ('python3.12', '-m', 'venv', str(venv_root), *VenvSnapshot.SEED_ARGS))
+                    VenvSnapshot.save(str(venv_root))
+        return str(executable_path)
+
+
+    @staticmethod
+    def is_project(src_dir):
+        return (Files.path_exists(src_dir, 'pyproject.toml')
+                or Files.path_exists(src_dir, 'setup.py'))
+
+    @staticmethod
+    def is_component(src_dir):
+        return PipUtil.is_project(src_dir) or PipUtil._descriptor_lang_matches(src_dir)
+
+    @staticmethod
+    def _descriptor_lang_matches(src_dir):
         try:
             with open(os.path.join(src_dir, 'descriptor', 'descriptor.json')) as f:
                 descriptor_json = json.load(f)
@@ -558,22 +3964,304 @@ class PipUtil(object):
     def clean(cls, src_dir):
         if Files.path_exists(src_dir, 'setup.py'):
             print('Cleaning ', src_dir)
-            subprocess.run(
-                    (cls._get_python_executable(), 'setup.py', 'clean'), check=True, cwd=src_dir)
+            SubprocessUtil.check_call(
+                    (cls._get_python_executable(), 'setup.py', 'clean'), cwd=src_dir)
 
     @staticmethod
-    def _get_sdk_install_root():
+    def get_sdk_install_root():
         return os.path.join(Files.get_sdk_install_path(), 'python')
 
     @staticmethod
     def get_sdk_wheelhouse():
-        return os.path.join(PipUtil._get_sdk_install_root(), 'wheelhouse')
+        return os.path.join(PipUtil.get_sdk_install_root(), 'wheelhouse')
+
+
+
+
+
+class WheelCache(object):
+    """
+    Persistent cache of the dependency wheels that "pip wheel" downloads or builds when packaging
+    Python components. Wheels are stored by the SHA-256 digest of their contents and indexed by
+    project name, version, and wheel tags. A directory containing a link to each indexed wheel
+    is passed to pip with --find-links, so a dependency is only built once no matter how many
+    components use it.
+
+    The cache is shared by parallel builds and separate runs of this script. Builds take a shared
+    lock while pip reads from the cache, and an exclusive lock is taken to add or evict wheels.
+    """
+    _WHEEL_FILE_REGEX = re.compile(
+        r'(?P<name>[^-]+)-(?P<version>[^-]+)(-\d[^-]*)?-(?P<tags>[^-]+-[^-]+-[^-]+)\.whl')
+
+    def __init__(self, cache_dir, max_size):
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+        self._wheels_dir = os.path.join(cache_dir, 'wheels')
+        self._objects_dir = os.path.join(cache_dir, 'objects')
+        self._index_path = os.path.join(cache_dir, 'index.json')
+        self._lock_path = os.path.join(cache_dir, '.lock')
+
+    @staticmethod
+    def from_args(cmdline_args):
+        if cmdline_args.wheel_cache_max_size:
+            return WheelCache(os.path.join(PipUtil.get_sdk_install_root(), 'wheel-cache'),
+                              cmdline_args.wheel_cache_max_size)
+        return None
+
+
+    @contextlib.contextmanager
+    def reading(self):
+        """
+        Prevents wheels from being evicted while pip reads from the cache.
+        :return: The directory to pass to pip with --find-links.
+        """
+        with self._locked(fcntl.LOCK_SH):
+            yield self._wheels_dir
+
+
+    def add(self, wheelhouse, excluded_wheelhouses=()):
+        """
+        Adds the wheels in wheelhouse to the cache, marks the wheels that were already cached as
+        recently used, and then evicts wheels until the cache fits within its maximum size.
+        """
+        excluded_file_names = set()
+        for excluded_wheelhouse in excluded_wheelhouses:
+            if os.path.isdir(excluded_wheelhouse):
+                excluded_file_names.update(os.listdir(excluded_wheelhouse))
+
+        with self._locked(fcntl.LOCK_EX):
+            index = Files.load_json(self._index_path, {})
+            for file_name in sorted(os.listdir(wheelhouse)):
+                key = WheelCache._get_key(file_name)
+                if key is None or file_name in excluded_file_names:
+                    continue
+                wheel_path = os.path.join(wheelhouse, file_name)
+                digest = Fingerprint.hash_file(wheel_path)
+                entry = index.get(key)
+                if entry is None or entry['digest'] != digest:
+                    self._store(wheel_path, file_name, digest)
+                    if entry is not None and entry['file_name'] != file_name:
+                        WheelCache._remove_if_exists(
+                            os.path.join(self._wheels_dir, entry['file_name']))
+                    entry = index[key] = {'file_name': file_name, 'digest': digest,
+                                          'size': os.path.getsize(wheel_path)}
+                entry['last_used'] = time.time()
+            self._evict(index)
+            Files.write_json(self._index_path, index)
+
+
+    @staticmethod
+    def _get_key(file_name):
+        match = WheelCache._WHEEL_FILE_REGEX.fullmatch(file_name)
+        if not match:
+            return None
+        # Wheel file names escape "-" in the project name with "_", but may differ in case.
+        return '%s-%s-%s' % (match.group('name').lower(), match.group('version'),
+                             match.group('tags'))
+
+
+    def _store(self, wheel_path, file_name, digest):
+        object_path = self._get_object_path(digest)
+        if not os.path.exists(object_path):
+            Files.make_dir(os.path.dirname(object_path))
+            shutil.copyfile(wheel_path, object_path + '.tmp')
+            os.replace(object_path + '.tmp', object_path)
+        Files.make_dir(self._wheels_dir)
+        Files.atomic_clone(object_path, os.path.join(self._wheels_dir, file_name))
+
+
+    def _evict(self, index):
+        total_size = sum(e['size'] for e in index.values())
+        by_last_used = sorted(index.items(), key=lambda item: item[1]['last_used'])
+        for key, entry in by_last_used:
+            if total_size <= self._max_size:
+                break
+            print('Evicting from wheel cache:', entry['file_name'])
+            del index[key]
+            total_size -= entry['size']
+            WheelCache._remove_if_exists(os.path.join(self._wheels_dir, entry['file_name']))
+            if all(e['digest'] != entry['digest'] for e in index.values()):
+                WheelCache._remove_if_exists(self._get_object_path(entry['digest']))
+
+
+    def _get_object_path(self, digest):
+        return os.path.join(self._objects_dir, digest[:2], digest + '.whl')
+
+
+    @staticmethod
+    def _remove_if_exists(path):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        Files.make_dir(self._cache_dir)
+        with open(self._lock_path, 'a') as lock_file:
+            with BuildTrace.span('wait for wheel cache lock'):
+                fcntl.flock(lock_file, operation)
+            yield
+
+
+
+class VenvSnapshot(object):
+    """
+    Compressed snapshot of a freshly created SDK venv, keyed by the Python interpreter and the
+    arguments used to seed the venv's packages. Creating the venv downloads and installs pip and
+    setuptools, so on build machines that start without a venv, restoring the snapshot is much
+    faster. The snapshot directory can be kept in a CI cache for that purpose.
+
+    The snapshot is extracted once in to a template directory next to the archive, and the venv
+    is restored by hard linking the template's files. The files that contain the absolute path of
+    the venv the snapshot was taken from, like the scripts in bin/, are copied with the path
+    replaced instead.
+    """
+    DEFAULT_SNAPSHOT_DIR = '~/.cache/mpf-build-venv-snapshots'
+    SEED_ARGS = ('--upgrade-deps',)
+    _METADATA_NAME = '.mpf-venv-snapshot.json'
+    _current = None
+
+    def __init__(self, snapshot_dir):
+        self._snapshot_dir = Files.expand_path(snapshot_dir)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def enabled(snapshot_dir):
+        if not snapshot_dir:
+            yield None
+            return
+        VenvSnapshot._current = VenvSnapshot(snapshot_dir)
+        try:
+            yield VenvSnapshot._current
+        finally:
+            VenvSnapshot._current = None
+
+
+    @staticmethod
+    def restore(venv_root):
+        """
+        :return: True if venv_root was restored from a snapshot and its interpreter works.
+        """
+        snapshot = VenvSnapshot._current
+        if snapshot is None:
+            return False
+        archive_path = snapshot._get_archive_path()
+        if not os.path.exists(archive_path):
+            return False
+        print('Restoring venv snapshot', archive_path, 'to:', venv_root)
+        with BuildTrace.span('restore venv snapshot'):
+            template_dir = snapshot._get_template_dir(archive_path)
+            metadata = Files.load_json(os.path.join(template_dir, VenvSnapshot._METADATA_NAME), {})
+            VenvSnapshot._link_tree(os.path.join(template_dir, 'venv'), venv_root,
+                                    metadata.get('venv_root', '').encode())
+            if VenvSnapshot._interpreter_works(venv_root):
+                return True
+        print_warning('The venv restored from %s does not work. Creating a new venv instead.'
+                      % archive_path)
+        shutil.rmtree(venv_root)
+        return False
+
+
+    @staticmethod
+    def save(venv_root):
+        snapshot = VenvSnapshot._current
+        if snapshot is None:
+            return
+        archive_path = snapshot._get_archive_path()
+        Files.make_dir(snapshot._snapshot_dir)
+        temp_path = '%s.%s.tmp' % (archive_path, threading.get_ident())
+        metadata = json.dumps({'venv_root': venv_root}).encode()
+        with BuildTrace.span('save venv snapshot'):
+            with Files.open_tar_gz(temp_path, compression_level=6) as tar:
+                tar.add(venv_root, arcname='venv')
+                metadata_info = tarfile.TarInfo(VenvSnapshot._METADATA_NAME)
+                metadata_info.size = len(metadata)
+                tar.addfile(metadata_info, io.BytesIO(metadata))
+            os.replace(temp_path, archive_path)
+        print('Saved venv snapshot to:', archive_path)
+
+
+    def _get_archive_path(self):
+        python_path = shutil.which('python3.12') or 'python3.12'
+        key = Fingerprint.hash_json([Fingerprint.get_tool_version('python3.12', '--version'),
+                                     os.path.realpath(python_path), VenvSnapshot.SEED_ARGS])
+        return os.path.join(self._snapshot_dir, 'venv-%s.tar.gz' % key[:16])
 
 
+    @staticmethod
+    def _get_template_dir(archive_path):
+        template_dir = archive_path[:-len('.tar.gz')]
+        with open(template_dir + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # The template is extracted again when the archive is newer, e.g. when a CI cache
+            # restored an updated archive.
+            if (os.path.isdir(template_dir)
+                    and os.stat(template_dir).st_mtime_ns >= os.stat(archive_path).st_mtime_ns):
+                return template_dir
+            temp_dir = tempfile.mkdtemp(dir=os.path.dirname(template_dir))
+            with tarfile.open(archive_path) as tar:
+                # The venv's python executable is an absolute symbolic link to the interpreter,
+                # which the newer "data" filter would reject.
+                extract_kwargs = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+                tar.extractall(temp_dir, **extract_kwargs)
+            if os.path.exists(template_dir):
+                shutil.rmtree(template_dir)
+            os.rename(temp_dir, template_dir)
+            return template_dir
+
+
+    @staticmethod
+    def _link_tree(template_dir, venv_root, original_venv_root):
+        for dir_path, dir_names, file_names in os.walk(template_dir):
+            dest_dir = os.path.join(venv_root, os.path.relpath(dir_path, template_dir))
+            os.makedirs(dest_dir, exist_ok=True)
+            for name in dir_names + file_names:
+                src = os.path.join(dir_path, name)
+                dest = os.path.join(dest_dir, name)
+                if os.path.islink(src):
+                    os.symlink(os.readlink(src), dest)
+                elif name in file_names:
+                    VenvSnapshot._restore_file(src, dest, original_venv_root, venv_root.encode())
+            # Symbolic links to directories, like lib64, were already created above.
+            dir_names[:] = [d for d in dir_names if not os.path.islink(os.path.join(dir_path, d))]
+
+
+    @staticmethod
+    def _restore_file(src, dest, original_venv_root, venv_root):
+        is_venv_config = os.path.basename(src) == 'pyvenv.cfg'
+        is_script = os.path.basename(os.path.dirname(src)) == 'bin'
+        if original_venv_root and (is_venv_config or is_script):
+            with open(src, 'rb') as f:
+                content = f.read()
+            if original_venv_root in content:
+                with open(dest, 'wb') as f:
+                    f.write(content.replace(original_venv_root, venv_root))
+                shutil.copymode(src, dest)
+                return
+        Files.atomic_clone(src, dest)
+
+
+    @staticmethod
+    def _interpreter_works(venv_root):
+        python_executable = os.path.join(venv_root, 'bin', 'python3.12')
+        try:
+            result = subprocess.run(
+                (python_executable, '-c', 'import sys, pip; print(sys.prefix)'),
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        except OSError:
+            return False
+        return (result.returncode == 0
+                and os.path.realpath(result.stdout.strip()) == os.path.realpath(venv_root))
 
 
 
 class MpfProject(abc.ABC):
+    # Estimated number of seconds the project takes to build, used until a build has been recorded.
+    default_build_duration = 60
+    # Estimated peak memory use in bytes of all of the processes building the project, used by
+    # --admission-control until a build has been recorded.
+    default_peak_memory = 1024 ** 3
+
     def __init__(self, src_dir):
         self.src_dir = os.path.abspath(Files.expand_path(src_dir))
 
@@ -581,6 +4269,9 @@ class MpfProject(abc.ABC):
     def build(self):
         raise NotImplementedError()
 
+    def depends_on(self, project):
+        return False
+
 
 
 def get_sdks(cmdline_args):
@@ -599,29 +4290,39 @@ def get_sdks(cmdline_args):
 
 
 class CppSdk(MpfProject):
+    default_build_duration = 1800
+    default_peak_memory = 4 * 1024 ** 3
+
     def __init__(self, cmdline_args):
         super(CppSdk, self).__init__(cmdline_args.cpp_sdk_src)
         self._sdk_build_dir = CmakeUtil.generate_build_path(cmdline_args.build_dir, self.src_dir)
         self._num_make_jobs = cmdline_args.jobs
+        self._use_ninja = cmdline_args.ninja
+        self._compiler_cache = CompilerCache.from_args(cmdline_args)
         if not CmakeUtil.is_project(self.src_dir):
             raise Exception(
                 'Unable to build C++ SDK because %s does not appear to be a CMake project.'
                 % self.src_dir)
 
     def build(self):
-        CmakeUtil.build(self._sdk_build_dir, self.src_dir, self._num_make_jobs)
+        CmakeUtil.build(self._sdk_build_dir, self.src_dir, self._num_make_jobs, self._use_ninja,
+                        self._compiler_cache)
 
 
 class JavaSdk(MpfProject):
+    default_build_duration = 120
+    default_peak_memory = 2 * 1024 ** 3
+
     def __init__(self, cmdline_args):
         super(JavaSdk, self).__init__(cmdline_args.java_sdk_src)
         if not MavenUtil.is_project(self.src_dir):
             raise Exception(
                 'Unable to build Java SDK because %s does not appear to be a Maven project.'
                 % self.src_dir)
+        self._maven_repo = IsolatedMavenRepo.from_args(cmdline_args)
 
     def build(self):
-        MavenUtil.install(self.src_dir)
+        MavenUtil.install(self.src_dir, self._maven_repo)
 
 
 class PythonSdk(MpfProject):
@@ -636,16 +4337,20 @@ class PythonSdk(MpfProject):
                                 f'pyproject.toml or a setup.py file.')
 
     def build(self):
-        for package in self.packages:
+        # pip resolves component_util's dependency on api to the api directory given in the same
+        # command, so both packages can be handled by a single pip command.
+        with PipUtil.locked_sdk_wheelhouse(exclusive=True):
             PipUtil.run_pip(
                     'wheel',
                     '--wheel-dir', PipUtil.get_sdk_wheelhouse(),
                     '--find-links', PipUtil.get_sdk_wheelhouse(),
-                    package)
+                    *self.packages,
+                    num_batched=len(self.packages))
             PipUtil.run_pip(
                     'install', '--upgrade',
                     '--find-links', PipUtil.get_sdk_wheelhouse(),
-                    package)
+                    *self.packages,
+                    num_batched=len(self.packages))
 
 
 class MpfComponent(MpfProject, abc.ABC):
@@ -664,40 +4369,142 @@ class MpfComponent(MpfProject, abc.ABC):
     def __init__(self, src_dir, cmdline_args):
         super(MpfComponent, self).__init__(src_dir)
         self.base_plugin_output_dir = get_plugin_output_dir(cmdline_args)
+        self._package_store = PackageStore(cmdline_args.build_dir)
+
+    @property
+    @abc.abstractmethod
+    def sdk_type(self):
+        """ The type of SDK project that must be built before this component. """
+        raise NotImplementedError()
+
+    def depends_on(self, project):
+        return isinstance(project, self.sdk_type)
+
+    @abc.abstractmethod
+    def build_package(self, staging_dir):
+        """
+        :param staging_dir: Directory where packages created by this script, rather than by the
+            component's own build, should be written. Packages in this directory are moved in to
+            the plugin output directory instead of being copied.
+        :return: Paths to the created plugin packages.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def get_build_inputs(self):
+        """
+        :return: JSON serializable description of everything other than the component's own
+            source files that affects the built package, e.g. the installed SDK and toolchain.
+        """
+        raise NotImplementedError()
 
     @abc.abstractmethod
-    def build_package(self):
+    def get_portable_build_inputs(self):
+        """
+        :return: Like get_build_inputs, but without anything specific to this host, like
+            absolute paths and modification times, so that the same inputs on different hosts
+            produce the same remote cache key.
+        """
         raise NotImplementedError()
 
     def build(self):
-        packages = self.build_package()
+        with self._package_store.create_staging_dir() as staging_dir:
+            if WorkerPool.is_running():
+                packages = WorkerPool.build_remotely(self, staging_dir)
+            else:
+                packages = self.build_package(staging_dir)
+            return self.publish_packages(packages, staging_dir)
+
+    def create_staging_dir(self):
+        return self._package_store.create_staging_dir()
+
+    def publish_packages(self, packages, staging_dir=None):
+        """
+        :return: Paths to the packages in the plugin output directory.
+        """
+        published_packages = []
         for package in packages:
-            shutil.copy(package, self.base_plugin_output_dir)
+            is_staged = os.path.dirname(package) == staging_dir
+            with BuildTrace.span('publish package', package=package):
+                published_packages.append(self._package_store.publish(
+                    package, self.base_plugin_output_dir, move=is_staged))
+        return published_packages
 
 
 
 class CppComponent(MpfComponent):
+    default_build_duration = 300
+    default_peak_memory = 4 * 1024 ** 3
+    sdk_type = CppSdk
+
     def __init__(self, component_src_dir, cmdline_args):
         super(CppComponent, self).__init__(component_src_dir, cmdline_args)
         self._component_build_dir = CmakeUtil.generate_build_path(cmdline_args.build_dir, self.src_dir)
         self._num_make_jobs = cmdline_args.jobs
+        self._use_ninja = cmdline_args.ninja
+        self._compiler_cache = CompilerCache.from_args(cmdline_args)
 
 
-    def build_package(self):
-        CmakeUtil.build(self._component_build_dir, self.src_dir, self._num_make_jobs)
+    def build_package(self, staging_dir):
+        CmakeUtil.build(self._component_build_dir, self.src_dir, self._num_make_jobs,
+                        self._use_ninja, self._compiler_cache)
         return Files.list_component_packages(self._component_build_dir)
 
+    def get_build_inputs(self):
+        return {
+            'sdk': Fingerprint.hash_tree_stats(Files.get_sdk_install_path(), excluded_dirs=('python',)),
+            'toolchain': self._get_toolchain_versions(),
+            'build_dir': self._component_build_dir
+        }
+
+    def get_portable_build_inputs(self):
+        return {
+            'sdk': Fingerprint.hash_tree_contents(Files.get_sdk_install_path(),
+                                                  excluded_dirs=('python',)),
+            'toolchain': self._get_toolchain_versions(),
+            'ninja': self._use_ninja
+        }
 
-class JavaComponent(MpfComponent):
-    def __init__(self, component_src_dir, cmdline_args):
-        super(JavaComponent, self).__init__(component_src_dir, cmdline_args)
+    @staticmethod
+    def _get_toolchain_versions():
+        return [Fingerprint.get_tool_version('cmake3', '--version'),
+                Fingerprint.get_tool_version('make', '--version'),
+                Fingerprint.get_tool_version('c++', '--version')]
 
-    def build_package(self):
-        MavenUtil.package(self.src_dir)
-        return self._find_plugin_packages()
 
+class JavaComponent(MpfComponent):
+    default_build_duration = 120
+    default_peak_memory = 2 * 1024 ** 3
+    sdk_type = JavaSdk
 
-    def _find_plugin_packages(self):
+    def __init__(self, component_src_dir, cmdline_args):
+        super(JavaComponent, self).__init__(component_src_dir, cmdline_args)
+        self._maven_repo = IsolatedMavenRepo.from_args(cmdline_args)
+
+    def build_package(self, staging_dir):
+        MavenUtil.package(self.src_dir, self._maven_repo)
+        return self.find_plugin_packages()
+
+    def get_build_inputs(self):
+        return {
+            'sdk': Fingerprint.hash_tree_stats(
+                IsolatedMavenRepo.get_installed_sdk_path(self._maven_repo)),
+            'toolchain': [Fingerprint.get_tool_version('mvn', '--version')]
+        }
+
+    def get_portable_build_inputs(self):
+        # MANIFEST.MF and pom.properties record the JDK and the time the jar was built.
+        return {
+            'sdk': Fingerprint.hash_tree_contents(
+                IsolatedMavenRepo.get_installed_sdk_path(self._maven_repo),
+                excluded_files=('_remote.repositories', 'maven-metadata-local.xml'),
+                zip_suffixes=('.jar',),
+                excluded_zip_entries=('MANIFEST.MF', 'pom.properties')),
+            'toolchain': [Fingerprint.get_tool_version('mvn', '--version')]
+        }
+
+
+    def find_plugin_packages(self):
         """
         For each Maven module in a Maven project,
         Maven creates a target directory within the module's directory.
@@ -719,41 +4526,157 @@ class JavaComponent(MpfComponent):
 
 
 
+class MavenReactorBuild(MpfProject):
+    """
+    Builds several Java components in a single Maven reactor. The reactor is a single node in
+    the build graph, but build results are still tracked for each component.
+    """
+    def __init__(self, java_components, cmdline_args):
+        super(MavenReactorBuild, self).__init__(os.path.join(cmdline_args.build_dir, 'maven-reactor'))
+        self.components = java_components
+        self._num_jobs = cmdline_args.jobs
+        self._maven_repo = IsolatedMavenRepo.from_args(cmdline_args)
+        self.default_build_duration = sum(c.default_build_duration for c in java_components)
+        # The reactor runs in one JVM, so it does not need the memory of separate builds.
+        self.default_peak_memory = max(c.default_peak_memory for c in java_components)
+
+    def depends_on(self, project):
+        return any(c.depends_on(project) for c in self.components)
+
+    def build(self):
+        return self.build_components(self.components)
+
+
+    def build_components(self, components):
+        """
+        :return: Mapping from each component to its published packages.
+        :raises Exception: When any of the components fail to build. Packages from the components
+            that were built successfully are published before the exception is raised.
+        """
+        if not components:
+            return {}
+        module_dirs = [c.src_dir for c in components]
+        # Warming the isolated repository runs "mvn" while holding its own job slot, so it must
+        # happen before the reactor takes every free slot.
+        repo_args = IsolatedMavenRepo.prepare(self._maven_repo, self.src_dir, module_dirs)
+        max_slots = float('inf') if JobServer.is_running() else self._num_jobs
+        with JobServer.job_slot(max_slots=max_slots) as num_slots:
+            num_threads = '1C' if num_slots == float('inf') else num_slots
+            exit_code, output = MavenUtil.build_reactor(
+                self.src_dir, module_dirs, num_threads, repo_args)
+        statuses = MavenUtil.parse_reactor_summary(output)
+
+        published_packages = {}
+        failed_components = []
+        for component in components:
+            if MavenReactorBuild._component_succeeded(component, exit_code, statuses):
+                published_packages[component] = component.publish_packages(
+                    component.find_plugin_packages())
+            else:
+                failed_components.append(component)
+
+        if failed_components:
+            raise ReactorBuildError(published_packages, failed_components)
+        return published_packages
+
+
+    @staticmethod
+    def _component_succeeded(component, exit_code, statuses):
+        if exit_code == 0:
+            return True
+        module_names = MavenUtil.get_module_names(component.src_dir)
+        if not module_names or any(n not in statuses for n in module_names):
+            # Maven failed before building the component, e.g. because a POM was invalid.
+            return False
+        return all(statuses[n] == 'SUCCESS' for n in module_names)
+
+
+
+class ReactorBuildError(Exception):
+    def __init__(self, published_packages, failed_components):
+        super(ReactorBuildError, self).__init__(
+            'The following Java components failed to build in the Maven reactor: '
+            + ', '.join(c.src_dir for c in failed_components))
+        self.published_packages = published_packages
+        self.failed_components = failed_components
+
+
+
 class PythonComponent(MpfComponent):
+    sdk_type = PythonSdk
+
     def __init__(self, component_src_dir, cmdline_args):
         super(PythonComponent, self).__init__(component_src_dir, cmdline_args)
+        self._compression_level = cmdline_args.compression_level
+        self._wheel_cache = WheelCache.from_args(cmdline_args)
+        self._reuse_build_envs = not cmdline_args.isolated_python_builds
 
-    def build_package(self):
+    def build_package(self, staging_dir):
         if PipUtil.is_project(self.src_dir):
-            return self._build_setuptools_component()
+            return [self._build_setuptools_component(staging_dir)]
         else:
-            Files.tar_directory(self.src_dir, self.base_plugin_output_dir)
-            return ()  # Builds package in place, no need to copy
-
-    def _build_setuptools_component(self):
+            return [Files.tar_directory(self.src_dir, staging_dir, self._compression_level)]
+
+    def get_build_inputs(self):
+        return {
+            'sdk': Fingerprint.hash_tree_stats(PipUtil.get_sdk_wheelhouse()),
+            'toolchain': [Fingerprint.get_tool_version('python3.12', '--version')],
+            'compression_level': self._compression_level
+        }
+
+    def get_portable_build_inputs(self):
+        return {
+            'sdk': Fingerprint.hash_tree_contents(PipUtil.get_sdk_wheelhouse(),
+                                                  zip_suffixes=('.whl',)),
+            'toolchain': [Fingerprint.get_tool_version('python3.12', '--version')],
+            'compression_level': self._compression_level
+        }
+
+    def _build_setuptools_component(self, output_dir):
         leaf_dir = Files.get_leaf(self.src_dir)
+        package_path = os.path.join(output_dir, leaf_dir + '.tar.gz')
         with Files.create_temp_dir() as temp_path:
             download_target_wheelhouse = os.path.join(temp_path, 'wheelhouse')
 
-            pip_args = ['wheel', self.src_dir,
+            build_requires = PipUtil.get_build_requires(self.src_dir)
+            if self._reuse_build_envs and build_requires is not None:
+                # Build the component's wheel first, then let "pip wheel" collect its
+                # dependencies and copy it in to the wheelhouse.
+                requirement = PipUtil.build_wheel_without_isolation(
+                    PipUtil.get_build_env(build_requires), self.src_dir,
+                    os.path.join(temp_path, 'component-wheel'))
+            else:
+                requirement = self.src_dir
+
+            pip_args = ['wheel', requirement,
                         '--wheel-dir', download_target_wheelhouse,
                         '--find-links', PipUtil.get_sdk_wheelhouse()]
 
             plugin_provided_wheelhouse = os.path.join(self.src_dir, 'plugin-files', 'wheelhouse')
             if os.path.exists(plugin_provided_wheelhouse):
                 pip_args += ('--find-links', plugin_provided_wheelhouse)
-            PipUtil.run_pip(*pip_args)
 
-            with tarfile.open(os.path.join(self.base_plugin_output_dir, leaf_dir + '.tar.gz'), 'w:gz') as tar:
+            with PipUtil.locked_sdk_wheelhouse():
+                if self._wheel_cache:
+                    with self._wheel_cache.reading() as cached_wheels_dir:
+                        PipUtil.run_pip(*pip_args, '--find-links', cached_wheels_dir)
+                    # Wheels that are already available locally do not need to be cached.
+                    self._wheel_cache.add(download_target_wheelhouse, excluded_wheelhouses=(
+                        PipUtil.get_sdk_wheelhouse(), plugin_provided_wheelhouse))
+                else:
+                    PipUtil.run_pip(*pip_args)
+
+            with BuildTrace.span('tar/gzip', package=package_path), \
+                    Files.open_tar_gz(package_path, self._compression_level) as tar:
                 dup_filter = create_tar_duplicate_filter()
                 tar.add(os.path.join(self.src_dir, 'plugin-files'), arcname=leaf_dir, filter=dup_filter)
 
-                for whl_file_name in os.listdir(download_target_wheelhouse):
+                for whl_file_name in sorted(os.listdir(download_target_wheelhouse)):
                     tar.add(os.path.join(download_target_wheelhouse, whl_file_name),
                             arcname=os.path.join(leaf_dir, 'wheelhouse', whl_file_name),
                             filter=dup_filter)
 
-            return ()  # Builds package in place, no need to copy
+            return package_path
 
 
 
@@ -764,10 +4687,215 @@ def create_tar_duplicate_filter():
         if tar_info.name in files_seen:
             return None
         files_seen.add(tar_info.name)
-        return tar_info
+        return normalize_tar_info(tar_info)
     return do_filter
 
 
+def normalize_tar_info(tar_info):
+    """
+    Removes the file metadata that varies between builds, so that building the same files
+    always produces the same package.
+    """
+    tar_info.uid = tar_info.gid = 0
+    tar_info.uname = tar_info.gname = ''
+    tar_info.mtime = int(os.getenv('SOURCE_DATE_EPOCH', 0))
+    if tar_info.isdir() or tar_info.mode & 0o111:
+        tar_info.mode = 0o755
+    else:
+        tar_info.mode = 0o644
+    return tar_info
+
+
+class PackageStore(object):
+    """
+    Content addressed store for plugin packages. Each package in the plugin output directory
+    shares its data with the store entry named after the SHA-256 digest of the package. When a
+    rebuilt package has the same bytes as the package already published, the published file is
+    left untouched, so its modification time and inode do not change.
+
+    Packages are added to the store and published without copying their data when possible (see
+    Files.atomic_clone). Packages that this script staged are moved in to the store, and published
+    packages are hard links to store entries. Packages in a C++ build directory or a Maven target
+    directory are never hard linked, because those builds may later rewrite the package in place,
+    which would also rewrite the store entry and the published package while the build runs. The
+    stat of each entry is recorded when it is added, and entries whose stat has changed are
+    discarded.
+    """
+    DIR_NAME = 'package-store'
+
+    def __init__(self, base_build_dir):
+        self._base_build_dir = base_build_dir
+        self._store_dir = os.path.join(base_build_dir, PackageStore.DIR_NAME)
+        self._objects_dir = os.path.join(self._store_dir, 'objects')
+
+    @contextlib.contextmanager
+    def create_staging_dir(self):
+        staging_parent = os.path.join(self._store_dir, 'staging')
+        Files.make_dir(staging_parent)
+        staging_dir = tempfile.mkdtemp(dir=staging_parent)
+        try:
+            yield staging_dir
+        finally:
+            shutil.rmtree(staging_dir)
+
+
+    def publish(self, package, output_dir, move=False):
+        """
+        :param move: When true, package is a temporary file that may be moved in to the store.
+        :return: Path to the published package.
+        """
+        published_path = os.path.join(output_dir, os.path.basename(package))
+        digest = Fingerprint.hash_file(package)
+        object_path = os.path.join(self._objects_dir, digest[:2], digest + '.tar.gz')
+
+        if not PackageStore._is_valid_object(object_path):
+            PackageStore._remove_object(object_path)
+            Files.make_dir(os.path.dirname(object_path))
+            if Files.has_same_contents(published_path, package, digest):
+                # Package was published before the store existed.
+                Files.atomic_clone(published_path, object_path)
+            elif move:
+                os.replace(package, object_path)
+            else:
+                Files.atomic_clone(package, object_path, hard_link=False)
+            PackageStore._record_object_stat(object_path)
+
+        if os.path.exists(published_path) and os.path.samefile(published_path, object_path):
+            print('Package unchanged, not rewriting:', published_path)
+        else:
+            method = Files.atomic_clone(object_path, published_path)
+            print('Published package using %s:' % method, published_path)
+        return published_path
+
+
+    @staticmethod
+    def _get_stat_key(path):
+        stat = os.stat(path)
+        return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+    @staticmethod
+    def _record_object_stat(object_path):
+        Files.write_json(object_path + '.stat', PackageStore._get_stat_key(object_path))
+
+    @staticmethod
+    def _is_valid_object(object_path):
+        try:
+            return PackageStore._get_stat_key(object_path) \
+                == Files.load_json(object_path + '.stat', None)
+        except OSError:
+            return False
+
+    @staticmethod
+    def _remove_object(object_path):
+        for path in (object_path, object_path + '.stat'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+    def prune(self):
+        """
+        Removes store entries that are no longer published or that were modified after being added
+        to the store.
+        """
+        published_files = set()
+        for package in Files.list_component_packages(self._base_build_dir):
+            stat = os.stat(package)
+            published_files.add((stat.st_dev, stat.st_ino))
+
+        for object_path in glob.glob(os.path.join(self._objects_dir, '*', '*.tar.gz')):
+            stat = os.stat(object_path)
+            if ((stat.st_dev, stat.st_ino) not in published_files
+                    or not PackageStore._is_valid_object(object_path)):
+                PackageStore._remove_object(object_path)
+
+
+    def delete(self):
+        if os.path.exists(self._store_dir):
+            print('Deleting', self._store_dir)
+            shutil.rmtree(self._store_dir)
+
+
+
+class ParallelGzipWriter(object):
+    """
+    File-like object that writes a standard single member gzip stream while compressing
+    independent blocks on a thread pool, in the same way as pigz. zlib releases the GIL while
+    compressing, so the blocks are compressed in parallel. Each block uses the last 32 KiB of the
+    preceding block as its dictionary, so the compression ratio is close to that of a serial
+    compressor.
+    """
+    BLOCK_SIZE = 1024 * 1024
+    _DICTIONARY_SIZE = 32 * 1024
+
+    def __init__(self, fileobj, compression_level=9, num_threads=None):
+        self._fileobj = fileobj
+        self._compression_level = compression_level
+        self._num_threads = num_threads or multiprocessing.cpu_count()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._num_threads)
+        self._pending_blocks = collections.deque()
+        self._buffer = bytearray()
+        self._previous_block_tail = b''
+        self._crc = 0
+        self._size = 0
+        self._closed = False
+        # Fixed modification time and OS fields, so output only depends on the input data.
+        self._fileobj.write(b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(cancel_futures=True)
+
+    def write(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.BLOCK_SIZE:
+            block = bytes(self._buffer[:self.BLOCK_SIZE])
+            del self._buffer[:self.BLOCK_SIZE]
+            self._submit_block(block, is_last=False)
+        return len(data)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._submit_block(bytes(self._buffer), is_last=True)
+        self._buffer.clear()
+        while self._pending_blocks:
+            self._fileobj.write(self._pending_blocks.popleft().result())
+        self._executor.shutdown()
+        self._fileobj.write(struct.pack('<II', self._crc, self._size & 0xffffffff))
+
+
+    def _submit_block(self, block, is_last):
+        self._pending_blocks.append(self._executor.submit(
+            ParallelGzipWriter._compress_block, block, self._previous_block_tail,
+            self._compression_level, is_last))
+        self._previous_block_tail = block[-self._DICTIONARY_SIZE:]
+        # Limit the amount of data held in memory.
+        while len(self._pending_blocks) > 2 * self._num_threads:
+            self._fileobj.write(self._pending_blocks.popleft().result())
+
+
+    @staticmethod
+    def _compress_block(block, dictionary, compression_level, is_last):
+        if dictionary:
+            compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                          zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        # Z_SYNC_FLUSH ends the block on a byte boundary without marking it as the final block,
+        # so the raw deflate output of consecutive blocks can be concatenated.
+        return compressor.compress(block) + compressor.flush(
+            zlib.Z_FINISH if is_last else zlib.Z_SYNC_FLUSH)
+
+
+
 def get_plugin_output_dir(cmdline_args):
     return os.path.join(cmdline_args.build_dir, 'plugin-packages')
 
@@ -785,24 +4913,114 @@ class Files(object):
 
     @staticmethod
     def make_dir(path):
-        if not os.path.exists(path):
-            os.makedirs(path)
+        # exist_ok avoids a race when parallel builds create the same directory.
+        os.makedirs(path, exist_ok=True)
 
     @staticmethod
     def list_component_packages(path, *paths):
         directory = os.path.join(path, *paths)
         return glob.glob(os.path.join(directory, 'plugin-packages', '*.tar.gz'))
 
+    @staticmethod
+    def load_json(path, default):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return default
+
+    @staticmethod
+    def write_json(path, obj):
+        """ Writes to a temporary file first so that readers never see a partially written file. """
+        Files.make_dir(os.path.dirname(os.path.abspath(path)))
+        temp_path = '%s.%s.tmp' % (path, threading.get_ident())
+        with open(temp_path, 'w') as f:
+            json.dump(obj, f)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def has_same_contents(path, other_path, other_digest):
+        return (os.path.isfile(path)
+                and os.path.getsize(path) == os.path.getsize(other_path)
+                and Fingerprint.hash_file(path) == other_digest)
+
+    @staticmethod
+    def atomic_clone(src, dest, hard_link=True):
+        """
+        Makes dest contain the same data as src, avoiding copying the data when possible. In order
+        of preference, dest will be a hard link, a reflink (copy-on-write clone), or a copy using
+        os.copy_file_range, which lets the kernel or file system copy the data. When none of those
+        are supported, a regular copy is made. The new file is created under a temporary name and
+        then renamed to dest, so readers never see a partially written dest.
+        :param hard_link: Must be false when src may later be rewritten in place, e.g. by a build
+            tool, since a hard link would share the rewrite.
+        :return: Name of the method used.
+        """
+        temp_path = '%s.%s.tmp' % (dest, threading.get_ident())
+        try:
+            try:
+                if not hard_link:
+                    raise OSError('Hard link not allowed.')
+                os.link(src, temp_path)
+                method = 'hard link'
+            except OSError:
+                method = Files._copy_data(src, temp_path)
+            os.replace(temp_path, dest)
+            return method
+        except BaseException:
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+    _FICLONE = 0x40049409  # From linux/fs.h
+
+    @staticmethod
+    def _copy_data(src, dest):
+        with open(src, 'rb') as src_file, open(dest, 'wb') as dest_file:
+            try:
+                fcntl.ioctl(dest_file.fileno(), Files._FICLONE, src_file.fileno())
+                return 'reflink'
+            except OSError:
+                pass
+
+            try:
+                remaining = os.fstat(src_file.fileno()).st_size
+                while remaining > 0:
+                    num_copied = os.copy_file_range(src_file.fileno(), dest_file.fileno(), remaining)
+                    if num_copied == 0:
+                        break
+                    remaining -= num_copied
+                return 'copy_file_range'
+            except (AttributeError, OSError):
+                # os.copy_file_range is not available or not supported by the file system.
+                src_file.seek(0)
+                dest_file.seek(0)
+                dest_file.truncate()
+
+            shutil.copyfileobj(src_file, dest_file)
+            return 'copy'
+
     @staticmethod
     def expand_path(path):
         return os.path.expanduser(os.path.expandvars(path))
 
     @staticmethod
-    def tar_directory(input_dir, output_dir):
+    def tar_directory(input_dir, output_dir, compression_level=9):
         leaf_dir = Files.get_leaf(input_dir)
         tar_full_path = os.path.join(output_dir, leaf_dir + '.tar.gz')
-        with tarfile.open(tar_full_path, 'w:gz') as tar:
-            tar.add(input_dir, arcname=leaf_dir)
+        with BuildTrace.span('tar/gzip', package=tar_full_path), \
+                Files.open_tar_gz(tar_full_path, compression_level) as tar:
+            tar.add(input_dir, arcname=leaf_dir, filter=normalize_tar_info)
+        return tar_full_path
+
+    @staticmethod
+    @contextlib.contextmanager
+    def open_tar_gz(path, compression_level=9):
+        """ Opens a .tar.gz file for writing that is compressed using all available cores. """
+        with open(path, 'wb') as f, ParallelGzipWriter(f, compression_level) as gzip_writer, \
+                tarfile.open(fileobj=gzip_writer, mode='w|') as tar:
+            yield tar
 
     @staticmethod
     def get_sdk_install_path():
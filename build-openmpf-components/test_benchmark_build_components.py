@@ -0,0 +1,68 @@
+#! /usr/bin/env python3
+
+#############################################################################
+# NOTICE                                                                    #
+#                                                                           #
+# This software (or technical data) was produced for the U.S. Government    #
+# under contract, and is subject to the Rights in Data-General Clause       #
+# 52.227-14, Alt. IV (DEC 2007).                                            #
+#                                                                           #
+# Copyright 2024 The MITRE Corporation. All Rights Reserved.                #
+#############################################################################
+
+#############################################################################
+# Copyright 2024 The MITRE Corporation                                      #
+#                                                                           #
+# Licensed under the Apache License, Version 2.0 (the "License");           #
+# you may not use this file except in compliance with the License.          #
+# You may obtain a copy of the License at                                   #
+#                                                                           #
+#    http://www.apache.org/licenses/LICENSE-2.0                             #
+#                                                                           #
+# Unless required by applicable law or agreed to in writing, software       #
+# distributed under the License is distributed on an "AS IS" BASIS,         #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  #
+# See the License for the specific language governing permissions and       #
+# limitations under the License.                                            #
+#############################################################################
+
+import os
+import tempfile
+import unittest
+
+import benchmark_build_components as benchmark
+
+
+class TestBenchmarkBuildComponents(unittest.TestCase):
+
+    def test_benchmarks_build_synthetic_components(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            args = benchmark.parse_args([
+                '--cpp-components', '1', '--java-components', '1', '--python-components', '1',
+                '--files-per-component', '4', '--file-size', '1K', '--package-size', '1K',
+                '--time-scale', '0', '--repeat', '2', '--work-dir', work_dir])
+            results = benchmark.run_benchmarks(args)
+
+            self.assertEqual(
+                {'locate_cold', 'locate_warm', 'build_cold', 'build_up_to_date', 'clean',
+                 'packaging'},
+                set(results['results']))
+            self.assertEqual(2, len(results['results']['build_cold']['samples']))
+            # The source files plus the descriptor.
+            self.assertGreater(results['results']['packaging']['bytes'], 4 * 1024)
+            with open(os.path.join(work_dir, 'benchmark-output.log')) as f:
+                log = f.read()
+            self.assertIn('3 succeeded, 0 failed', log)
+            self.assertIn('Build cache: 3 hit(s), 0 miss(es).', log)
+            # The second repetition restores the SDK venv that the first one created.
+            self.assertEqual(1, log.count('Creating venv at:'))
+            self.assertIn('Restoring venv snapshot', log)
+            self.assertEqual(1, log.count('Creating Python build environment'))
+            self.assertTrue(os.listdir(
+                os.path.join(work_dir, 'sdk-install', 'python', 'wheel-cache', 'wheels')))
+            self.assertTrue(os.path.exists(
+                os.path.join(work_dir, 'components', 'java', 'BenchmarkJava0', 'pom.xml')))
+
+
+if __name__ == '__main__':
+    unittest.main()
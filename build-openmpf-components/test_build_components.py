@@ -0,0 +1,1151 @@
+#! /usr/bin/env python3
+
+#############################################################################
+# NOTICE                                                                    #
+#                                                                           #
+# This software (or technical data) was produced for the U.S. Government    #
+# under contract, and is subject to the Rights in Data-General Clause       #
+# 52.227-14, Alt. IV (DEC 2007).                                            #
+#                                                                           #
+# Copyright 2024 The MITRE Corporation. All Rights Reserved.                #
+#############################################################################
+
+#############################################################################
+# Copyright 2024 The MITRE Corporation                                      #
+#                                                                           #
+# Licensed under the Apache License, Version 2.0 (the "License");           #
+# you may not use this file except in compliance with the License.          #
+# You may obtain a copy of the License at                                   #
+#                                                                           #
+#    http://www.apache.org/licenses/LICENSE-2.0                             #
+#                                                                           #
+# Unless required by applicable law or agreed to in writing, software       #
+# distributed under the License is distributed on an "AS IS" BASIS,         #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  #
+# See the License for the specific language governing permissions and       #
+# limitations under the License.                                            #
+#############################################################################
+
+
+import unittest
+
+import collections
+import contextlib
+import functools
+import glob
+import gzip
+import io
+import json
+import multiprocessing.connection
+import multiprocessing.pool
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import unittest.mock
+import urllib.error
+import urllib.request
+import zipfile
+
+import build_components
+
+
+class TestBuildComponents(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.build_dir = os.path.join(self.temp_dir, 'build')
+        env_patcher = unittest.mock.patch.dict(
+            os.environ, MPF_SDK_INSTALL_PATH=os.path.join(self.temp_dir, 'sdk-install'))
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+
+
+    def create_python_component(self, name):
+        """ Creates a Python component without a setup.py, so it is packaged by just tarring it. """
+        component_dir = os.path.join(self.temp_dir, 'components', name)
+        os.makedirs(os.path.join(component_dir, 'descriptor'))
+        with open(os.path.join(component_dir, 'descriptor', 'descriptor.json'), 'w') as f:
+            json.dump({'componentName': name, 'sourceLanguage': 'python'}, f)
+        with open(os.path.join(component_dir, name + '.py'), 'w') as f:
+            f.write('print("hello")\n')
+        return component_dir
+
+
+    def run_build(self, *args):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            cmdline_args = build_components.MpfArgumentParser.parse(['-b', self.build_dir, *args])
+            components = build_components.ComponentLocator.locate(cmdline_args)
+            if cmdline_args.clean or cmdline_args.clean_only:
+                build_components.clean(cmdline_args.build_dir, components,
+                                       cmdline_args.native_clean)
+            if not cmdline_args.clean_only:
+                build_components.ProjectBuilder.build_projects([], components, cmdline_args)
+        return output.getvalue()
+
+
+    def create_builder(self, pool_size):
+        return build_components.ProjectBuilder(
+            pool_size, build_components.BuildManifest(self.build_dir),
+            build_components.BuildHistory(self.build_dir))
+
+
+    def test_unchanged_component_is_skipped(self):
+        component_dir = self.create_python_component('TestComponent')
+        output = self.run_build('-c', component_dir)
+        self.assertIn('Build cache miss', output)
+        package = os.path.join(self.build_dir, 'plugin-packages', 'TestComponent.tar.gz')
+        self.assertTrue(os.path.exists(package))
+
+        output = self.run_build('-c', component_dir)
+        self.assertIn('Build cache hit', output)
+        self.assertIn('1 hit(s), 0 miss(es)', output)
+
+        output = self.run_build('-c', component_dir, '--force-rebuild')
+        self.assertIn('Build cache miss', output)
+
+
+    def test_changed_component_is_rebuilt(self):
+        component_dir = self.create_python_component('TestComponent')
+        self.run_build('-c', component_dir)
+
+        with open(os.path.join(component_dir, 'TestComponent.py'), 'a') as f:
+            f.write('print("world")\n')
+        self.assertIn('Build cache miss', self.run_build('-c', component_dir))
+
+        os.remove(os.path.join(self.build_dir, 'plugin-packages', 'TestComponent.tar.gz'))
+        self.assertIn('Build cache miss', self.run_build('-c', component_dir))
+        self.assertIn('Build cache hit', self.run_build('-c', component_dir))
+
+
+    def test_trace_contains_build_phases(self):
+        component_dir = self.create_python_component('TestComponent')
+        trace_path = os.path.join(self.temp_dir, 'trace.json')
+        self.run_build('-c', component_dir, '--trace', trace_path)
+
+        with open(trace_path) as f:
+            events = json.load(f)['traceEvents']
+        spans = {e['name']: e for e in events if e['ph'] == 'X'}
+        self.assertEqual({'TestComponent', 'fingerprint', 'tar/gzip', 'publish package'}, set(spans))
+        project_span = spans['TestComponent']
+        tar_span = spans['tar/gzip']
+        self.assertEqual(component_dir, tar_span['args']['project'])
+        self.assertEqual(project_span['tid'], tar_span['tid'])
+        self.assertLessEqual(project_span['ts'], tar_span['ts'])
+        self.assertGreaterEqual(project_span['ts'] + project_span['dur'],
+                                tar_span['ts'] + tar_span['dur'])
+
+
+    def test_parallel_gzip_output_is_standard_gzip(self):
+        random_data = os.urandom(build_components.ParallelGzipWriter.BLOCK_SIZE)
+        repetitive_data = b'abcdefgh' * build_components.ParallelGzipWriter.BLOCK_SIZE
+        data = random_data + repetitive_data + random_data[:1000]
+
+        output = io.BytesIO()
+        with build_components.ParallelGzipWriter(output, compression_level=6, num_threads=3) as f:
+            for i in range(0, len(data), 10000):
+                f.write(data[i:i + 10000])
+        self.assertEqual(data, gzip.decompress(output.getvalue()))
+        self.assertLess(len(output.getvalue()), len(random_data) + len(repetitive_data) // 100)
+
+        empty_output = io.BytesIO()
+        build_components.ParallelGzipWriter(empty_output).close()
+        self.assertEqual(b'', gzip.decompress(empty_output.getvalue()))
+
+
+    def test_component_package_contents(self):
+        component_dir = self.create_python_component('TestComponent')
+        self.run_build('-c', component_dir, '--fast-packaging')
+        package = os.path.join(self.build_dir, 'plugin-packages', 'TestComponent.tar.gz')
+        with tarfile.open(package, 'r:gz') as tar:
+            self.assertEqual(
+                ['TestComponent', 'TestComponent/TestComponent.py', 'TestComponent/descriptor',
+                 'TestComponent/descriptor/descriptor.json'],
+                sorted(tar.getnames()))
+            descriptor = json.load(tar.extractfile('TestComponent/descriptor/descriptor.json'))
+        self.assertEqual('TestComponent', descriptor['componentName'])
+
+
+    def test_identical_packages_are_not_rewritten(self):
+        component_dir = self.create_python_component('TestComponent')
+        self.run_build('-c', component_dir)
+        package = os.path.join(self.build_dir, 'plugin-packages', 'TestComponent.tar.gz')
+        first_stat = os.stat(package)
+
+        self.assertIn('Package unchanged', self.run_build('-c', component_dir, '--force-rebuild'))
+        second_stat = os.stat(package)
+        self.assertEqual(first_stat.st_ino, second_stat.st_ino)
+        self.assertEqual(first_stat.st_mtime_ns, second_stat.st_mtime_ns)
+
+        with open(os.path.join(component_dir, 'TestComponent.py'), 'a') as f:
+            f.write('print("world")\n')
+        self.assertIn('Published package', self.run_build('-c', component_dir))
+        self.assertNotEqual(first_stat.st_ino, os.stat(package).st_ino)
+        store_objects = glob.glob(
+            os.path.join(self.build_dir, 'package-store', 'objects', '*', '*.tar.gz'))
+        self.assertEqual(1, len(store_objects))
+        self.assertTrue(os.path.samefile(package, store_objects[0]))
+
+
+    def test_packages_modified_in_place_are_republished(self):
+        component_build_dir = os.path.join(self.build_dir, 'component-build', 'plugin-packages')
+        os.makedirs(component_build_dir)
+        build_output = os.path.join(component_build_dir, 'TestComponent.tar.gz')
+        with open(build_output, 'w') as f:
+            f.write('first build')
+
+        output_dir = os.path.join(self.build_dir, 'plugin-packages')
+        os.makedirs(output_dir)
+        store = build_components.PackageStore(self.build_dir)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            published_path = store.publish(build_output, output_dir)
+        self.assertIn('Published package using hard link', output.getvalue())
+        self.assertFalse(os.path.samefile(build_output, published_path))
+
+        # Simulate a build that overwrites its previous output rather than replacing it.
+        with open(build_output, 'r+') as f:
+            f.write('second build')
+        # The published package is not modified while the build runs.
+        with open(published_path) as f:
+            self.assertEqual('first build', f.read())
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            store.publish(build_output, output_dir)
+            store.prune()
+        self.assertNotIn('Package unchanged', output.getvalue())
+        store_objects = glob.glob(
+            os.path.join(self.build_dir, 'package-store', 'objects', '*', '*.tar.gz'))
+        self.assertEqual(1, len(store_objects))
+        with open(store_objects[0]) as f:
+            self.assertEqual('second build', f.read())
+        with open(published_path) as f:
+            self.assertEqual('second build', f.read())
+
+
+    def test_atomic_clone_falls_back_to_copying_data(self):
+        src = os.path.join(self.temp_dir, 'src')
+        dest = os.path.join(self.temp_dir, 'dest')
+        with open(src, 'w') as f:
+            f.write('data')
+        with unittest.mock.patch('os.link', side_effect=OSError):
+            method = build_components.Files.atomic_clone(src, dest)
+        self.assertIn(method, ('reflink', 'copy_file_range', 'copy'))
+        self.assertFalse(os.path.samefile(src, dest))
+        with open(dest) as f:
+            self.assertEqual('data', f.read())
+        self.assertEqual(['dest', 'src'], sorted(os.listdir(self.temp_dir)))
+
+
+    def test_components_do_not_wait_for_other_languages_sdk(self):
+        python_component_built = threading.Event()
+
+        def build_slow_sdk():
+            if not python_component_built.wait(timeout=10):
+                raise Exception('Python component was not built while the C++ SDK was building.')
+
+        cpp_sdk = FakeProject('cpp-sdk', build_slow_sdk)
+        python_sdk = FakeProject('python-sdk')
+        python_component = FakeProject('python-component', python_component_built.set, python_sdk)
+        cpp_component = FakeProject('cpp-component', dependency=cpp_sdk)
+
+        builds = []
+        for project in (cpp_sdk, python_sdk, python_component, cpp_component):
+            project.on_build = functools.partial(builds.append, project)
+
+        builder = self.create_builder(2)
+        builder.build([cpp_sdk, python_sdk, cpp_component, python_component])
+        self.assertLess(builds.index(python_component), builds.index(cpp_sdk))
+        self.assertLess(builds.index(cpp_sdk), builds.index(cpp_component))
+
+
+    def test_dependents_of_failed_project_are_skipped(self):
+        def fail():
+            raise Exception('SDK build failed')
+        cpp_sdk = FakeProject('cpp-sdk', fail)
+        cpp_component = FakeProject('cpp-component', dependency=cpp_sdk)
+        python_component = FakeProject('python-component')
+
+        builder = self.create_builder(2)
+        with self.assertRaises(SystemExit) as cm:
+            builder.build([cpp_sdk, cpp_component, python_component])
+        self.assertIn('Did not build cpp-component because cpp-sdk failed', str(cm.exception))
+        self.assertFalse(cpp_component.built)
+        self.assertTrue(python_component.built)
+
+
+    def test_fail_fast_kills_running_builds(self):
+        long_build_started = threading.Event()
+
+        def long_build():
+            long_build_started.set()
+            build_components.SubprocessUtil.check_call(('sh', '-c', 'sleep 30'))
+
+        def fail():
+            long_build_started.wait()
+            time.sleep(0.2)
+            raise Exception('compile error')
+
+        long_project = FakeProject('long', long_build)
+        failing_project = FakeProject('failing', fail)
+        queued_project = FakeProject('queued')
+        builder = build_components.ProjectBuilder(
+            2, build_components.BuildManifest(self.build_dir),
+            build_components.BuildHistory(self.build_dir), failure_mode='fail-fast')
+
+        start_time = time.monotonic()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), self.assertRaises(SystemExit):
+            try:
+                builder.build([long_project, failing_project, queued_project])
+            finally:
+                build_components.SubprocessUtil.reset()
+        self.assertLess(time.monotonic() - start_time, 10)
+        self.assertFalse(queued_project.built)
+        self.assertRegex(output.getvalue(), r'long\s+cancelled')
+        self.assertRegex(output.getvalue(), r'failing\s+failed\s+compile error')
+        self.assertRegex(output.getvalue(), r'queued\s+cancelled\s+not started')
+        self.assertIn('0 succeeded, 1 failed, 0 skipped, 2 cancelled.', output.getvalue())
+
+
+    def test_projects_on_critical_path_built_first(self):
+        short = FakeProject('short')
+        long = FakeProject('long')
+        sdk = FakeProject('sdk')
+        sdk_dependent = FakeProject('sdk-dependent', dependency=sdk)
+        projects = [short, long, sdk, sdk_dependent]
+
+        history = build_components.BuildHistory(self.build_dir)
+        for project, duration in ((short, 1), (long, 10), (sdk, 4), (sdk_dependent, 8)):
+            history.record_duration(project, duration)
+        history.save()
+
+        builds = []
+        for project in projects:
+            project.on_build = functools.partial(builds.append, project.src_dir)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.create_builder(1).build(projects)
+        self.assertEqual(['sdk', 'long', 'sdk-dependent', 'short'], builds)
+
+        with contextlib.redirect_stdout(output):
+            self.create_builder(2).build(projects)
+        self.assertIn('Predicted time was 12 seconds when ordering builds by critical path and '
+                      '13 seconds when using command line order.', output.getvalue())
+
+        # "-p 0" builds sequentially.
+        builder = self.create_builder(0)
+        self.assertEqual(23, builder.predict_makespan(
+            projects, build_components.ProjectBuilder.get_dependencies(projects),
+            {p: history.get_estimated_duration(p) for p in projects}))
+
+
+    def test_jobserver_limits_jobs_across_make_processes(self):
+        log_path = os.path.join(self.temp_dir, 'jobs.log')
+        make_dirs = []
+        for i in range(2):
+            make_dir = os.path.join(self.temp_dir, 'make%s' % i)
+            os.makedirs(make_dir)
+            with open(os.path.join(make_dir, 'Makefile'), 'w') as f:
+                f.write('all: a b c\n'
+                        'a b c:\n'
+                        '\t@echo start >> %s; sleep 0.2; echo end >> %s\n' % (log_path, log_path))
+            make_dirs.append(make_dir)
+
+        with build_components.JobServer.running(3):
+            threads = [threading.Thread(target=build_components.SubprocessUtil.check_call,
+                                        args=(('make', '--silent'),),
+                                        kwargs=dict(cwd=d, share_jobserver=True))
+                       for d in make_dirs]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        with open(log_path) as f:
+            events = f.read().split()
+        self.assertEqual(12, len(events))
+        num_running = max_running = 0
+        for event in events:
+            num_running += 1 if event == 'start' else -1
+            max_running = max(num_running, max_running)
+        self.assertEqual(3, max_running)
+
+
+    def test_job_slot_takes_available_extra_slots(self):
+        with build_components.JobServer.running(3):
+            with build_components.JobServer.job_slot() as num_slots:
+                self.assertEqual(1, num_slots)
+                with build_components.JobServer.job_slot(max_slots=float('inf')) as num_slots:
+                    self.assertEqual(2, num_slots)
+            with build_components.JobServer.job_slot(max_slots=float('inf')) as num_slots:
+                self.assertEqual(3, num_slots)
+
+
+    def create_configured_cmake_build_dir(self, generator):
+        src_dir = os.path.join(self.temp_dir, 'src dir')
+        build_dir = os.path.join(self.temp_dir, 'build')
+        os.makedirs(src_dir)
+        os.makedirs(os.path.join(build_dir, 'CMakeFiles'))
+        cmake_lists = os.path.join(src_dir, 'CMakeLists.txt')
+        with open(cmake_lists, 'w') as f:
+            f.write('project(Test)\n')
+        with open(os.path.join(build_dir, 'CMakeCache.txt'), 'w') as f:
+            f.write('# This is the CMakeCache file.\n'
+                    'CMAKE_GENERATOR:INTERNAL=%s\n'
+                    'CMAKE_HOME_DIRECTORY:INTERNAL=%s\n' % (generator, src_dir))
+        if generator == 'Ninja':
+            with open(os.path.join(build_dir, 'build.ninja'), 'w') as f:
+                f.write('build build.ninja: RERUN_CMAKE | %s $\n    CMakeCache.txt\n'
+                        '  pool = console\n' % cmake_lists.replace(' ', '$ '))
+        else:
+            with open(os.path.join(build_dir, 'Makefile'), 'w') as f:
+                f.write('all:\n')
+            with open(os.path.join(build_dir, 'CMakeFiles', 'Makefile.cmake'), 'w') as f:
+                f.write('set(CMAKE_MAKEFILE_DEPENDS\n  "CMakeCache.txt"\n  "%s"\n  )\n'
+                        % cmake_lists)
+        with open(os.path.join(build_dir, 'CMakeFiles', 'cmake.check_cache'), 'w') as f:
+            f.write('# This file is generated by cmake for dependency checking\n')
+        os.utime(cmake_lists, ns=(0, 0))
+        os.utime(os.path.join(build_dir, 'CMakeCache.txt'), ns=(0, 0))
+        return src_dir, build_dir, cmake_lists
+
+
+    def test_configure_skipped_when_up_to_date(self):
+        for generator in ('Unix Makefiles', 'Ninja'):
+            with self.subTest(generator=generator):
+                src_dir, build_dir, cmake_lists = self.create_configured_cmake_build_dir(generator)
+                self.assertFalse(
+                    build_components.CmakeUtil._needs_configure(build_dir, src_dir, generator, {}))
+
+                for launcher, needs_configure in (('', False), ('ccache', True)):
+                    cache_variables = build_components.CompilerCache.get_cmake_variables(
+                        launcher and build_components.CompilerCache('cache', '1G'))
+                    self.assertEqual(needs_configure, build_components.CmakeUtil._needs_configure(
+                        build_dir, src_dir, generator, cache_variables))
+
+                os.utime(cmake_lists)
+                self.assertTrue(
+                    build_components.CmakeUtil._needs_configure(build_dir, src_dir, generator, {}))
+
+                os.utime(cmake_lists, ns=(0, 0))
+                other_generator = 'Ninja' if generator == 'Unix Makefiles' else 'Unix Makefiles'
+                with contextlib.redirect_stdout(io.StringIO()):
+                    self.assertTrue(build_components.CmakeUtil._needs_configure(
+                        build_dir, src_dir, other_generator, {}))
+                self.assertFalse(os.path.exists(os.path.join(build_dir, 'CMakeCache.txt')))
+                shutil.rmtree(src_dir)
+                shutil.rmtree(build_dir)
+
+
+    def test_ccache_stats_recorded_per_project(self):
+        compiler_cache = build_components.CompilerCache(self.temp_dir, '1G')
+        with build_components.CompilerCache.recording_stats(
+                compiler_cache, '/src/TestComponent', self.temp_dir) as env:
+            self.assertEqual(self.temp_dir, env['CCACHE_DIR'])
+            with open(env['CCACHE_STATSLOG'], 'w') as f:
+                f.write('# /src/a.cpp\ndirect_cache_hit\n'
+                        '# /src/b.cpp\npreprocessed_cache_hit\n'
+                        '# /src/c.cpp\ncache_miss\n')
+        self.assertIn(('TestComponent', 2, 1), build_components.CompilerCache._stats)
+
+
+    def test_source_hashes_reused_when_stats_unchanged(self):
+        component_dir = self.create_python_component('TestComponent')
+        digest, file_hashes = build_components.Fingerprint.hash_source_tree(component_dir, {})
+        with unittest.mock.patch.object(build_components.Fingerprint, 'hash_file') as hash_file:
+            digest2, _ = build_components.Fingerprint.hash_source_tree(component_dir, file_hashes)
+        hash_file.assert_not_called()
+        self.assertEqual(digest, digest2)
+
+
+    def create_java_component(self, name):
+        component_dir = os.path.join(self.temp_dir, 'components', name)
+        os.makedirs(component_dir)
+        with open(os.path.join(component_dir, 'pom.xml'), 'w') as f:
+            f.write('<project xmlns="http://maven.apache.org/POM/4.0.0">'
+                    '<artifactId>%s</artifactId></project>' % name)
+        return component_dir
+
+
+    def create_fake_mvn(self, script):
+        """ Puts an "mvn" script first on the PATH for the rest of the test. """
+        bin_dir = os.path.join(self.temp_dir, 'bin')
+        os.makedirs(bin_dir)
+        fake_mvn = os.path.join(bin_dir, 'mvn')
+        with open(fake_mvn, 'w') as f:
+            f.write('#!/bin/sh\n'
+                    '[ "$1" = --version ] && echo "Apache Maven 3" && exit 0\n' + script)
+        os.chmod(fake_mvn, 0o755)
+        env_patcher = unittest.mock.patch.dict(
+            os.environ, PATH=bin_dir + os.pathsep + os.environ['PATH'])
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+
+
+    def test_reactor_failures_mapped_to_components(self):
+        good_dir = self.create_java_component('GoodComponent')
+        bad_dir = self.create_java_component('BadComponent')
+        self.create_fake_mvn(
+            'mkdir -p {0}/target/plugin-packages\n'
+            'echo package > {0}/target/plugin-packages/GoodComponent.tar.gz\n'
+            'echo "[INFO] Reactor Summary for mpf-build-components-reactor 1.0:"\n'
+            'echo "[INFO] "\n'
+            'echo "[INFO] GoodComponent ...................... SUCCESS [  1.0 s]"\n'
+            'echo "[INFO] BadComponent ....................... FAILURE [  1.0 s]"\n'
+            'echo "[INFO] mpf-build-components-reactor ....... SKIPPED"\n'
+            'echo "[INFO] -----------------------------------------------------"\n'
+            'exit 1\n'.format(good_dir))
+
+        with self.assertRaises(SystemExit):
+            self.run_build('--maven-reactor', '-c', good_dir + ':' + bad_dir)
+
+        plugin_dir = os.path.join(self.build_dir, 'plugin-packages')
+        self.assertEqual(['GoodComponent.tar.gz'], os.listdir(plugin_dir))
+        with open(os.path.join(self.build_dir, 'maven-reactor', 'pom.xml')) as f:
+            aggregator_pom = f.read()
+        self.assertIn('<module>../../components/GoodComponent</module>', aggregator_pom)
+        manifest = build_components.Files.load_json(
+            os.path.join(self.build_dir, 'build-manifest.json'), {})
+        self.assertIn(good_dir, manifest)
+        self.assertNotIn(bad_dir, manifest)
+
+
+    def test_isolated_maven_repo_warmed_once(self):
+        component_dir = self.create_java_component('TestComponent')
+        mvn_log = os.path.join(self.temp_dir, 'mvn.log')
+        self.create_fake_mvn('echo "$@" >> %s\n' % mvn_log)
+        warmed_repo = os.path.join(self.temp_dir, 'warmed-repo')
+
+        self.run_build('--isolated-maven-repo', warmed_repo, '-c', component_dir)
+        self.run_build('--isolated-maven-repo', warmed_repo, '--force-rebuild', '-c', component_dir)
+
+        with open(mvn_log) as f:
+            commands = f.read().splitlines()
+        self.assertEqual(3, len(commands))
+        self.assertIn('dependency:go-offline', commands[0])
+        self.assertIn('-Dmaven.repo.local=' + warmed_repo, commands[0])
+        overlay_dir = os.path.join(
+            self.build_dir, 'maven-repos', 'projects', 'TestComponent-%s'
+            % build_components.Fingerprint.hash_json(component_dir)[:16])
+        for command in commands[1:]:
+            self.assertTrue(command.startswith('package --offline'))
+            self.assertIn('-Dmaven.repo.local=' + overlay_dir, command)
+            self.assertIn(warmed_repo, command)
+
+    def test_isolated_maven_repo_with_reactor_and_jobserver(self):
+        component_dirs = [self.create_java_component(n) for n in ('ComponentA', 'ComponentB')]
+        mvn_log = os.path.join(self.temp_dir, 'mvn.log')
+        self.create_fake_mvn('echo "$@" >> %s\n' % mvn_log)
+        warmed_repo = os.path.join(self.temp_dir, 'warmed-repo')
+
+        build_thread = threading.Thread(target=self.run_build, daemon=True, args=(
+            '--maven-reactor', '--isolated-maven-repo', warmed_repo, '--jobserver', '2',
+            '-c', ':'.join(component_dirs)))
+        build_thread.start()
+        build_thread.join(30)
+        self.assertFalse(build_thread.is_alive(), 'The build did not finish.')
+
+        with open(mvn_log) as f:
+            commands = f.read().splitlines()
+        self.assertEqual(3, len(commands))
+        self.assertIn('dependency:go-offline', commands[0])
+        self.assertIn('dependency:go-offline', commands[1])
+        self.assertIn('--offline', commands[2])
+        self.assertIn('-T 2 ', commands[2])
+
+    def test_wheel_cache_evicts_least_recently_used(self):
+        cache = build_components.WheelCache(os.path.join(self.temp_dir, 'wheel-cache'), 250)
+        wheelhouse = os.path.join(self.temp_dir, 'wheelhouse')
+        sdk_wheelhouse = os.path.join(self.temp_dir, 'sdk-wheelhouse')
+        os.makedirs(wheelhouse)
+        os.makedirs(sdk_wheelhouse)
+        for name in ('numpy-1.0-cp312-cp312-linux_x86_64.whl', 'six-1.0-py3-none-any.whl',
+                     'mpf_sdk-1.0-py3-none-any.whl'):
+            with open(os.path.join(wheelhouse, name), 'w') as f:
+                f.write(name.ljust(100))
+        shutil.copy(os.path.join(wheelhouse, 'mpf_sdk-1.0-py3-none-any.whl'), sdk_wheelhouse)
+
+        with unittest.mock.patch.object(build_components.time, 'time', return_value=1):
+            cache.add(wheelhouse, excluded_wheelhouses=(sdk_wheelhouse,))
+        with cache.reading() as cached_wheels_dir:
+            self.assertEqual(['numpy-1.0-cp312-cp312-linux_x86_64.whl', 'six-1.0-py3-none-any.whl'],
+                             sorted(os.listdir(cached_wheels_dir)))
+
+        # Using numpy again makes six the least recently used wheel.
+        os.remove(os.path.join(wheelhouse, 'six-1.0-py3-none-any.whl'))
+        with open(os.path.join(wheelhouse, 'attrs-1.0-py3-none-any.whl'), 'w') as f:
+            f.write('attrs'.ljust(100))
+        with unittest.mock.patch.object(build_components.time, 'time', return_value=2):
+            cache.add(wheelhouse, excluded_wheelhouses=(sdk_wheelhouse,))
+        self.assertEqual(['attrs-1.0-py3-none-any.whl', 'numpy-1.0-cp312-cp312-linux_x86_64.whl'],
+                         sorted(os.listdir(cached_wheels_dir)))
+        objects = glob.glob(os.path.join(self.temp_dir, 'wheel-cache', 'objects', '*', '*.whl'))
+        self.assertEqual(2, len(objects))
+
+
+    def test_parse_size(self):
+        self.assertEqual(500 * 1024 ** 2, build_components.parse_size('500M'))
+        self.assertEqual(int(1.5 * 1024 ** 3), build_components.parse_size('1.5G'))
+        self.assertEqual(0, build_components.parse_size('0'))
+
+    def test_python_sdk_packages_built_with_one_pip_wheel_and_install(self):
+        sdk_src = os.path.join(self.temp_dir, 'python-sdk')
+        for package in ('api', 'component_util'):
+            os.makedirs(os.path.join(sdk_src, 'detection', package))
+            open(os.path.join(sdk_src, 'detection', package, 'pyproject.toml'), 'w').close()
+        cmdline_args = build_components.MpfArgumentParser.parse(
+            ['-b', self.build_dir, '-psdk', sdk_src])
+        python_sdk = build_components.PythonSdk(cmdline_args)
+
+        with unittest.mock.patch.object(build_components.PipUtil, '_get_python_executable',
+                                        return_value='python3.12'), \
+                unittest.mock.patch.object(build_components.SubprocessUtil, 'check_call') as call, \
+                unittest.mock.patch.object(build_components.PipUtil, '_durations', []), \
+                unittest.mock.patch.object(build_components.PipUtil, '_invocations_avoided', 0):
+            python_sdk.build()
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                build_components.PipUtil.print_stats_summary()
+
+        self.assertEqual(['wheel', 'install'], [c.args[0][3] for c in call.call_args_list])
+        for pip_call in call.call_args_list:
+            self.assertEqual(python_sdk.packages, list(pip_call.args[0][-2:]))
+        self.assertIn('Batching avoided 2 invocation(s)', output.getvalue())
+
+    def test_build_env_reused_until_requirements_change(self):
+        component_dir = os.path.join(self.temp_dir, 'TestComponent')
+        os.makedirs(component_dir)
+        with open(os.path.join(component_dir, 'pyproject.toml'), 'w') as f:
+            f.write('[build-system]\nrequires = ["wheel", "setuptools>=61"]\n')
+        build_requires = build_components.PipUtil.get_build_requires(component_dir)
+        self.assertEqual(['setuptools>=61', 'wheel'], build_requires)
+
+        with unittest.mock.patch.object(build_components.Fingerprint, 'get_tool_version',
+                                        return_value='Python 3.12.0'), \
+                unittest.mock.patch.object(build_components.SubprocessUtil, 'check_call') as call, \
+                contextlib.redirect_stdout(io.StringIO()):
+            env_python = build_components.PipUtil.get_build_env(build_requires)
+            self.assertEqual(env_python, build_components.PipUtil.get_build_env(build_requires))
+            self.assertEqual(2, call.call_count)
+            self.assertEqual((env_python, '-m', 'pip', 'install', 'setuptools>=61', 'wheel'),
+                             call.call_args.args[0])
+
+            other_python = build_components.PipUtil.get_build_env(['hatchling'])
+            self.assertNotEqual(env_python, other_python)
+            self.assertEqual(4, call.call_count)
+
+    def test_venv_restored_from_snapshot(self):
+        original_venv = os.path.join(self.temp_dir, 'original', 'venv')
+        os.makedirs(os.path.join(original_venv, 'bin'))
+        os.makedirs(os.path.join(original_venv, 'lib', 'site-packages'))
+        os.symlink('lib', os.path.join(original_venv, 'lib64'))
+        with open(os.path.join(original_venv, 'pyvenv.cfg'), 'w') as f:
+            f.write('command = python3.12 -m venv %s\n' % original_venv)
+        with open(os.path.join(original_venv, 'lib', 'site-packages', 'pip.py'), 'w') as f:
+            f.write('# pip\n')
+        # Stands in for the interpreter check, which prints the venv's sys.prefix.
+        fake_python = os.path.join(original_venv, 'bin', 'python3.12')
+        with open(fake_python, 'w') as f:
+            f.write('#!/bin/sh\necho %s\n' % original_venv)
+        os.chmod(fake_python, 0o755)
+
+        restored_venv = os.path.join(self.temp_dir, 'restored', 'venv')
+        with unittest.mock.patch.object(build_components.Fingerprint, 'get_tool_version',
+                                        return_value='Python 3.12.0'), \
+                build_components.VenvSnapshot.enabled(os.path.join(self.temp_dir, 'snapshots')), \
+                contextlib.redirect_stdout(io.StringIO()):
+            build_components.VenvSnapshot.save(original_venv)
+            shutil.rmtree(original_venv)
+            self.assertTrue(build_components.VenvSnapshot.restore(restored_venv))
+
+        with open(os.path.join(restored_venv, 'pyvenv.cfg')) as f:
+            self.assertIn(restored_venv, f.read())
+        self.assertEqual('lib', os.readlink(os.path.join(restored_venv, 'lib64')))
+        self.assertEqual(2, os.stat(os.path.join(restored_venv, 'lib', 'site-packages', 'pip.py'))
+                         .st_nlink)
+
+    def test_sdk_venv_created_once_by_parallel_builds(self):
+        def create_venv(command):
+            time.sleep(0.1)
+            os.makedirs(os.path.join(command[3], 'bin'))
+            open(os.path.join(command[3], 'bin', 'python3.12'), 'w').close()
+
+        get_python_executable = build_components.PipUtil._get_python_executable
+        get_python_executable.cache_clear()
+        self.addCleanup(get_python_executable.cache_clear)
+        with unittest.mock.patch.object(build_components.SubprocessUtil, 'check_call',
+                                        side_effect=create_venv) as call, \
+                contextlib.redirect_stdout(io.StringIO()), \
+                multiprocessing.pool.ThreadPool(4) as pool:
+            executables = pool.map(lambda _: get_python_executable(), range(4))
+
+        self.assertEqual(1, call.call_count)
+        self.assertEqual(1, len(set(executables)))
+
+    def test_fast_clean_deletes_build_outputs(self):
+        component_dir = self.create_java_component('TestComponent')
+        os.makedirs(os.path.join(component_dir, 'target', 'classes'))
+        os.makedirs(os.path.join(component_dir, 'module', 'target'))
+        os.makedirs(os.path.join(component_dir, 'src'))
+        with open(os.path.join(component_dir, 'module', 'pom.xml'), 'w') as f:
+            f.write('<project/>')
+        with open(os.path.join(component_dir, 'target', 'classes', 'A.class'), 'wb') as f:
+            f.write(b'a' * 1000)
+        cmake_build_dir = os.path.join(self.build_dir, 'src-TestCppComponent-build')
+        os.makedirs(os.path.join(cmake_build_dir, 'CMakeFiles'))
+        with open(os.path.join(cmake_build_dir, 'CMakeCache.txt'), 'wb') as f:
+            f.write(b'c' * 24)
+        os.makedirs(os.path.join(self.build_dir, 'plugin-packages'))
+        open(os.path.join(self.build_dir, 'plugin-packages', 'TestComponent.tar.gz'), 'w').close()
+        os.makedirs(os.path.join(self.build_dir, 'maven-repos'))
+
+        output = self.run_build('--clean-only', '-c', component_dir)
+
+        self.assertIn('Clean freed 1.0 KiB', output)
+        self.assertEqual(['module', 'pom.xml', 'src'], sorted(os.listdir(component_dir)))
+        self.assertEqual(['pom.xml'], os.listdir(os.path.join(component_dir, 'module')))
+        self.assertEqual(['maven-repos', 'plugin-packages'], sorted(os.listdir(self.build_dir)))
+
+    def test_discovered_components_use_saved_index(self):
+        search_path = os.path.join(self.temp_dir, 'components')
+        python_dir = self.create_python_component('PythonComponent')
+        java_dir = self.create_java_component('JavaComponent')
+        os.makedirs(os.path.join(search_path, 'NotAComponent'))
+
+        def locate():
+            cmdline_args = build_components.MpfArgumentParser.parse(
+                ['-b', self.build_dir, '-cp', search_path, '--discover-components'])
+            return build_components.ComponentLocator.locate(cmdline_args)
+
+        components = locate()
+        self.assertEqual([java_dir, python_dir], [c.src_dir for c in components])
+        self.assertIsInstance(components[0], build_components.JavaComponent)
+
+        with unittest.mock.patch.object(build_components.os, 'scandir') as scandir, \
+                unittest.mock.patch.object(build_components.Files, 'load_json',
+                                           wraps=build_components.Files.load_json) as load_json:
+            self.assertEqual([java_dir, python_dir], [c.src_dir for c in locate()])
+        scandir.assert_not_called()
+        # Only the index itself is loaded. The descriptor's language comes from the index.
+        self.assertEqual(1, load_json.call_count)
+
+        os.remove(os.path.join(python_dir, 'descriptor', 'descriptor.json'))
+        self.assertEqual([java_dir], [c.src_dir for c in locate()])
+
+    def test_build_output_written_to_project_logs(self):
+        def fail():
+            build_components.SubprocessUtil.check_call(('sh', '-c', 'echo compile error; exit 1'))
+        failing_project = FakeProject('/src/failing', fail)
+        passing_project = FakeProject('/src/passing', lambda: build_components.SubprocessUtil
+                                      .check_call(('sh', '-c', 'echo compiled')))
+        log_dir = os.path.join(self.build_dir, 'logs')
+        builder = build_components.ProjectBuilder(
+            2, build_components.BuildManifest(self.build_dir),
+            build_components.BuildHistory(self.build_dir), log_dir)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), self.assertRaises(SystemExit):
+            builder.build([failing_project, passing_project])
+
+        with open(os.path.join(log_dir, 'src-passing.log')) as f:
+            self.assertEqual('+ sh -c echo compiled\ncompiled\n', f.read())
+        self.assertIn('compile error', output.getvalue())
+        self.assertNotIn('compiled\n', output.getvalue())
+        self.assertIn('2/2 finished (1 failed)', output.getvalue())
+
+    def start_worker(self, capacity):
+        worker = build_components.BuildWorker(('localhost', 0), capacity,
+                                              os.path.join(self.temp_dir, 'worker%s' % capacity))
+        threading.Thread(target=worker.serve_forever, daemon=True).start()
+        self.addCleanup(worker.close)
+        return worker
+
+
+    def start_broken_worker(self, behavior):
+        """
+        Starts a worker that accepts builds but then either disconnects or stops responding.
+        """
+        listener = multiprocessing.connection.Listener(('localhost', 0), authkey=b'secret')
+        self.addCleanup(listener.close)
+        open_connections = []
+
+        def serve():
+            with contextlib.suppress(OSError):
+                while True:
+                    conn = listener.accept()
+                    request = build_components.WorkerProtocol.receive(conn)
+                    if request['type'] == 'hello':
+                        build_components.WorkerProtocol.send(conn, {'capacity': 1})
+                    elif behavior == 'disconnect':
+                        conn.close()
+                    else:
+                        open_connections.append(conn)
+        threading.Thread(target=serve, daemon=True).start()
+        return listener.address
+
+
+    def test_components_built_on_workers(self):
+        component_dirs = [self.create_python_component('Component%s' % i) for i in range(3)]
+        # Use small chunks so that packages and sources are sent in several pieces.
+        with unittest.mock.patch.dict(os.environ, MPF_BUILD_WORKER_AUTHKEY='secret'), \
+                unittest.mock.patch.object(build_components.WorkerProtocol, 'CHUNK_SIZE', 64):
+            workers = [self.start_worker(1), self.start_worker(2)]
+            output = self.run_build(
+                '--workers', ','.join('%s:%s' % w.address for w in workers), '--send-sources',
+                '-c', ':'.join(component_dirs))
+
+        self.assertIn('Connected to build worker %s:%s with capacity 2.' % workers[1].address,
+                      output)
+        self.assertEqual(['Component0.tar.gz', 'Component1.tar.gz', 'Component2.tar.gz'],
+                         sorted(os.listdir(os.path.join(self.build_dir, 'plugin-packages'))))
+        with tarfile.open(os.path.join(self.build_dir, 'plugin-packages', 'Component1.tar.gz')) as tar:
+            self.assertIn('Component1/Component1.py', tar.getnames())
+        # Both workers received builds.
+        for worker_dir in ('worker1', 'worker2'):
+            self.assertTrue(glob.glob(os.path.join(self.temp_dir, worker_dir, 'worker-sources', '*')))
+
+
+    def test_builds_requeued_when_worker_dies(self):
+        component_dir = self.create_python_component('TestComponent')
+        with unittest.mock.patch.dict(os.environ, MPF_BUILD_WORKER_AUTHKEY='secret'), \
+                unittest.mock.patch.object(build_components.WorkerPool, 'HEARTBEAT_TIMEOUT', 0.5):
+            addresses = [self.start_broken_worker('disconnect'), self.start_broken_worker('silent'),
+                         self.start_worker(1).address]
+            output = self.run_build('--workers', ','.join('%s:%s' % a for a in addresses),
+                                    '-c', component_dir)
+
+        self.assertIn('Build worker %s:%s died while building' % addresses[0], output)
+        self.assertIn('Build worker %s:%s died while building %s: No heartbeat'
+                      % (addresses[1] + (component_dir,)), output)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.build_dir, 'plugin-packages', 'TestComponent.tar.gz')))
+
+
+    def test_source_watchers_report_changed_dirs(self):
+        src_dirs = [os.path.join(self.temp_dir, name) for name in ('component1', 'component2')]
+        for src_dir in src_dirs:
+            os.makedirs(os.path.join(src_dir, 'build'))
+        watcher_types = (build_components.InotifyWatcher, build_components.PollingWatcher)
+        for watcher_type in watcher_types:
+            with self.subTest(watcher_type.__name__), \
+                    unittest.mock.patch.object(build_components.PollingWatcher, 'POLL_INTERVAL', 0.05), \
+                    watcher_type(src_dirs, ()) as watcher:
+                # Changes to build output are ignored.
+                with open(os.path.join(src_dirs[0], 'build', 'output.o'), 'w') as f:
+                    f.write(watcher_type.__name__)
+                self.assertEqual(set(), watcher._wait_for_events(0.2))
+
+                # Directories created after the watcher started are watched.
+                new_dir = os.path.join(src_dirs[1], watcher_type.__name__)
+                os.mkdir(new_dir)
+                with open(os.path.join(new_dir, 'source.py'), 'w') as f:
+                    f.write('1')
+                self.assertEqual({src_dirs[1]}, watcher.wait_for_changes())
+                with open(os.path.join(new_dir, 'source.py'), 'w') as f:
+                    f.write('22')
+                with open(os.path.join(src_dirs[0], 'source.py'), 'w') as f:
+                    f.write('333')
+                self.assertEqual(set(src_dirs), watcher.wait_for_changes())
+
+
+    def test_watch_rebuilds_changed_projects_and_dependents(self):
+        build_counts = collections.Counter()
+        def create_project(name, dependency=None):
+            project = FakeProject(os.path.join(self.temp_dir, name), dependency=dependency)
+            os.makedirs(project.src_dir)
+            project.on_build = lambda: build_counts.update([name])
+            return project
+        sdk = create_project('sdk')
+        component = create_project('component', sdk)
+        other_component = create_project('other-component')
+        on_build_finished = unittest.mock.Mock()
+
+        output = io.StringIO()
+        with unittest.mock.patch.object(build_components.SourceWatcher, 'wait_for_changes',
+                                        side_effect=[{sdk.src_dir}, KeyboardInterrupt]), \
+                contextlib.redirect_stdout(output):
+            self.create_builder(2).watch([sdk, component, other_component], self.build_dir,
+                                         on_build_finished)
+
+        self.assertEqual({'sdk': 2, 'component': 2, 'other-component': 1}, build_counts)
+        self.assertEqual(2, on_build_finished.call_count)
+        self.assertIn('Changes detected in: ' + sdk.src_dir, output.getvalue())
+        self.assertIn('Stopped watching.', output.getvalue())
+
+
+    def test_builds_delayed_until_memory_is_available(self):
+        build_history = build_components.BuildHistory(self.build_dir)
+        builder = build_components.ProjectBuilder(
+            3, build_components.BuildManifest(self.build_dir), build_history)
+        running = []
+        max_running = []
+        def build():
+            running.append(1)
+            max_running.append(len(running))
+            time.sleep(0.2)
+            running.pop()
+        projects = [FakeProject('project%s' % i, build) for i in range(3)]
+        for project in projects:
+            build_history.record_peak_memory(project, 2 * 1024 ** 3)
+
+        monitor = build_components.ResourceMonitor(build_history, admission_control=True)
+        output = io.StringIO()
+        with unittest.mock.patch.object(build_components.ResourceMonitor, 'get_available_memory',
+                                        return_value=3 * 1024 ** 3), \
+                unittest.mock.patch.object(build_components.ResourceMonitor, 'SAMPLE_INTERVAL',
+                                           0.05), \
+                unittest.mock.patch('os.getloadavg', return_value=(0, 0, 0)), \
+                build_components.ResourceMonitor.running(monitor), \
+                contextlib.redirect_stdout(output):
+            builder.build(projects)
+
+        self.assertTrue(all(p.built for p in projects))
+        self.assertEqual(1, max(max_running))
+        self.assertIn('Waiting to start %s because it may use 2.0 GiB of memory and the running '
+                      'builds may use 2.0 GiB more, but only 3.0 GiB is available.'
+                      % projects[1].src_dir, output.getvalue())
+        # Projects that did not start any processes only use memory in this process.
+        self.assertEqual(0, build_history.get_estimated_peak_memory(projects[0]))
+
+
+    def test_peak_memory_recorded_and_memory_limited(self):
+        build_history = build_components.BuildHistory(self.build_dir)
+        def run_python(code):
+            return lambda: build_components.SubprocessUtil.check_call(
+                (sys.executable, '-c', code))
+        allocating_project = FakeProject('allocating', run_python(
+            'import time; data = bytearray(200 * 1024 ** 2); time.sleep(1)'))
+        limited_project = FakeProject('limited', run_python('bytearray(400 * 1024 ** 2)'))
+        # The limit is already in place when the command starts.
+        checking_project = FakeProject('checking', run_python(
+            'import resource; assert resource.getrlimit(resource.RLIMIT_AS)[0] == 300 * 1024 ** 2'))
+
+        monitor = build_components.ResourceMonitor(build_history, memory_limit=300 * 1024 ** 2)
+        builder = build_components.ProjectBuilder(
+            2, build_components.BuildManifest(self.build_dir), build_history,
+            failure_mode='keep-going')
+        with unittest.mock.patch.object(build_components.ResourceMonitor, 'SAMPLE_INTERVAL',
+                                        0.05), \
+                build_components.ResourceMonitor.running(monitor), \
+                contextlib.redirect_stdout(io.StringIO()), \
+                self.assertRaises(SystemExit) as cm:
+            builder.build([allocating_project, limited_project, checking_project])
+
+        self.assertTrue(allocating_project.built)
+        self.assertTrue(checking_project.built)
+        self.assertIn('An error occurred while trying to build %s' % limited_project.src_dir,
+                      str(cm.exception))
+        self.assertGreater(build_history.get_estimated_peak_memory(allocating_project),
+                           200 * 1024 ** 2)
+
+
+    def start_cache_server(self, max_size, upload_token=None):
+        server = build_components.RemoteCacheServer(
+            ('localhost', 0), os.path.join(self.temp_dir, 'remote-cache'), max_size, upload_token)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return 'http://%s:%s' % server.server_address[:2]
+
+
+    def test_packages_downloaded_from_remote_cache(self):
+        component_dir = self.create_python_component('TestComponent')
+        cache_url = self.start_cache_server(1024 * 1024)
+        output = self.run_build('--remote-cache', cache_url, '-c', component_dir)
+        self.assertIn('Build cache miss, building: ' + component_dir, output)
+
+        self.build_dir = os.path.join(self.temp_dir, 'other-build')
+        output = self.run_build('--remote-cache', cache_url, '-c', component_dir)
+        self.assertIn('Remote cache hit, downloaded: ' + component_dir, output)
+        self.assertNotIn('Build cache miss', output)
+        package = os.path.join(self.build_dir, 'plugin-packages', 'TestComponent.tar.gz')
+        with tarfile.open(package) as tar:
+            self.assertIn('TestComponent/TestComponent.py', tar.getnames())
+        # The downloaded package is recorded in the local build manifest.
+        output = self.run_build('--remote-cache', cache_url, '-c', component_dir)
+        self.assertIn('Build cache hit, skipping: ' + component_dir, output)
+
+
+    def test_reactor_components_use_remote_cache(self):
+        component_dirs = [self.create_java_component(n) for n in ('ComponentA', 'ComponentB')]
+        mvn_log = os.path.join(self.temp_dir, 'mvn.log')
+        self.create_fake_mvn(''.join(
+            'mkdir -p {0}/target/plugin-packages\n'
+            'echo package > {0}/target/plugin-packages/{1}.tar.gz\n'.format(
+                d, os.path.basename(d)) for d in component_dirs)
+            + 'echo "$@" >> %s\n' % mvn_log)
+        cache_url = self.start_cache_server(1024 * 1024)
+        args = ('--maven-reactor', '--remote-cache', cache_url, '-c', ':'.join(component_dirs))
+        self.run_build(*args)
+
+        self.build_dir = os.path.join(self.temp_dir, 'other-build')
+        output = self.run_build(*args)
+        for component_dir in component_dirs:
+            self.assertIn('Remote cache hit, downloaded: ' + component_dir, output)
+        self.assertNotIn('Build cache miss', output)
+        self.assertEqual(['ComponentA.tar.gz', 'ComponentB.tar.gz'], sorted(
+            os.listdir(os.path.join(self.build_dir, 'plugin-packages'))))
+        with open(mvn_log) as f:
+            self.assertEqual(1, len(f.read().splitlines()))
+
+
+    def test_remote_cache_key_is_the_same_on_other_hosts(self):
+        component_dir = self.create_python_component('TestComponent')
+        sdk_wheelhouse = os.path.join(self.temp_dir, 'sdk-install', 'python', 'wheelhouse')
+        os.makedirs(sdk_wheelhouse)
+        wheel_name = 'mpf_component_api-9.0-py3-none-any.whl'
+
+        def write_sdk_wheel(wheelhouse, content, date_time):
+            with zipfile.ZipFile(os.path.join(wheelhouse, wheel_name), 'w') as wheel:
+                wheel.writestr(zipfile.ZipInfo('mpf_component_api/__init__.py', date_time),
+                               content)
+
+        def get_key(build_dir):
+            cmdline_args = build_components.MpfArgumentParser.parse(
+                ['-b', build_dir, '-c', component_dir])
+            component = build_components.PythonComponent(component_dir, cmdline_args)
+            fingerprint = build_components.BuildManifest(build_dir).get_fingerprint(component)
+            return build_components.RemoteCache.get_key(component, fingerprint)
+
+        write_sdk_wheel(sdk_wheelhouse, 'api = 1', (2024, 1, 1, 0, 0, 0))
+        key = get_key(self.build_dir)
+        self.assertEqual(key, get_key(os.path.join(self.temp_dir, 'other-build')))
+
+        # The same SDK wheels built at a different time and installed in a different location.
+        other_sdk_install = os.path.join(self.temp_dir, 'other-sdk-install')
+        shutil.copytree(os.path.join(self.temp_dir, 'sdk-install'), other_sdk_install)
+        other_wheelhouse = os.path.join(other_sdk_install, 'python', 'wheelhouse')
+        write_sdk_wheel(other_wheelhouse, 'api = 1', (2025, 6, 1, 12, 0, 0))
+        os.utime(other_wheelhouse, (0, 0))
+        with unittest.mock.patch.dict(os.environ, MPF_SDK_INSTALL_PATH=other_sdk_install):
+            self.assertEqual(key, get_key(os.path.join(self.temp_dir, 'other-build')))
+
+            # The SDK was changed without changing its version.
+            write_sdk_wheel(other_wheelhouse, 'api = 2', (2025, 6, 1, 12, 0, 0))
+            os.utime(os.path.join(other_wheelhouse, wheel_name), (1, 1))
+            self.assertNotEqual(key, get_key(os.path.join(self.temp_dir, 'other-build')))
+
+        with open(os.path.join(component_dir, 'TestComponent.py'), 'a') as f:
+            f.write('print("changed")\n')
+        self.assertNotEqual(key, get_key(self.build_dir))
+
+
+    def test_remote_cache_key_ignores_jar_build_metadata(self):
+        sdk_dir = os.path.join(self.temp_dir, 'sdk')
+        os.makedirs(sdk_dir)
+        jar_path = os.path.join(sdk_dir, 'mpf-java-component-api-9.0.jar')
+
+        def write_jar(class_bytes, build_time):
+            with zipfile.ZipFile(jar_path, 'w') as jar:
+                jar.writestr('META-INF/MANIFEST.MF', 'Build-Time: %s\n' % build_time)
+                jar.writestr('META-INF/maven/org.mitre.mpf/api/pom.properties',
+                             '#%s\nversion=9.0\n' % build_time)
+                jar.writestr('org/mitre/mpf/Api.class', class_bytes)
+
+        def hash_sdk():
+            return build_components.Fingerprint.hash_tree_contents(
+                sdk_dir, zip_suffixes=('.jar',),
+                excluded_zip_entries=('MANIFEST.MF', 'pom.properties'))
+
+        write_jar(b'class v1', 'Mon Jan 1 2024')
+        digest = hash_sdk()
+        write_jar(b'class v1', 'Tue Jan 2 2024')
+        os.utime(jar_path, (1, 1))
+        self.assertEqual(digest, hash_sdk())
+        write_jar(b'class v2', 'Tue Jan 2 2024')
+        os.utime(jar_path, (2, 2))
+        self.assertNotEqual(digest, hash_sdk())
+
+
+    def test_remote_cache_server_evicts_least_recently_used(self):
+        cache_url = self.start_cache_server(250)
+
+        def put(key, size):
+            request = urllib.request.Request('%s/%s' % (cache_url, key * 64), data=b'x' * size,
+                                             method='PUT')
+            with urllib.request.urlopen(request) as response:
+                return response.status
+
+        def get(key):
+            try:
+                with urllib.request.urlopen('%s/%s' % (cache_url, key * 64)) as response:
+                    return len(response.read())
+            except urllib.error.HTTPError as err:
+                return err.code
+
+        self.assertEqual(201, put('a', 100))
+        self.assertEqual(201, put('b', 100))
+        self.assertEqual(100, get('a'))
+        self.assertEqual(201, put('c', 100))
+        self.assertEqual(404, get('b'))
+        self.assertEqual(100, get('a'))
+        self.assertEqual(100, get('c'))
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            put('d', 300)
+        self.assertEqual(413, context.exception.code)
+        self.assertEqual(['a' * 64, 'c' * 64], sorted(os.listdir(
+            os.path.join(self.temp_dir, 'remote-cache'))))
+
+    def test_remote_cache_uploads_require_token(self):
+        component_dir = self.create_python_component('TestComponent')
+        cache_url = self.start_cache_server(1024 * 1024, upload_token='secret')
+
+        with unittest.mock.patch.dict(os.environ, MPF_REMOTE_CACHE_TOKEN='wrong'):
+            output = self.run_build('--remote-cache', cache_url, '-c', component_dir)
+        self.assertIn('Unable to upload', output)
+        self.assertEqual([], os.listdir(os.path.join(self.temp_dir, 'remote-cache')))
+
+        with unittest.mock.patch.dict(os.environ, MPF_REMOTE_CACHE_TOKEN='secret'):
+            output = self.run_build('--remote-cache', cache_url, '--force-rebuild',
+                                    '-c', component_dir)
+        self.assertNotIn('Unable to upload', output)
+        self.assertEqual(1, len(os.listdir(os.path.join(self.temp_dir, 'remote-cache'))))
+
+    def test_worker_errors_fail_build_without_requeueing(self):
+        class UnknownComponent(build_components.PythonComponent):
+            pass
+        component_dir = self.create_python_component('TestComponent')
+        cmdline_args = build_components.MpfArgumentParser.parse(
+            ['-b', self.build_dir, '-c', component_dir, '--send-sources'])
+        with unittest.mock.patch.dict(os.environ, MPF_BUILD_WORKER_AUTHKEY='secret'), \
+                contextlib.redirect_stdout(io.StringIO()) as output:
+            workers = [self.start_worker(1), self.start_worker(2)]
+            cmdline_args.workers = [w.address for w in workers]
+            pool = build_components.WorkerPool.connect(cmdline_args)
+            component = UnknownComponent(component_dir, cmdline_args)
+            with build_components.WorkerPool.running(pool), \
+                    build_components.Files.create_temp_dir() as staging_dir, \
+                    self.assertRaises(Exception) as cm:
+                build_components.WorkerPool.build_remotely(component, staging_dir)
+
+        self.assertIn("KeyError: 'UnknownComponent'", str(cm.exception))
+        self.assertNotIn('died', output.getvalue())
+        self.assertTrue(all(w['alive'] for w in pool._workers))
+
+
+class FakeProject(build_components.MpfProject):
+    def __init__(self, name, build_func=lambda: None, dependency=None):
+        super(FakeProject, self).__init__(name)
+        self.src_dir = name
+        self._build_func = build_func
+        self._dependency = dependency
+        self.on_build = lambda: None
+        self.built = False
+
+    def build(self):
+        self._build_func()
+        self.on_build()
+        self.built = True
+
+    def depends_on(self, project):
+        return project is self._dependency
+
+
+
+if __name__ == '__main__':
+    unittest.main()